@@ -0,0 +1,190 @@
+"""Scheduling and firing rates of the reminder timers and the time to load a window of reminders.
+
+Run from the `src` directory:
+
+    python -m benchmarks.bench_reminders --timers 1000000 --rows 300000
+
+The timer wheel is compared to a binary heap with lazy cancelling, the usual alternative. Both get timers
+spread over `--horizon` seconds, cancel a tenth of them and are advanced tick by tick to fire the rest.
+The scheduler case fires timers due at the same moment through `TimerScheduler` and its worker threads.
+The window case fills the `todos` table with due dates spread over a month and loads an hour of them
+with and without the `due_at` index.
+"""
+import argparse
+import heapq
+import os
+import random
+import sys
+import tempfile
+import threading
+from datetime import datetime, timedelta
+from statistics import median
+from time import perf_counter, time
+
+from sqlalchemy import insert
+
+from core.state_machine import TimerScheduler, TimerWheel
+
+
+class HeapTimers:
+    """Binary heap of timers, a cancelled or rescheduled timer stays in the heap until it is popped."""
+
+    def __init__(self):
+        self._heap: list[tuple[float, int]] = []
+        self._deadlines: dict[int, float] = {}
+
+    def schedule(self, key: int, deadline: float) -> None:
+        self._deadlines[key] = deadline
+        heapq.heappush(self._heap, (deadline, key))
+
+    def cancel(self, key: int) -> bool:
+        return self._deadlines.pop(key, None) is not None
+
+    def advance(self, now: float) -> list[tuple[int, float]]:
+        expired = []
+        while self._heap and self._heap[0][0] <= now:
+            deadline, key = heapq.heappop(self._heap)
+            if self._deadlines.get(key) == deadline:
+                del self._deadlines[key]
+                expired.append((key, deadline))
+        return expired
+
+
+def run_timers_case(timers, deadlines: list[float], tick: float, horizon: float) -> dict:
+    started_at = perf_counter()
+    for key, deadline in enumerate(deadlines):
+        timers.schedule(key, deadline)
+    schedule_seconds = perf_counter() - started_at
+
+    cancelled_keys = range(0, len(deadlines), 10)
+    started_at = perf_counter()
+    for key in cancelled_keys:
+        timers.cancel(key)
+    cancel_seconds = perf_counter() - started_at
+
+    fired = 0
+    started_at = perf_counter()
+    now = 0.0
+    while now <= horizon + tick:
+        now += tick
+        fired += len(timers.advance(now))
+    fire_seconds = perf_counter() - started_at
+
+    return {
+        'schedules_per_second': len(deadlines) / schedule_seconds,
+        'cancels_per_second': len(cancelled_keys) / cancel_seconds,
+        'fires_per_second': fired / fire_seconds,
+        'fired': fired,
+    }
+
+
+def run_scheduler_case(timers: int) -> dict:
+    fired = 0
+    lock = threading.Lock()
+    all_fired = threading.Event()
+
+    def on_expired(_):
+        nonlocal fired
+        with lock:
+            fired += 1
+            if fired == timers:
+                all_fired.set()
+
+    with TimerScheduler.setup(on_expired, tick=0.01) as scheduler:
+        due_at = time() + 1
+        started_at = perf_counter()
+        for key in range(timers):
+            scheduler.schedule(key, due_at)
+        schedule_seconds = perf_counter() - started_at
+        all_fired.wait(timeout=60)
+        fire_seconds = time() - due_at
+    return {
+        'schedules_per_second': timers / schedule_seconds,
+        'fires_per_second': fired / max(fire_seconds, 1e-9),
+        'fired': fired,
+    }
+
+
+def run_window_case(rows: int, queries: int) -> list[dict]:
+    from bot.repositories import Todo, get_engine, session_scope
+
+    started = datetime(2024, 1, 1)
+    month = timedelta(days=30).total_seconds()
+    with session_scope() as session:
+        session.execute(insert(Todo), [
+            {
+                'title': f'Todo {row}',
+                'content': '',
+                'is_done': False,
+                'tg_user_id': row % 1000,
+                'due_at': started + timedelta(seconds=random.uniform(0, month)),
+            }
+            for row in range(rows)
+        ])
+
+    engine = get_engine()
+    index = next(index for index in Todo.__table__.indexes if index.name == 'ix_todos_due_at')
+    results = []
+    for indexed in (True, False):
+        if not indexed:
+            index.drop(engine)
+        timings = []
+        loaded = 0
+        for _ in range(queries):
+            since = started + timedelta(seconds=random.uniform(0, month))
+            query_started_at = perf_counter()
+            loaded = len(Todo.get_reminders(since, since + timedelta(hours=1)))
+            timings.append(perf_counter() - query_started_at)
+        results.append({'indexed': indexed, 'load_ms': median(timings) * 1000, 'reminders': loaded})
+    index.create(engine)
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--timers', type=int, default=1_000_000)
+    parser.add_argument('--horizon', type=float, default=86_400, help='timers are due within it, seconds')
+    parser.add_argument('--tick', type=float, default=1)
+    parser.add_argument('--scheduler-timers', type=int, default=100_000)
+    parser.add_argument('--rows', type=int, default=300_000, help='todos with due dates in the window case')
+    parser.add_argument('--queries', type=int, default=20, help='window loads per measurement')
+    args = parser.parse_args()
+
+    random.seed(1)
+    deadlines = [random.uniform(0, args.horizon) for _ in range(args.timers)]
+    print(f'{"timers":<12}{"schedule/s":>14}{"cancel/s":>14}{"fire/s":>14}{"fired":>10}')
+    for name, timers in (
+            ('wheel', TimerWheel(tick=args.tick, now=0)),
+            ('heap', HeapTimers()),
+    ):
+        result = run_timers_case(timers, deadlines, args.tick, args.horizon)
+        print(
+            f'{name:<12}{result["schedules_per_second"]:>14,.0f}{result["cancels_per_second"]:>14,.0f}'
+            f'{result["fires_per_second"]:>14,.0f}{result["fired"]:>10}',
+        )
+
+    result = run_scheduler_case(args.scheduler_timers)
+    print(
+        f'{"scheduler":<12}{result["schedules_per_second"]:>14,.0f}{"":>14}'
+        f'{result["fires_per_second"]:>14,.0f}{result["fired"]:>10}',
+    )
+
+    working_directory = os.getcwd()
+    # Keep the source directory importable after leaving it
+    sys.path.insert(0, working_directory)
+    with tempfile.TemporaryDirectory() as directory:
+        # Bot models create the database on import, the benchmark runs on a fresh one
+        os.chdir(directory)
+        print(f'\n{"rows":>8}{"index":>7}{"load 1h ms":>12}{"reminders":>11}')
+        for result in run_window_case(args.rows, args.queries):
+            print(
+                f'{args.rows:>8}{"yes" if result["indexed"] else "no":>7}{result["load_ms"]:>12.2f}'
+                f'{result["reminders"]:>11}',
+            )
+        from bot.repositories import get_engine
+        get_engine().dispose()
+        os.chdir(working_directory)
+
+
+if __name__ == '__main__':
+    main()
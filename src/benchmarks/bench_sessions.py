@@ -0,0 +1,92 @@
+"""Access rate and memory of the in-memory session repository with and without eviction.
+
+Run from the `src` directory:
+
+    python -m benchmarks.bench_sessions --users 200000 --accesses 1000000
+
+Users come and go: every access is a locator read and most of them a locator save, users are picked with
+a Zipf-like skew, so a few users are active and most are seen a few times. The unbounded case keeps every
+session, the bounded cases keep at most `--max-users` sessions or the sessions accessed within the last
+`--ttl` seconds. Memory is the estimate of the repository and the peak traced by tracemalloc in a second,
+untimed run of the case.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import tracemalloc
+from functools import partial
+from time import perf_counter
+
+from core.state_machine import Locator
+
+
+def access_sessions(repository, user_ids: list[int], locators: list[Locator]) -> None:
+    for user_id, locator in zip(user_ids, locators):
+        if repository.get_locator_by_user_id(user_id) is None or locator.params:
+            repository.save_user_locator(user_id, locator)
+
+
+def run_case(make_repository, user_ids: list[int], locators: list[Locator]) -> dict:
+    repository = make_repository()
+    started_at = perf_counter()
+    access_sessions(repository, user_ids, locators)
+    seconds = perf_counter() - started_at
+    stats = repository.get_stats()
+
+    tracemalloc.start()
+    access_sessions(make_repository(), user_ids, locators)
+    _, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'accesses_per_second': len(user_ids) / seconds,
+        'hit_rate': stats.hits / max(stats.hits + stats.misses, 1),
+        'users': stats.users,
+        'evicted': stats.evictions + stats.expirations,
+        'approx_mb': stats.approx_bytes / 2 ** 20,
+        'peak_mb': peak_bytes / 2 ** 20,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=200_000)
+    parser.add_argument('--accesses', type=int, default=1_000_000)
+    parser.add_argument('--max-users', type=int, default=20_000)
+    parser.add_argument('--ttl', type=float, default=0.5, help='seconds')
+    args = parser.parse_args()
+
+    working_directory = os.getcwd()
+    # Keep the source directory importable after leaving it
+    sys.path.insert(0, working_directory)
+    with tempfile.TemporaryDirectory() as directory:
+        # Bot models create the database on import, it is not used here
+        os.chdir(directory)
+        from bot.repositories import MemorySessionRepository, get_engine
+        get_engine().dispose()
+        os.chdir(working_directory)
+
+    random.seed(1)
+    user_ids = [int(args.users * random.random() ** 3) for _ in range(args.accesses)]
+    locators = [
+        Locator('/todo/', {'todo_id': access % 1000}) if access % 4 else Locator('/')
+        for access in range(args.accesses)
+    ]
+
+    print(f'{"case":<12}{"access/s":>12}{"hit rate":>10}{"users":>9}{"evicted":>10}{"approx MB":>11}{"peak MB":>9}')
+    for name, make_repository in (
+            ('unbounded', MemorySessionRepository),
+            ('max_users', partial(MemorySessionRepository, max_users=args.max_users)),
+            ('ttl', partial(MemorySessionRepository, ttl=args.ttl)),
+    ):
+        result = run_case(make_repository, user_ids, locators)
+        print(
+            f'{name:<12}{result["accesses_per_second"]:>12,.0f}{result["hit_rate"]:>10.1%}{result["users"]:>9}'
+            f'{result["evicted"]:>10}{result["approx_mb"]:>11.1f}{result["peak_mb"]:>9.1f}',
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+"""Write throughput of the todo repository on SQLite under concurrent handlers, per pragma profile.
+
+Writer threads add todos in transactions of their own as `AddTodoContentState` does, reader threads list todos of
+the same users meanwhile. Every profile runs on a fresh database file, with `--group-commit` once more
+with writes committed by the group commit writer. Run from the `src` directory:
+
+    python -m benchmarks.bench_sqlite_writes --writers 8 --readers 4 --seconds 5 --output sqlite_writes.json
+"""
+import argparse
+import contextvars
+import json
+import os
+import sys
+import tempfile
+import threading
+from functools import partial
+from inspect import unwrap
+from statistics import quantiles
+from time import perf_counter
+
+from sqlalchemy.exc import OperationalError
+
+
+def get_percentiles(values: list[float]) -> dict[str, float]:
+    if len(values) < 2:
+        return {'p50_ms': 0, 'p99_ms': 0}
+    percentiles = quantiles(values, n=100)
+    return {'p50_ms': round(percentiles[49] * 1000, 3), 'p99_ms': round(percentiles[98] * 1000, 3)}
+
+
+class Worker(threading.Thread):
+
+    def __init__(self, operation, user_id: int, deadline: float):
+        super().__init__(daemon=True)
+        self.operation = operation
+        self.user_id = user_id
+        self.deadline = deadline
+        self.latencies = []
+        self.errors = 0
+        # The thread sees the default group commit writer
+        self.context = contextvars.copy_context()
+
+    def run(self) -> None:
+        while perf_counter() < self.deadline:
+            started_at = perf_counter()
+            try:
+                self.context.run(self.operation, self.user_id)
+            except OperationalError:
+                # Database is locked longer than the busy timeout
+                self.errors += 1
+                continue
+            self.latencies.append(perf_counter() - started_at)
+
+
+def run_profile(profile: str, path: str, args, *, group_commit: bool = False) -> dict:
+    from bot.repositories import GroupCommitWriter, Todo, configure, get_sqlite_pragmas
+    from bot.repositories.models import upgrade_schema
+
+    engine = configure(f'sqlite:///{path}', sqlite_pragmas=get_sqlite_pragmas(profile))
+    upgrade_schema(engine)
+
+    def add_todo(user_id: int) -> None:
+        Todo.create_for_user(user_id, 'Buy milk', 'Two bottles, 2.5%')
+
+    # Readers go to the database, not to the cache of todo lists
+    list_todos = partial(unwrap(Todo.get_active_for_user.__func__), Todo)
+
+    writer = GroupCommitWriter(max_batch_size=args.max_batch_size, max_delay=args.max_delay) if group_commit else None
+    if writer:
+        writer.start()
+        default_writer_token = GroupCommitWriter.default_writer.set(writer)
+
+    deadline = perf_counter() + args.seconds
+    writers = [Worker(add_todo, user_id, deadline) for user_id in range(args.writers)]
+    readers = [Worker(list_todos, user_id, deadline) for user_id in range(args.readers)]
+    for worker in [*writers, *readers]:
+        worker.start()
+    for worker in [*writers, *readers]:
+        worker.join()
+
+    if writer:
+        GroupCommitWriter.default_writer.reset(default_writer_token)
+        writer.stop()
+    engine.dispose()
+
+    write_latencies = [latency for writer in writers for latency in writer.latencies]
+    read_latencies = [latency for reader in readers for latency in reader.latencies]
+    return {
+        'profile': profile,
+        'group_commit': group_commit,
+        'mean_batch_size': round(writer.get_stats().mean_batch_size, 1) if writer else 1,
+        'writes_per_second': round(len(write_latencies) / args.seconds, 1),
+        'write': get_percentiles(write_latencies),
+        'write_errors': sum(writer.errors for writer in writers),
+        'reads_per_second': round(len(read_latencies) / args.seconds, 1),
+        'read': get_percentiles(read_latencies),
+        'read_errors': sum(reader.errors for reader in readers),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--profiles', nargs='+', help='pragma profiles to compare, all by default')
+    parser.add_argument('--writers', type=int, default=8)
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--group-commit', action='store_true', help='also run every profile with group commit')
+    parser.add_argument('--max-batch-size', type=int, default=128)
+    parser.add_argument('--max-delay', type=float, default=0.005, help='group commit delay, seconds')
+    parser.add_argument('--output', help='path of the JSON report')
+    args = parser.parse_args()
+
+    output_path = os.path.abspath(args.output) if args.output else None
+    working_directory = os.getcwd()
+    # Keep the source directory importable after leaving it
+    sys.path.insert(0, working_directory)
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        # Bot repositories create the database on import, it is left in the temporary directory
+        os.chdir(directory)
+        from bot.repositories import SQLITE_PROFILES
+
+        print(
+            f'{"profile":<10}{"group":>6}{"writes/s":>10}{"p50 ms":>9}{"p99 ms":>9}{"errors":>8}{"batch":>7}'
+            f'{"reads/s":>10}{"p99 ms":>9}',
+        )
+        for profile in args.profiles or SQLITE_PROFILES:
+            for group_commit in (False, True) if args.group_commit else (False,):
+                path = os.path.join(directory, f'{profile}{"_group" if group_commit else ""}.db')
+                result = run_profile(profile, path, args, group_commit=group_commit)
+                results.append(result)
+                print(
+                    f'{profile:<10}{"yes" if group_commit else "no":>6}{result["writes_per_second"]:>10.0f}'
+                    f'{result["write"]["p50_ms"]:>9.2f}{result["write"]["p99_ms"]:>9.2f}{result["write_errors"]:>8}'
+                    f'{result["mean_batch_size"]:>7.1f}{result["reads_per_second"]:>10.0f}'
+                    f'{result["read"]["p99_ms"]:>9.2f}',
+                )
+        os.chdir(working_directory)
+
+    if output_path:
+        with open(output_path, 'w') as file:
+            json.dump({'benchmark': 'sqlite_writes', 'results': results}, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
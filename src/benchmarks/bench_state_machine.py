@@ -0,0 +1,265 @@
+"""End-to-end benchmark of the todo bot: user scripts are replayed through `state_machine.process`.
+
+Telegram is replaced by the in-process fake Bot API, the database is a fresh SQLite file in a temporary
+directory. Every simulated user opens the bot, adds todos, pages the list, marks a todo as done, edits,
+searches and deletes one. Run from the `src` directory:
+
+    python -m benchmarks.bench_state_machine --users 20 --output state_machine.json
+
+The JSON report holds updates per second, latency percentiles, DB queries and allocated memory per update,
+overall and per state class, to compare the results across commits.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import tracemalloc
+from collections import defaultdict
+from contextlib import AbstractContextManager, nullcontext, redirect_stdout
+from itertools import zip_longest
+from statistics import fmean, quantiles
+from time import perf_counter
+
+import httpx
+from sqlalchemy import event
+
+from core.tg_api import SyncTgClient, Update
+
+from .fake_api import FakeBotApi, get_callback_data
+
+TODO_BUTTON = '<todo>'
+
+SCRIPTS = {
+    'start': [('text', '/start')],
+    'add_todo': [('press', 'add'), ('text', 'Buy milk'), ('text', 'Two bottles, 2.5%')],
+    'paging': [('press', 'page#2'), ('press', 'page#1')],
+    'mark_done': [('press', TODO_BUTTON), ('press', 'done')],
+    'edit': [
+        ('press', TODO_BUTTON),
+        ('press', 'edit'),
+        ('press', 'edit_title'),
+        ('text', 'Buy kefir'),
+        ('press', 'edit'),
+        ('press', 'edit_content'),
+        ('text', 'One bottle'),
+        ('press', 'back'),
+    ],
+    'delete': [('press', TODO_BUTTON), ('press', 'delete')],
+    'search': [('text', '/search'), ('text', 'kefir'), ('text', 'milk'), ('press', TODO_BUTTON), ('press', 'back')],
+}
+
+
+def make_user_journey(todos: int) -> list[tuple[str, str]]:
+    return [
+        *SCRIPTS['start'],
+        *SCRIPTS['add_todo'] * todos,
+        *SCRIPTS['paging'],
+        *SCRIPTS['mark_done'],
+        *SCRIPTS['edit'],
+        *SCRIPTS['search'],
+        *SCRIPTS['delete'],
+    ]
+
+
+def get_percentiles(values: list[float]) -> dict[str, float]:
+    if len(values) < 2:
+        return {'p50_ms': 0, 'p95_ms': 0, 'p99_ms': 0}
+    percentiles = quantiles(values, n=100)
+    return {f'p{n}_ms': round(percentiles[n - 1] * 1000, 3) for n in (50, 95, 99)}
+
+
+def get_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            capture_output=True,
+            check=True,
+            text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class StateMachineBenchmark:
+
+    def __init__(self, *, users: int, todos: int):
+        # Bot modules create the database on import, so they are imported in the working directory of the run
+        from bot import state_machine
+        from bot.repositories import get_engine
+
+        self.state_machine = state_machine
+        self.users = users
+        self.todos = todos
+        self.api = FakeBotApi()
+        self.client = SyncTgClient(
+            'token',
+            session=httpx.Client(transport=self.api.make_transport()),
+            retry_policy=None,
+        )
+        self.queries = 0
+        event.listen(get_engine(), 'before_cursor_execute', self._count_query)
+
+    def run(self, *, first_user_id: int, trace_allocations: bool = False) -> list[dict]:
+        """Replay journeys of the users interleaving their steps. Return measurements of every update."""
+        journeys = [
+            [(user_id, step) for step in make_user_journey(self.todos)]
+            for user_id in range(first_user_id, first_user_id + self.users)
+        ]
+        measurements = []
+        with (
+            self.client.set_as_default(),
+            self.start_session_writer(),
+            open(os.devnull, 'w') as devnull,
+            redirect_stdout(devnull),
+        ):
+            for steps in zip_longest(*journeys):
+                for user_id, step in filter(None, steps):
+                    if update := self.make_update(user_id, *step):
+                        measurements.append(self.process(update, trace_allocations))
+        return measurements
+
+    def start_session_writer(self) -> AbstractContextManager:
+        from bot.repositories import SqlSessionRepository
+
+        session_repository = self.state_machine.session_repository
+        if not isinstance(session_repository, SqlSessionRepository):
+            return nullcontext()
+        return session_repository.write_behind()
+
+    def make_update(self, user_id: int, action: str, value: str) -> Update | None:
+        if action == 'text':
+            return Update.parse_obj({'update_id': 0, **self.api.make_message_update(user_id, value)})
+
+        message = self.api.get_keyboard_message(user_id)
+        callback_data = get_callback_data(message) if message else []
+        if value == TODO_BUTTON:
+            callback_data = [data for data in callback_data if data.isdigit()]
+        elif value not in callback_data:
+            callback_data = []
+        if not callback_data:
+            return None
+        data = callback_data[0] if value == TODO_BUTTON else value
+        return Update.parse_obj({'update_id': 0, **self.api.make_callback_query_update(user_id, message, data)})
+
+    def process(self, update: Update, trace_allocations: bool) -> dict:
+        state_name = self.get_handling_state_name(update)
+        queries_before = self.queries
+        if trace_allocations:
+            tracemalloc.reset_peak()
+            memory_before, _ = tracemalloc.get_traced_memory()
+
+        error = False
+        started_at = perf_counter()
+        try:
+            self.state_machine.process(update)
+        except Exception:
+            error = True
+        elapsed = perf_counter() - started_at
+
+        measurement = {'state': state_name, 'seconds': elapsed, 'queries': self.queries - queries_before}
+        if trace_allocations:
+            memory_after, memory_peak = tracemalloc.get_traced_memory()
+            measurement['peak_bytes'] = memory_peak - memory_before
+            measurement['net_bytes'] = memory_after - memory_before
+        measurement['error'] = error
+        return measurement
+
+    def get_handling_state_name(self, update: Update) -> str:
+        locator = self.state_machine.get_locator_from_command(update)
+        locator = locator or self.state_machine.session_repository.get_locator_by_user_id(update.chat_id)
+        locator = locator or self.state_machine.start_state_locator
+        return self.state_machine.state_router[locator.state_name].__name__
+
+    def _count_query(self, *args) -> None:
+        self.queries += 1
+
+
+def get_mean(rows: list[dict], key: str) -> float:
+    return round(fmean(row[key] for row in rows), 3) if rows else 0
+
+
+def make_report(timings: list[dict], allocations: list[dict], elapsed: float, args) -> dict:
+    def summarize(timing_rows: list[dict], allocation_rows: list[dict]) -> dict:
+        return {
+            'updates': len(timing_rows),
+            **get_percentiles([row['seconds'] for row in timing_rows]),
+            'db_queries_per_update': get_mean(timing_rows, 'queries'),
+            'alloc_peak_bytes_per_update': round(get_mean(allocation_rows, 'peak_bytes')),
+            'alloc_net_bytes_per_update': round(get_mean(allocation_rows, 'net_bytes')),
+        }
+
+    timings_by_state = defaultdict(list)
+    allocations_by_state = defaultdict(list)
+    for row in timings:
+        timings_by_state[row['state']].append(row)
+    for row in allocations:
+        allocations_by_state[row['state']].append(row)
+
+    return {
+        'benchmark': 'state_machine',
+        'commit': get_commit(),
+        'python': platform.python_version(),
+        'params': {'users': args.users, 'todos': args.todos, 'session_store': args.session_store},
+        'updates_per_second': round(len(timings) / elapsed, 1),
+        'errors': sum(row['error'] for row in timings),
+        **summarize(timings, allocations),
+        'states': {
+            state_name: summarize(rows, allocations_by_state[state_name])
+            for state_name, rows in sorted(timings_by_state.items())
+        },
+    }
+
+
+def print_report(report: dict) -> None:
+    print(f'{report["updates"]} updates, {report["updates_per_second"]} updates/s, {report["errors"]} errors')
+    print(f'{"state":<24}{"updates":>8}{"p50 ms":>9}{"p95 ms":>9}{"p99 ms":>9}{"queries":>9}{"peak KiB":>10}')
+    for state_name, row in [('all', report), *report['states'].items()]:
+        print(
+            f'{state_name:<24}{row["updates"]:>8}{row["p50_ms"]:>9.2f}{row["p95_ms"]:>9.2f}{row["p99_ms"]:>9.2f}'
+            f'{row["db_queries_per_update"]:>9.2f}{row["alloc_peak_bytes_per_update"] / 1024:>10.1f}',
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--todos', type=int, default=8, help='todos added by every user, 7+ to get two pages')
+    parser.add_argument('--session-store', choices=['memory', 'db'], default='memory')
+    parser.add_argument('--output', help='path of the JSON report, - for stdout')
+    args = parser.parse_args()
+    os.environ['BOT_SESSION_STORE'] = args.session_store
+
+    output_path = os.path.abspath(args.output) if args.output and args.output != '-' else args.output
+    working_directory = os.getcwd()
+    # Keep the source directory importable after leaving it
+    sys.path.insert(0, working_directory)
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        benchmark = StateMachineBenchmark(users=args.users, todos=args.todos)
+
+        started_at = perf_counter()
+        timings = benchmark.run(first_user_id=1)
+        elapsed = perf_counter() - started_at
+
+        # Allocations are traced in a separate pass by other users, tracing slows the code down several times
+        tracemalloc.start()
+        allocations = benchmark.run(first_user_id=args.users + 1, trace_allocations=True)
+        tracemalloc.stop()
+        os.chdir(working_directory)
+
+    report = make_report(timings, allocations, elapsed, args)
+    if output_path == '-':
+        print(json.dumps(report, indent=2))
+        return
+    print_report(report)
+    if output_path:
+        with open(output_path, 'w') as file:
+            json.dump(report, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
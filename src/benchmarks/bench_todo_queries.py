@@ -0,0 +1,97 @@
+"""Time of the per-user todo queries as the `todos` table grows, with and without the composite index.
+
+The table is filled with todos of many users, every user has about `--todos-per-user` todos and a third of
+them is done. Run from the `src` directory:
+
+    python -m benchmarks.bench_todo_queries --rows 1000 10000 100000 300000 --output todo_queries.json
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+from functools import partial
+from inspect import unwrap
+from statistics import median
+from time import perf_counter
+
+from sqlalchemy import insert
+
+
+def fill_table(session, todo_model, rows: int, todos_per_user: int, first_id: int) -> None:
+    batch = [
+        {
+            'title': f'Todo {todo_id}',
+            'content': 'Lorem ipsum dolor sit amet',
+            'is_done': todo_id % 3 == 0,
+            'tg_user_id': todo_id // todos_per_user,
+        }
+        for todo_id in range(first_id, first_id + rows)
+    ]
+    session.execute(insert(todo_model), batch)
+
+
+def time_query(query, user_ids: list[int]) -> float:
+    """Return the median time of the query in milliseconds."""
+    timings = []
+    for user_id in user_ids:
+        started_at = perf_counter()
+        query(user_id)
+        timings.append(perf_counter() - started_at)
+    return median(timings) * 1000
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, nargs='+', default=[1_000, 10_000, 100_000, 300_000])
+    parser.add_argument('--todos-per-user', type=int, default=20)
+    parser.add_argument('--queries', type=int, default=200, help='queries of random users per measurement')
+    parser.add_argument('--output', help='path of the JSON report')
+    args = parser.parse_args()
+
+    output_path = os.path.abspath(args.output) if args.output else None
+    working_directory = os.getcwd()
+    # Keep the source directory importable after leaving it
+    sys.path.insert(0, working_directory)
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        # Bot models create the database on import, the benchmark runs on a fresh one
+        os.chdir(directory)
+        from bot.repositories import Todo, get_engine, session_scope
+
+        engine = get_engine()
+        index = next(index for index in Todo.__table__.indexes if index.name == 'ix_todos_tg_user_id_is_done_id')
+
+        # Measure the queries, not the caches in front of them
+        queries = {
+            name: partial(unwrap(getattr(Todo, name).__func__), Todo)
+            for name in ('get_active_for_user', 'get_all_for_user')
+        }
+        print(f'{"rows":>8}{"index":>7}' + ''.join(f'{name + " ms":>24}' for name in queries))
+        row_count = 0
+        for rows in sorted(args.rows):
+            with session_scope() as session:
+                fill_table(session, Todo, rows - row_count, args.todos_per_user, first_id=row_count + 1)
+            row_count = rows
+            user_ids = [random.randint(0, rows // args.todos_per_user) for _ in range(args.queries)]
+
+            for indexed in (True, False):
+                if not indexed:
+                    index.drop(engine)
+                timings = {name: time_query(query, user_ids) for name, query in queries.items()}
+                results.append({'rows': rows, 'indexed': indexed, **{f'{name}_ms': t for name, t in timings.items()}})
+                print(f'{rows:>8}{"yes" if indexed else "no":>7}' + ''.join(f'{t:>24.3f}' for t in timings.values()))
+
+            index.create(engine)
+
+        engine.dispose()
+        os.chdir(working_directory)
+
+    if output_path:
+        with open(output_path, 'w') as file:
+            json.dump({'benchmark': 'todo_queries', 'results': results}, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
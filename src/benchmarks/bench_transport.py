@@ -0,0 +1,122 @@
+"""Outbound send throughput of the Telegram client while a long poll is in flight.
+
+Run from the `src` directory:
+
+    python -m benchmarks.bench_transport --senders 8 --messages 800 --latency 0.05 --poll-timeout 8
+
+Compares the session used before transport configuration (a bare `httpx.Client()`), a tuned pool shared
+with the long poll and the tuned pool with a dedicated polling connection. A long poll longer than
+the default read timeout of httpx fails and reconnects, a poll sharing the pool takes a connection from
+the senders.
+"""
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from statistics import quantiles
+from time import perf_counter
+
+import httpx
+
+from core.tg_api import GetUpdatesRequest, SendMessageRequest, SyncTgClient, TransportConfig
+
+from .fake_api import FakeBotApi
+
+
+def poll_updates(client: SyncTgClient, stopped: threading.Event, poll_timeout: int) -> int:
+    """Keep a long poll running until stopped. Return the number of failed polls."""
+    errors = 0
+    with client.set_as_default():
+        while not stopped.is_set():
+            try:
+                list(GetUpdatesRequest(timeout=poll_timeout).send())
+            except httpx.HTTPError:
+                errors += 1
+    return errors
+
+
+def send_messages(client: SyncTgClient, chat_ids: range) -> tuple[list[float], int]:
+    latencies = []
+    errors = 0
+    with client.set_as_default():
+        for chat_id in chat_ids:
+            started_at = perf_counter()
+            try:
+                SendMessageRequest(chat_id=chat_id, text='Hello!').send()
+            except httpx.HTTPError:
+                errors += 1
+                continue
+            latencies.append(perf_counter() - started_at)
+    return latencies, errors
+
+
+def run_case(api: FakeBotApi, session: httpx.Client, polling_session: httpx.Client | None, args) -> dict:
+    api.reset_stats()
+    client = SyncTgClient(
+        'token',
+        session=session,
+        polling_session=polling_session,
+        tg_server_url=api.url,
+        retry_policy=None,
+    )
+    stopped = threading.Event()
+    with ThreadPoolExecutor(args.senders + 1) as executor:
+        poller = executor.submit(poll_updates, client, stopped, args.poll_timeout)
+        started_at = perf_counter()
+        messages_per_sender = args.messages // args.senders
+        senders = [
+            executor.submit(send_messages, client, range(first_chat_id, first_chat_id + messages_per_sender))
+            for first_chat_id in range(0, messages_per_sender * args.senders, messages_per_sender)
+        ]
+        results = [sender.result() for sender in senders]
+        elapsed = perf_counter() - started_at
+        stopped.set()
+        poll_errors = poller.result()
+
+    latencies = sorted(latency for sender_latencies, _ in results for latency in sender_latencies)
+    percentiles = quantiles(latencies, n=100) if len(latencies) > 1 else [0] * 99
+    return {
+        'sent': len(latencies),
+        'send_errors': sum(errors for _, errors in results),
+        'poll_errors': poll_errors,
+        'messages_per_second': len(latencies) / elapsed,
+        'p50_ms': percentiles[49] * 1000,
+        'p99_ms': percentiles[98] * 1000,
+        'max_ms': latencies[-1] * 1000 if latencies else 0,
+        'connections': api.get_stats().connections,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--senders', type=int, default=8)
+    parser.add_argument('--messages', type=int, default=800)
+    parser.add_argument('--latency', type=float, default=0.05, help='fake API response latency, seconds')
+    parser.add_argument('--poll-timeout', type=int, default=8, help='getUpdates long poll timeout, seconds')
+    args = parser.parse_args()
+
+    # Pool sized to the number of senders, as a bot would size it to its outbound concurrency
+    transport = TransportConfig(max_connections=args.senders, max_keepalive_connections=args.senders, pool_timeout=10)
+    with FakeBotApi(latency=args.latency) as api:
+        cases = {
+            'bare httpx.Client()': lambda: (httpx.Client(), None),
+            'tuned, shared poll': lambda: (transport.make_session(), None),
+            'tuned, dedicated poll': lambda: (transport.make_session(), transport.make_polling_session()),
+        }
+        print(f'{"case":<24}{"msg/s":>10}{"p50 ms":>10}{"p99 ms":>10}{"max ms":>10}{"errors":>8}{"conns":>7}')
+        for name, make_sessions in cases.items():
+            session, polling_session = make_sessions()
+            try:
+                result = run_case(api, session, polling_session, args)
+            finally:
+                session.close()
+                if polling_session:
+                    polling_session.close()
+            print(
+                f'{name:<24}{result["messages_per_second"]:>10.0f}{result["p50_ms"]:>10.1f}'
+                f'{result["p99_ms"]:>10.1f}{result["max_ms"]:>10.1f}'
+                f'{result["send_errors"] + result["poll_errors"]:>8}{result["connections"]:>7}',
+            )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,517 @@
+"""Local stand-in for the Telegram Bot API server.
+
+Run the server with a stream of synthetic updates and point the bot to it with `TG_SERVER_URL`:
+
+    python -m benchmarks.fake_api --port 8081 --users 100 --rate 50 --latency 0.03 --flood-rate 0.01
+    TG_SERVER_URL=http://127.0.0.1:8081 TG_BOT_TOKEN=token python run.py
+"""
+import argparse
+import json
+import random
+import threading
+from collections import Counter, deque
+from dataclasses import dataclass, field
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import count
+from statistics import quantiles
+from time import monotonic, sleep, time
+
+import httpx
+
+SECRET_TOKEN_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+MAX_UPDATES_TO_KEEP = 100_000
+
+
+@dataclass
+class FakeBotApiStats:
+    connections: int = 0
+    calls: Counter[str] = field(default_factory=Counter)
+    flood_errors: int = 0
+    server_errors: int = 0
+    updates_generated: int = 0
+    updates_delivered: int = 0
+    reply_latencies: list[float] = field(default_factory=list)
+
+    def get_reply_percentiles(self) -> dict[str, float]:
+        """Time from delivery of an update to the first bot request to the same chat, milliseconds."""
+        if len(self.reply_latencies) < 2:
+            return {}
+        percentiles = quantiles(self.reply_latencies, n=100)
+        return {f'p{n}': percentiles[n - 1] * 1000 for n in (50, 95, 99)}
+
+
+def make_user(user_id: int) -> dict:
+    return {'id': user_id, 'is_bot': False, 'first_name': f'User {user_id}'}
+
+
+def get_callback_data(message: dict) -> list[str]:
+    """Return callback data of all inline buttons of the message."""
+    return [
+        button['callback_data']
+        for row in message.get('reply_markup', {}).get('inline_keyboard', [])
+        for button in row
+        if button.get('callback_data')
+    ]
+
+
+class FakeBotApiError(Exception):
+
+    def __init__(self, status: HTTPStatus, description: str, parameters: dict | None = None):
+        super().__init__(description)
+        self.status = status
+        self.description = description
+        self.parameters = parameters
+
+
+class FakeBotApi:
+    """Imitation of the Telegram Bot API server for load tests and benchmarks.
+
+    Implements `getUpdates`, message sending and editing methods and the webhook methods, keeping sent messages
+    in memory. Every response is delayed by `latency` plus a random `latency_jitter`, a share of requests fails
+    with `429 Too Many Requests` (`flood_rate`) or `502 Bad Gateway` (`error_rate`), `getUpdates` is never
+    failed on purpose.
+
+    Simulated users write texts and press buttons of the last inline keyboard sent to them, so the bot walks
+    through its states as with real users. Updates are generated by `generate_updates` or by a background
+    stream of `updates_per_second`, they are delivered by `getUpdates` or pushed to the webhook if it is set.
+
+    Usage:
+
+        with FakeBotApi(latency=0.01, users=100) as api:
+            api.generate_updates(1000)
+            with SyncTgClient.setup('token', tg_server_url=api.url):
+                ...
+    """
+
+    def __init__(
+            self,
+            *,
+            host: str = '127.0.0.1',
+            port: int = 0,
+            latency: float = 0,
+            latency_jitter: float = 0,
+            flood_rate: float = 0,
+            flood_retry_after: int = 1,
+            error_rate: float = 0,
+            users: int = 100,
+            updates_per_second: float = 0,
+            seed: int | None = None,
+    ):
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.flood_rate = flood_rate
+        self.flood_retry_after = flood_retry_after
+        self.error_rate = error_rate
+        self.users = users
+        self.updates_per_second = updates_per_second
+        self.webhook_url: str | None = None
+        self.webhook_secret_token: str | None = None
+
+        self.stats = FakeBotApiStats()
+        self.http_server = ThreadingHTTPServer((host, port), self._make_request_handler())
+        self.http_server.daemon_threads = True
+
+        self._random = random.Random(seed)
+        self._update_ids = count(1)
+        self._message_ids = count(1)
+        self._callback_query_ids = count(1)
+        self._pending_updates: deque[dict] = deque()
+        self._messages: dict[tuple[int, int], dict] = {}
+        self._keyboard_messages: dict[int, dict] = {}
+        self._known_users: set[int] = set()
+        self._waiting_reply_since: dict[int, float] = {}
+        self._last_delivered_update_id = 0
+        self._condition = threading.Condition()
+        self._stopped = threading.Event()
+        self._threads: list[threading.Thread] = []
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    @property
+    def url(self) -> str:
+        host, port = self.http_server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self) -> None:
+        self._start_thread(self.http_server.serve_forever, 'fake-bot-api')
+        self._start_thread(self._push_to_webhook, 'fake-bot-api-webhook')
+        if self.updates_per_second:
+            self._start_thread(self._stream_updates, 'fake-bot-api-updates')
+
+    def stop(self) -> None:
+        self._stopped.set()
+        with self._condition:
+            self._condition.notify_all()
+        if self._threads:
+            self.http_server.shutdown()
+        for thread in self._threads:
+            thread.join()
+        self._threads.clear()
+        self.http_server.server_close()
+
+    def get_stats(self) -> FakeBotApiStats:
+        with self._condition:
+            return FakeBotApiStats(
+                connections=self.stats.connections,
+                calls=self.stats.calls.copy(),
+                flood_errors=self.stats.flood_errors,
+                server_errors=self.stats.server_errors,
+                updates_generated=self.stats.updates_generated,
+                updates_delivered=self.stats.updates_delivered,
+                reply_latencies=self.stats.reply_latencies.copy(),
+            )
+
+    def reset_stats(self) -> None:
+        with self._condition:
+            self.stats = FakeBotApiStats()
+
+    def push_update(self, update: dict) -> int:
+        """Queue an update for delivery, `update_id` is assigned by the server. Return the update id."""
+        with self._condition:
+            update = {'update_id': next(self._update_ids), **update}
+            self._pending_updates.append(update)
+            if len(self._pending_updates) > MAX_UPDATES_TO_KEEP:
+                self._pending_updates.popleft()
+            self.stats.updates_generated += 1
+            self._condition.notify_all()
+        return update['update_id']
+
+    def generate_updates(self, number: int) -> None:
+        for _ in range(number):
+            self.push_update(self.make_user_update())
+
+    def make_user_update(self, user_id: int | None = None) -> dict:
+        """Make the next action of a simulated user: a text message or a press of an inline button."""
+        with self._condition:
+            if user_id is None:
+                user_id = self._random.randint(1, self.users)
+
+            keyboard_message = self._keyboard_messages.get(user_id)
+            if keyboard_message and self._random.random() < 0.6:
+                if callback_data := get_callback_data(keyboard_message):
+                    data = self._random.choice(callback_data)
+                    return self.make_callback_query_update(user_id, keyboard_message, data)
+
+            if user_id in self._known_users:
+                text = f'Task {self._random.randint(1, 10_000)}'
+            else:
+                self._known_users.add(user_id)
+                text = '/start'
+            return self.make_message_update(user_id, text)
+
+    def make_message_update(self, user_id: int, text: str) -> dict:
+        return {'message': {
+            'message_id': next(self._message_ids),
+            'date': int(time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': make_user(user_id),
+            'text': text,
+        }}
+
+    def make_callback_query_update(self, user_id: int, message: dict, data: str) -> dict:
+        return {'callback_query': {
+            'id': str(next(self._callback_query_ids)),
+            'from': make_user(user_id),
+            'chat_instance': str(user_id),
+            'message': message,
+            'data': data,
+        }}
+
+    def get_keyboard_message(self, chat_id: int) -> dict | None:
+        """Return the last message with an inline keyboard sent to the chat."""
+        with self._condition:
+            return self._keyboard_messages.get(chat_id)
+
+    def call(self, api_method: str, content: bytes) -> tuple[HTTPStatus, dict]:
+        """Process an HTTP request to the Bot API method, return the response status and body."""
+        payload = json.loads(content) if content else {}
+        with self._condition:
+            self.stats.calls[api_method] += 1
+
+        try:
+            return HTTPStatus.OK, {'ok': True, 'result': self.handle(api_method, payload)}
+        except FakeBotApiError as ex:
+            response = {'ok': False, 'error_code': ex.status, 'description': ex.description}
+            if ex.parameters:
+                response['parameters'] = ex.parameters
+            return ex.status, response
+
+    def make_transport(self) -> httpx.MockTransport:
+        """Make a transport calling the fake API in process, without the HTTP server."""
+
+        def handle_request(request: httpx.Request) -> httpx.Response:
+            status, response = self.call(request.url.path.rsplit('/', 1)[-1].lower(), request.read())
+            return httpx.Response(status, json=response)
+
+        return httpx.MockTransport(handle_request)
+
+    def handle(self, api_method: str, payload: dict) -> dict | list | bool:
+        """Call a Bot API method, return the `result` field of the response or raise FakeBotApiError."""
+        handler = getattr(self, f'handle_{api_method}', None)
+        if not handler:
+            raise FakeBotApiError(HTTPStatus.NOT_FOUND, 'Not Found')
+        if api_method == 'getupdates':
+            return handler(payload)
+
+        sleep(self.latency + self._random.random() * self.latency_jitter)
+        if self._random.random() < self.flood_rate:
+            with self._condition:
+                self.stats.flood_errors += 1
+            raise FakeBotApiError(
+                HTTPStatus.TOO_MANY_REQUESTS,
+                f'Too Many Requests: retry after {self.flood_retry_after}',
+                {'retry_after': self.flood_retry_after},
+            )
+        if self._random.random() < self.error_rate:
+            with self._condition:
+                self.stats.server_errors += 1
+            raise FakeBotApiError(HTTPStatus.BAD_GATEWAY, 'Bad Gateway')
+
+        self._register_reply(payload.get('chat_id'))
+        return handler(payload)
+
+    def handle_getupdates(self, payload: dict) -> list[dict]:
+        if self.webhook_url:
+            raise FakeBotApiError(HTTPStatus.CONFLICT, "Conflict: can't use getUpdates method while webhook is active")
+
+        offset = payload.get('offset') or 0
+        limit = payload.get('limit') or 100
+        deadline = monotonic() + (payload.get('timeout') or 0)
+        with self._condition:
+            while self._pending_updates and self._pending_updates[0]['update_id'] < offset:
+                self._pending_updates.popleft()
+            while not self._pending_updates and not self._stopped.is_set() and monotonic() < deadline:
+                self._condition.wait(deadline - monotonic())
+            updates = [self._pending_updates[index] for index in range(min(limit, len(self._pending_updates)))]
+            self._register_delivery(updates)
+        return updates
+
+    def handle_sendmessage(self, payload: dict) -> dict:
+        message = {
+            'message_id': next(self._message_ids),
+            'date': int(time()),
+            'chat': {'id': payload['chat_id'], 'type': 'private'},
+            'from': {'id': 0, 'is_bot': True, 'first_name': 'Bot'},
+            'text': payload['text'],
+        }
+        if payload.get('reply_markup'):
+            message['reply_markup'] = payload['reply_markup']
+        with self._condition:
+            self._save_message(message)
+        return message
+
+    def handle_editmessagetext(self, payload: dict) -> dict:
+        return self._edit_message(payload, text=payload['text'], reply_markup=payload.get('reply_markup'))
+
+    def handle_editmessagereplymarkup(self, payload: dict) -> dict:
+        return self._edit_message(payload, reply_markup=payload.get('reply_markup'))
+
+    def handle_deletemessage(self, payload: dict) -> bool:
+        with self._condition:
+            message = self._messages.pop((payload['chat_id'], payload['message_id']), None)
+            if not message:
+                raise FakeBotApiError(HTTPStatus.BAD_REQUEST, 'Bad Request: message to delete not found')
+            if self._keyboard_messages.get(payload['chat_id']) is message:
+                del self._keyboard_messages[payload['chat_id']]
+        return True
+
+    def handle_answercallbackquery(self, payload: dict) -> bool:
+        return True
+
+    def handle_setwebhook(self, payload: dict) -> bool:
+        with self._condition:
+            self.webhook_url = payload['url'] or None
+            self.webhook_secret_token = payload.get('secret_token')
+            self._condition.notify_all()
+        return True
+
+    def handle_deletewebhook(self, payload: dict) -> bool:
+        with self._condition:
+            self.webhook_url = None
+            self.webhook_secret_token = None
+            if payload.get('drop_pending_updates'):
+                self._pending_updates.clear()
+        return True
+
+    def handle_getwebhookinfo(self, payload: dict) -> dict:
+        with self._condition:
+            return {
+                'url': self.webhook_url or '',
+                'has_custom_certificate': False,
+                'pending_update_count': len(self._pending_updates),
+            }
+
+    def _edit_message(self, payload: dict, **changes) -> dict:
+        with self._condition:
+            message = self._messages.get((payload.get('chat_id'), payload.get('message_id')))
+            if not message:
+                raise FakeBotApiError(HTTPStatus.BAD_REQUEST, 'Bad Request: message to edit not found')
+
+            edited_message = {**message, **changes, 'edit_date': int(time())}
+            if not changes.get('reply_markup') or not changes['reply_markup'].get('inline_keyboard'):
+                edited_message.pop('reply_markup', None)
+            if all(message.get(key) == edited_message.get(key) for key in ('text', 'reply_markup')):
+                raise FakeBotApiError(
+                    HTTPStatus.BAD_REQUEST,
+                    'Bad Request: message is not modified: specified new message content and reply markup are '
+                    'exactly the same as a current content and reply markup of the message',
+                )
+            self._save_message(edited_message)
+        return edited_message
+
+    def _save_message(self, message: dict) -> None:
+        chat_id = message['chat']['id']
+        self._messages[(chat_id, message['message_id'])] = message
+        if message.get('reply_markup', {}).get('inline_keyboard'):
+            self._keyboard_messages[chat_id] = message
+        elif self._keyboard_messages.get(chat_id, {}).get('message_id') == message['message_id']:
+            del self._keyboard_messages[chat_id]
+
+    def _register_delivery(self, updates: list[dict]) -> None:
+        # Updates are returned by getUpdates again until confirmed, count only the first delivery
+        updates = [update for update in updates if update['update_id'] > self._last_delivered_update_id]
+        if not updates:
+            return
+        self._last_delivered_update_id = updates[-1]['update_id']
+        now = monotonic()
+        for update in updates:
+            if update.get('message'):
+                chat_id = update['message']['chat']['id']
+            else:
+                chat_id = update['callback_query']['from']['id']
+            self._waiting_reply_since.setdefault(chat_id, now)
+        self.stats.updates_delivered += len(updates)
+
+    def _register_reply(self, chat_id: int | None) -> None:
+        with self._condition:
+            if (delivered_at := self._waiting_reply_since.pop(chat_id, None)) is not None:
+                self.stats.reply_latencies.append(monotonic() - delivered_at)
+
+    def _start_thread(self, target, name: str) -> None:
+        thread = threading.Thread(target=target, name=name, daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def _stream_updates(self) -> None:
+        pause = 1 / self.updates_per_second
+        next_update_at = monotonic()
+        while not self._stopped.is_set():
+            self.push_update(self.make_user_update())
+            next_update_at += pause
+            self._stopped.wait(max(0.0, next_update_at - monotonic()))
+
+    def _push_to_webhook(self) -> None:
+        """Deliver pending updates to the webhook one by one like Telegram does, failed updates are sent again."""
+        with httpx.Client() as session:
+            while not self._stopped.is_set():
+                with self._condition:
+                    while not (self.webhook_url and self._pending_updates) and not self._stopped.is_set():
+                        self._condition.wait()
+                    if self._stopped.is_set():
+                        return
+                    update = self._pending_updates[0]
+                    url, secret_token = self.webhook_url, self.webhook_secret_token
+
+                headers = {'content-type': 'application/json'}
+                if secret_token:
+                    headers[SECRET_TOKEN_HEADER] = secret_token
+                try:
+                    response = session.post(url, headers=headers, content=json.dumps(update).encode('utf-8'))
+                except httpx.HTTPError:
+                    self._stopped.wait(1)
+                    continue
+                if not response.is_success:
+                    self._stopped.wait(1)
+                    continue
+
+                with self._condition:
+                    if self._pending_updates and self._pending_updates[0] is update:
+                        self._pending_updates.popleft()
+                        self._register_delivery([update])
+
+    def _make_request_handler(self) -> type[BaseHTTPRequestHandler]:
+        server = self
+
+        class FakeBotApiRequestHandler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def setup(self):
+                super().setup()
+                with server._condition:
+                    server.stats.connections += 1
+
+            def do_POST(self):  # noqa N802
+                api_method = self.path.rsplit('/', 1)[-1].lower()
+                content = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                self.reply(*server.call(api_method, content))
+
+            def reply(self, status: HTTPStatus, response: dict) -> None:
+                body = json.dumps(response).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                try:
+                    self.wfile.write(body)
+                except (BrokenPipeError, ConnectionResetError):
+                    # Client gave up waiting, e.g. a long poll hit the read timeout
+                    pass
+
+            def log_message(self, format, *args):  # noqa A002
+                pass
+
+        return FakeBotApiRequestHandler
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--users', type=int, default=100, help='number of simulated users')
+    parser.add_argument('--rate', type=float, default=10, help='synthetic updates per second')
+    parser.add_argument('--latency', type=float, default=0, help='response latency, seconds')
+    parser.add_argument('--jitter', type=float, default=0, help='random extra latency up to, seconds')
+    parser.add_argument('--flood-rate', type=float, default=0, help='share of requests failed with 429')
+    parser.add_argument('--error-rate', type=float, default=0, help='share of requests failed with 502')
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args()
+
+    api = FakeBotApi(
+        host=args.host,
+        port=args.port,
+        latency=args.latency,
+        latency_jitter=args.jitter,
+        flood_rate=args.flood_rate,
+        error_rate=args.error_rate,
+        users=args.users,
+        updates_per_second=args.rate,
+        seed=args.seed,
+    )
+    print(f'Fake Bot API is listening on {api.url}')
+    with api:
+        try:
+            while True:
+                sleep(5)
+                stats = api.get_stats()
+                api.reset_stats()
+                reply_percentiles = ' '.join(
+                    f'{name}={value:.0f}ms' for name, value in stats.get_reply_percentiles().items()
+                )
+                print(
+                    f'updates generated={stats.updates_generated} delivered={stats.updates_delivered} '
+                    f'calls={sum(stats.calls.values())} 429={stats.flood_errors} 5xx={stats.server_errors} '
+                    f'replies {reply_percentiles or "-"}',
+                )
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,17 @@
+import os
+
+TRUE_VALUES = ('1', 'true', 'yes', 'on')
+FALSE_VALUES = ('', '0', 'false', 'no', 'off')
+
+
+def get_env_flag(name: str, default: bool = False) -> bool:
+    """Read a boolean setting from the environment, `DB_ECHO=0` turns the flag off like an unset variable."""
+    value = os.getenv(name)
+    if value is None:
+        return default
+    value = value.strip().lower()
+    if value in TRUE_VALUES:
+        return True
+    if value in FALSE_VALUES:
+        return False
+    raise ValueError(f'{name} must be one of {", ".join(TRUE_VALUES + FALSE_VALUES[1:])}, got {value!r}')
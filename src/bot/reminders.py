@@ -0,0 +1,116 @@
+"""Reminders of the todo due dates.
+
+Due dates are stored in UTC and shown in the time zone of the bot users, `BOT_UTC_OFFSET` hours. Timers
+of the reminders are loaded from the database window by window, see `BaseTimerScheduler`.
+"""
+import html
+import os
+import re
+from datetime import datetime, timedelta, timezone
+
+from core.tg_api import send_text_message, asend_text_message
+from .repositories import Todo
+
+USERS_TIMEZONE = timezone(timedelta(hours=float(os.getenv('BOT_UTC_OFFSET', 3))))
+# Reminders missed while the bot was down longer than this are not sent after the start
+MAX_REMINDER_DELAY = timedelta(days=1)
+
+DUE_AT_PATTERN = re.compile(
+    r'^(?:(?P<day>\d{1,2})\.(?P<month>\d{1,2})(?:\.(?P<year>\d{2}|\d{4}))?\s+)?(?P<hour>\d{1,2})[:.](?P<minute>\d{2})$',
+)
+
+
+def utc_now() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def parse_due_at(text: str, now: datetime | None = None) -> datetime | None:
+    """Parse the due date sent by a user: `31.12.2024 18:00`, `31.12 18:00` or `18:00`.
+
+    Return it in UTC or None if the text is not a date. A date without a year or a time without a date
+    is the nearest one in the future, 29.02 without a year is in the nearest leap year.
+    """
+    if not (match := DUE_AT_PATTERN.match(text.strip())):
+        return None
+    now = (now or utc_now()).replace(tzinfo=timezone.utc).astimezone(USERS_TIMEZONE)
+    day, month, year, hour, minute = match.group('day', 'month', 'year', 'hour', 'minute')
+    if year and len(year) == 2:
+        year = f'20{year}'
+
+    if not day:
+        due_at = replace_date(now, now.year, now.month, now.day, hour, minute)
+        if due_at and due_at <= now:
+            due_at += timedelta(days=1)
+    elif year:
+        due_at = replace_date(now, year, month, day, hour, minute)
+    else:
+        due_at = next(
+            (
+                due_at
+                for next_year in range(now.year, now.year + 9)
+                if (due_at := replace_date(now, next_year, month, day, hour, minute)) and due_at > now
+            ),
+            None,
+        )
+    return due_at and due_at.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def replace_date(now: datetime, year, month, day, hour, minute) -> datetime | None:
+    try:
+        return now.replace(
+            year=int(year),
+            month=int(month),
+            day=int(day),
+            hour=int(hour),
+            minute=int(minute),
+            second=0,
+            microsecond=0,
+        )
+    except ValueError:
+        return None
+
+
+def format_due_at(due_at: datetime) -> str:
+    return due_at.replace(tzinfo=timezone.utc).astimezone(USERS_TIMEZONE).strftime('%d.%m.%Y %H:%M')
+
+
+def to_timestamp(due_at: datetime) -> float:
+    return due_at.replace(tzinfo=timezone.utc).timestamp()
+
+
+def from_timestamp(timestamp: float) -> datetime:
+    return datetime.fromtimestamp(timestamp, timezone.utc).replace(tzinfo=None)
+
+
+def get_reminders_range(since: float | None, until: float) -> tuple[datetime, datetime]:
+    if since is None:
+        return utc_now() - MAX_REMINDER_DELAY, from_timestamp(until)
+    return from_timestamp(since), from_timestamp(until)
+
+
+def load_reminders(since: float | None, until: float) -> list[tuple[int, float]]:
+    return [
+        (todo_id, to_timestamp(due_at))
+        for todo_id, due_at in Todo.get_reminders(*get_reminders_range(since, until))
+    ]
+
+
+async def aload_reminders(since: float | None, until: float) -> list[tuple[int, float]]:
+    return [
+        (todo_id, to_timestamp(due_at))
+        for todo_id, due_at in await Todo.aget_reminders(*get_reminders_range(since, until))
+    ]
+
+
+def get_reminder_text(todo: Todo) -> str:
+    return f'Напоминаю о задаче <b>{html.escape(todo.title)}</b>\nСрок: {format_due_at(todo.due_at)}'
+
+
+def send_reminder(todo_id: int) -> None:
+    if todo := Todo.claim_reminder(todo_id, utc_now()):
+        send_text_message(get_reminder_text(todo), todo.tg_user_id, parse_mode='HTML')
+
+
+async def asend_reminder(todo_id: int) -> None:
+    if todo := await Todo.aclaim_reminder(todo_id, utc_now()):
+        await asend_text_message(get_reminder_text(todo), todo.tg_user_id, parse_mode='HTML')
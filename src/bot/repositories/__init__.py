@@ -1,2 +1,19 @@
-from .sessions import MemorySessionRepository
+from .sessions import MemorySessionRepository, SqlSessionRepository, SessionRepositoryStats, SessionWriterStats
 from .models import Todo
+from .pages import TodoPageSource
+from .todo_cache import TodoCache, TodoCacheStats
+from .db import (
+    configure,
+    configure_async,
+    get_engine,
+    get_async_engine,
+    get_dsn,
+    get_async_dsn,
+    get_pool_options,
+    session_scope,
+    async_session_scope,
+    unit_of_work,
+    async_unit_of_work,
+)
+from .sqlite_pragmas import SQLITE_PROFILES, get_sqlite_pragmas
+from .group_commit import GroupCommitWriter, GroupCommitStats
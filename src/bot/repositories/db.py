@@ -0,0 +1,243 @@
+"""Engine, connection pool and sessions of the todo database.
+
+Every unit of work, usually the processing of one update, gets its own session from `session_scope`.
+Nested scopes share the session of the outermost one, which commits on success and rolls back on
+an error. Sessions are not shared between threads or tasks.
+
+The database is SQLite file by default, `DB_DSN` or `POSTGRES_DSN` selects another one, e.g. a PostgreSQL
+server shared by several replicas of the bot. The async runtime gets an async engine of the same database
+from `configure_async`.
+"""
+import os
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from functools import partial
+from typing import AsyncIterator, Callable, Iterator
+
+from sqlalchemy import Engine, create_engine, event, make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+from ..env import get_env_flag
+from .sqlite_pragmas import DEFAULT_SQLITE_PROFILE, apply_sqlite_pragmas, get_sqlite_pragmas
+
+DEFAULT_DSN = 'sqlite:///db.db'
+
+ASYNC_DRIVERS = {
+    'sqlite': 'sqlite+aiosqlite',
+    'postgresql': 'postgresql+asyncpg',
+}
+
+# Cached todos are read after their session is closed, expiring them on commit would detach them unloaded
+SessionFactory = sessionmaker(expire_on_commit=False)
+AsyncSessionFactory = async_sessionmaker(expire_on_commit=False)
+
+current_session: ContextVar[Session | None] = ContextVar('current_session', default=None)
+current_async_session: ContextVar[AsyncSession | None] = ContextVar('current_async_session', default=None)
+
+_engine: Engine | None = None
+_async_engine: AsyncEngine | None = None
+
+
+def get_dsn() -> str:
+    dsn = os.getenv('DB_DSN') or os.getenv('POSTGRES_DSN') or DEFAULT_DSN
+    # Heroku style URLs are not accepted by SQLAlchemy
+    if dsn.startswith('postgres://'):
+        dsn = 'postgresql://' + dsn.removeprefix('postgres://')
+    return dsn
+
+
+def get_async_dsn(dsn: str) -> str:
+    """Return DSN of the same database with the async driver of its backend."""
+    url = make_url(dsn)
+    if url.get_backend_name() not in ASYNC_DRIVERS:
+        raise ValueError(f'No async driver for {url.get_backend_name()} database')
+    return url.set(drivername=ASYNC_DRIVERS[url.get_backend_name()]).render_as_string(hide_password=False)
+
+
+def get_pool_options() -> dict:
+    return {
+        'pool_size': int(os.getenv('DB_POOL_SIZE', 10)),
+        'max_overflow': int(os.getenv('DB_MAX_OVERFLOW', 10)),
+        'pool_timeout': float(os.getenv('DB_POOL_TIMEOUT', 30)),
+        'pool_recycle': int(os.getenv('DB_POOL_RECYCLE', 3600)),
+        'pool_pre_ping': get_env_flag('DB_POOL_PRE_PING'),
+    }
+
+
+def configure(
+        dsn: str = DEFAULT_DSN,
+        *,
+        echo: bool = False,
+        pool_size: int = 10,
+        max_overflow: int = 10,
+        pool_timeout: float = 30,
+        pool_recycle: int = 3600,
+        pool_pre_ping: bool = False,
+        sqlite_pragmas: dict[str, str | int] | None = None,
+) -> Engine:
+    """Create the engine and bind new sessions to it, the engine configured before is disposed.
+
+    The pool should hold a connection for every worker of the dispatcher, `max_overflow` connections
+    are opened over `pool_size` under peak load and closed when returned. `pool_pre_ping` checks every
+    connection taken from the pool with an extra query, it is worth it for a server dropping idle connections.
+    `sqlite_pragmas` are applied to new SQLite connections, by default the pragmas of the `balanced` profile.
+    """
+    global _engine
+    engine = create_engine(
+        dsn,
+        echo=echo,
+        pool_size=pool_size,
+        max_overflow=max_overflow,
+        pool_timeout=pool_timeout,
+        pool_recycle=pool_recycle,
+        pool_pre_ping=pool_pre_ping,
+    )
+    if engine.dialect.name == 'sqlite':
+        pragmas = get_sqlite_pragmas() if sqlite_pragmas is None else sqlite_pragmas
+        event.listen(engine, 'connect', partial(_set_sqlite_pragmas, pragmas))
+    SessionFactory.configure(bind=engine)
+    if _engine is not None:
+        _engine.dispose()
+    _engine = engine
+    return engine
+
+
+def _set_sqlite_pragmas(pragmas: dict[str, str | int], dbapi_connection, connection_record) -> None:
+    apply_sqlite_pragmas(dbapi_connection, pragmas)
+
+
+def configure_async(
+        dsn: str,
+        *,
+        echo: bool = False,
+        pool_size: int = 10,
+        max_overflow: int = 10,
+        pool_timeout: float = 30,
+        pool_recycle: int = 3600,
+        pool_pre_ping: bool = False,
+        sqlite_pragmas: dict[str, str | int] | None = None,
+) -> AsyncEngine:
+    """Create the async engine and bind new async sessions to it, the options are the same as of `configure`.
+
+    The engine configured before is not disposed, it should be disposed by the caller in its event loop.
+    """
+    global _async_engine
+    engine = create_async_engine(
+        dsn,
+        echo=echo,
+        # aiosqlite defaults to NullPool, which would connect and apply the pragmas for every session
+        poolclass=AsyncAdaptedQueuePool,
+        pool_size=pool_size,
+        max_overflow=max_overflow,
+        pool_timeout=pool_timeout,
+        pool_recycle=pool_recycle,
+        pool_pre_ping=pool_pre_ping,
+    )
+    if engine.dialect.name == 'sqlite':
+        pragmas = get_sqlite_pragmas() if sqlite_pragmas is None else sqlite_pragmas
+        event.listen(engine.sync_engine, 'connect', partial(_set_sqlite_pragmas, pragmas))
+    AsyncSessionFactory.configure(bind=engine)
+    _async_engine = engine
+    return engine
+
+
+def get_engine() -> Engine:
+    if _engine is None:
+        raise RuntimeError('Database is not configured, call configure() first')
+    return _engine
+
+
+def get_async_engine() -> AsyncEngine:
+    if _async_engine is None:
+        raise RuntimeError('Async database is not configured, call configure_async() first')
+    return _async_engine
+
+
+@contextmanager
+def session_scope() -> Iterator[Session]:
+    if (session := current_session.get()) is not None:
+        yield session
+        return
+
+    session = SessionFactory()
+    session.info['after_transaction'] = []
+    token = current_session.set(session)
+    try:
+        yield session
+        session.commit()
+    except BaseException:
+        committed = False
+        session.rollback()
+        raise
+    else:
+        committed = True
+    finally:
+        current_session.reset(token)
+        callbacks = session.info.pop('after_transaction')
+        session.close()
+        for callback in callbacks:
+            callback(committed)
+
+
+def after_transaction(session: Session | AsyncSession, callback: Callable[[bool], None]) -> None:
+    """Call the function with True when the transaction of the scope session is committed or with False when
+    it is rolled back."""
+    session.info['after_transaction'].append(callback)
+
+
+@asynccontextmanager
+async def async_session_scope() -> AsyncIterator[AsyncSession]:
+    if (session := current_async_session.get()) is not None:
+        yield session
+        return
+
+    session = AsyncSessionFactory()
+    session.info['after_transaction'] = []
+    token = current_async_session.set(session)
+    try:
+        yield session
+        await session.commit()
+    except BaseException:
+        committed = False
+        await session.rollback()
+        raise
+    else:
+        committed = True
+    finally:
+        current_async_session.reset(token)
+        callbacks = session.info.pop('after_transaction')
+        await session.close()
+        for callback in callbacks:
+            callback(committed)
+
+
+@contextmanager
+def unit_of_work() -> Iterator[Session]:
+    """Session shared by the repository calls within the scope, committed when the scope exits.
+
+    The transaction holds the SQLite write lock after the first write, so the scope should not span
+    Telegram requests. Repository calls outside of a scope commit on their own.
+    """
+    with session_scope() as session:
+        yield session
+
+
+@asynccontextmanager
+async def async_unit_of_work() -> AsyncIterator[AsyncSession]:
+    async with async_session_scope() as session:
+        yield session
+
+
+configure(
+    get_dsn(),
+    echo=get_env_flag('DB_ECHO'),
+    **get_pool_options(),
+    # In the rollback journal mode of the legacy profile a writer waiting for readers and a reader waiting
+    # to write block each other until the busy timeout, concurrent handlers need a WAL profile
+    sqlite_pragmas=get_sqlite_pragmas(
+        os.getenv('DB_SQLITE_PROFILE', DEFAULT_SQLITE_PROFILE),
+        os.getenv('DB_SQLITE_PRAGMAS'),
+    ),
+)
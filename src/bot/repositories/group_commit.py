@@ -0,0 +1,160 @@
+import asyncio
+import threading
+from concurrent.futures import Future
+from contextlib import contextmanager
+from contextvars import ContextVar, Token
+from dataclasses import dataclass
+from time import monotonic
+from typing import Callable, ClassVar, Generator, TypeVar
+
+from sqlalchemy.orm import Session
+
+from .db import session_scope
+
+ResultType = TypeVar('ResultType')
+
+
+@dataclass
+class GroupCommitStats:
+    batches: int = 0
+    operations: int = 0
+    failed_operations: int = 0
+
+    @property
+    def mean_batch_size(self) -> float:
+        return self.operations / self.batches if self.batches else 0
+
+
+@dataclass
+class _Operation:
+    write: Callable[[Session], object]
+    future: Future
+    submitted_at: float
+
+
+class GroupCommitWriter:
+    """Writes todos of many concurrent handlers in shared transactions, so they share one fsync.
+
+    A batch is committed `max_delay` seconds after its first operation or once it has `max_batch_size`
+    operations, whichever comes first. When an operation fails, the batch is rolled back and its operations
+    are committed one by one, so only the failed operation raises its error. Futures are resolved after
+    the commit.
+
+    Usage:
+
+        with GroupCommitWriter.setup():
+            Todo.create_for_user(user_id, title, content)
+    """
+
+    default_writer: ClassVar[ContextVar['GroupCommitWriter']] = ContextVar('default_group_commit_writer')
+
+    def __init__(self, *, max_batch_size: int = 128, max_delay: float = 0.005):
+        if max_batch_size < 1:
+            raise ValueError(f'Batch requires at least one operation, got {max_batch_size}')
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self._pending: list[_Operation] = []
+        self._condition = threading.Condition()
+        self._stopped = False
+        self._thread: threading.Thread | None = None
+        self._stats = GroupCommitStats()
+
+    @classmethod
+    @contextmanager
+    def setup(cls, **kwargs) -> Generator['GroupCommitWriter', None, None]:
+        writer = cls(**kwargs)
+        writer.start()
+        try:
+            with writer.set_as_default():
+                yield writer
+        finally:
+            writer.stop()
+
+    @contextmanager
+    def set_as_default(self) -> Generator[None, None, None]:
+        default_writer_token: Token = self.default_writer.set(self)
+        try:
+            yield
+        finally:
+            self.default_writer.reset(default_writer_token)
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name='group-commit-writer', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Commit the pending operations and stop the writer thread."""
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+        self._thread.join()
+
+    def submit(self, write: Callable[[Session], ResultType]) -> Future:
+        """Queue the write, the returned future resolves to its result once its batch is committed."""
+        operation = _Operation(write, Future(), monotonic())
+        with self._condition:
+            if self._stopped:
+                raise RuntimeError('Group commit writer is stopped')
+            self._pending.append(operation)
+            if len(self._pending) == 1 or len(self._pending) >= self.max_batch_size:
+                self._condition.notify()
+        return operation.future
+
+    def write(self, write: Callable[[Session], ResultType]) -> ResultType:
+        return self.submit(write).result()
+
+    async def awrite(self, write: Callable[[Session], ResultType]) -> ResultType:
+        return await asyncio.wrap_future(self.submit(write))
+
+    def get_stats(self) -> GroupCommitStats:
+        with self._condition:
+            return GroupCommitStats(
+                batches=self._stats.batches,
+                operations=self._stats.operations,
+                failed_operations=self._stats.failed_operations,
+            )
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                while not self._pending and not self._stopped:
+                    self._condition.wait()
+                if not self._pending:
+                    return
+                deadline = self._pending[0].submitted_at + self.max_delay
+                while len(self._pending) < self.max_batch_size and not self._stopped:
+                    timeout = deadline - monotonic()
+                    if timeout <= 0:
+                        break
+                    self._condition.wait(timeout)
+                batch = self._pending[:self.max_batch_size]
+                del self._pending[:self.max_batch_size]
+            self._commit(batch)
+
+    def _commit(self, batch: list[_Operation]) -> None:
+        try:
+            with session_scope() as session:
+                results = [operation.write(session) for operation in batch]
+        except Exception:
+            # An operation failed and rolled the batch back, operations are repeated one by one to find it
+            failed_operations = sum(not self._commit_alone(operation) for operation in batch)
+        else:
+            failed_operations = 0
+            for operation, result in zip(batch, results):
+                operation.future.set_result(result)
+
+        with self._condition:
+            self._stats.batches += 1
+            self._stats.operations += len(batch)
+            self._stats.failed_operations += failed_operations
+
+    @staticmethod
+    def _commit_alone(operation: _Operation) -> bool:
+        try:
+            with session_scope() as session:
+                result = operation.write(session)
+        except Exception as ex:
+            operation.future.set_exception(ex)
+            return False
+        operation.future.set_result(result)
+        return True
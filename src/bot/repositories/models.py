@@ -1,6 +1,29 @@
 import os
+from datetime import datetime, timezone
+from functools import partial
+from typing import Awaitable, Callable, TypeVar
 
-from sqlalchemy import String, Boolean, BigInteger, create_engine
+from sqlalchemy import (
+    String,
+    Boolean,
+    BigInteger,
+    Connection,
+    DateTime,
+    Engine,
+    Index,
+    JSON,
+    Select,
+    delete as sql_delete,
+    false,
+    func,
+    inspect,
+    or_,
+    select,
+    text,
+    update as sql_update,
+)
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
+from sqlalchemy.schema import CreateColumn
 from sqlalchemy.orm import (
     DeclarativeBase,
     Mapped,
@@ -8,8 +31,28 @@ from sqlalchemy.orm import (
     Session,
 )
 
-engine = create_engine('sqlite:///db.db', echo=os.getenv('DB_ECHO', False))
-db_session = Session(engine)
+from core.state_machine import BaseTimerScheduler
+
+from .db import (
+    after_transaction,
+    async_session_scope,
+    current_async_session,
+    current_session,
+    get_engine,
+    session_scope,
+)
+from .group_commit import GroupCommitWriter
+from .search import create_search_index, get_search_words, is_full_text_search_supported, match_todos
+from .todo_cache import TodoCache
+
+ResultType = TypeVar('ResultType')
+
+todo_cache = TodoCache(
+    max_users=int(os.getenv('TODO_CACHE_MAX_USERS', 1000)),
+    max_items=int(os.getenv('TODO_CACHE_MAX_ITEMS', 50_000)),
+    # Replicas sharing a database server do not see writes of each other, so the cache is off by default there
+    ttl=float(os.getenv('TODO_CACHE_TTL', 300 if get_engine().dialect.name == 'sqlite' else 0)),
+)
 
 
 class Base(DeclarativeBase):
@@ -18,12 +61,21 @@ class Base(DeclarativeBase):
 
 class Todo(Base):
     __tablename__ = 'todos'
+    __table_args__ = (
+        # Serves lists of user todos, both all and active ones, ordered by id
+        Index('ix_todos_tg_user_id_is_done_id', 'tg_user_id', 'is_done', 'id'),
+        # Serves windows of upcoming reminders, todos without a due date are not in the range
+        Index('ix_todos_due_at', 'due_at'),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True, unique=True)
     title: Mapped[str] = mapped_column(String(64))
     content: Mapped[str]
     is_done: Mapped[bool] = mapped_column(Boolean)
     tg_user_id: Mapped[int] = mapped_column(BigInteger)
+    # UTC, naive
+    due_at: Mapped[datetime | None] = mapped_column(DateTime)
+    is_reminded: Mapped[bool] = mapped_column(Boolean, default=False, server_default=false())
 
     def __str__(self):
         if self.is_done:
@@ -33,15 +85,65 @@ class Todo(Base):
 
     @classmethod
     def get_by_id(cls, todo_id: int):
-        return db_session.query(cls).filter_by(id=todo_id).first()
+        with session_scope() as session:
+            return session.get(cls, todo_id)
 
     @classmethod
+    @todo_cache.cached(current_session.get)
     def get_all_for_user(cls, user_id: int):
-        return db_session.query(cls).filter_by(tg_user_id=user_id).all()
+        with session_scope() as session:
+            return list(session.scalars(cls._select_for_user(user_id)))
 
     @classmethod
+    @todo_cache.cached(current_session.get)
     def get_active_for_user(cls, user_id: int):
-        return db_session.query(cls).filter_by(tg_user_id=user_id, is_done=False).all()
+        with session_scope() as session:
+            return list(session.scalars(cls._select_for_user(user_id, only_active=True)))
+
+    @classmethod
+    @todo_cache.cached(current_session.get)
+    def count_for_user(cls, user_id: int, *, only_active: bool = False) -> int:
+        with session_scope() as session:
+            return session.scalar(cls._select_count_for_user(user_id, only_active=only_active))
+
+    @classmethod
+    @todo_cache.cached(current_session.get)
+    def get_page_for_user(
+            cls,
+            user_id: int,
+            *,
+            limit: int,
+            only_active: bool = False,
+            after_id: int | None = None,
+            before_id: int | None = None,
+            from_end: bool = False,
+            offset: int = 0,
+    ) -> list['Todo']:
+        """Return a page of user todos ordered by id using keyset pagination.
+
+        `after_id` selects the todos following the id, `before_id` selects the todos preceding the id,
+        `from_end` selects the last todos. `offset` is meant for jumps to a page without a known id.
+        """
+        query, is_reversed = cls._select_page_for_user(
+            user_id, limit, only_active, after_id, before_id, from_end, offset,
+        )
+        with session_scope() as session:
+            todos = list(session.scalars(query))
+        return todos[::-1] if is_reversed else todos
+
+    @classmethod
+    def search_for_user(cls, user_id: int, query: str, *, limit: int) -> list['Todo']:
+        """Return user todos containing all words of the query, the best matches first."""
+        if (statement := cls._select_search_for_user(user_id, query, limit)) is None:
+            return []
+        with session_scope() as session:
+            return list(session.scalars(statement))
+
+    @classmethod
+    def get_reminders(cls, since: datetime | None, until: datetime) -> list[tuple[int, datetime]]:
+        """Return ids and due dates of the todos to remind of, due before `until` and not before `since`."""
+        with session_scope() as session:
+            return list(session.execute(cls._select_reminders(since, until)).tuples())
 
     @classmethod
     def create_for_user(cls, user_id: int, title: str, content: str, is_done: bool = False):
@@ -51,16 +153,355 @@ class Todo(Base):
             tg_user_id=user_id,
             is_done=is_done,
         )
-        db_session.add(todo)
-        db_session.commit()
+        cls._write(partial(cls._add, todo=todo))
 
     @classmethod
     def delete(cls, todo_id: int):
-        db_session.query(cls).filter_by(id=todo_id).delete()
+        cls._write(partial(cls._delete_by_id, todo_id=todo_id))
 
     @classmethod
     def update(cls, todo_id: int, **kwargs):
-        db_session.query(cls).filter_by(id=todo_id).update(kwargs)
+        cls._write(partial(cls._update_by_id, todo_id=todo_id, values=kwargs))
+
+    @classmethod
+    def set_due_at(cls, todo_id: int, due_at: datetime | None):
+        """Set or remove the due date, the reminder is scheduled with the default timer scheduler."""
+        scheduler = BaseTimerScheduler.default_scheduler.get(None)
+        cls._write(partial(cls._set_due_at_by_id, todo_id=todo_id, due_at=due_at, scheduler=scheduler))
+
+    @classmethod
+    def claim_reminder(cls, todo_id: int, now: datetime) -> 'Todo | None':
+        """Mark the reminder as sent if the todo is due and not done yet.
+
+        Return the todo or None if there is nothing to remind of, e.g. the reminder has been sent already.
+        """
+        return cls._write(partial(cls._claim_reminder_by_id, todo_id=todo_id, now=now))
+
+    @classmethod
+    async def aget_by_id(cls, todo_id: int):
+        async with async_session_scope() as session:
+            return await session.get(cls, todo_id)
+
+    @classmethod
+    @todo_cache.acached(current_async_session.get)
+    async def aget_all_for_user(cls, user_id: int):
+        async with async_session_scope() as session:
+            return list(await session.scalars(cls._select_for_user(user_id)))
+
+    @classmethod
+    @todo_cache.acached(current_async_session.get)
+    async def aget_active_for_user(cls, user_id: int):
+        async with async_session_scope() as session:
+            return list(await session.scalars(cls._select_for_user(user_id, only_active=True)))
+
+    @classmethod
+    @todo_cache.acached(current_async_session.get)
+    async def acount_for_user(cls, user_id: int, *, only_active: bool = False) -> int:
+        async with async_session_scope() as session:
+            return await session.scalar(cls._select_count_for_user(user_id, only_active=only_active))
+
+    @classmethod
+    @todo_cache.acached(current_async_session.get)
+    async def aget_page_for_user(
+            cls,
+            user_id: int,
+            *,
+            limit: int,
+            only_active: bool = False,
+            after_id: int | None = None,
+            before_id: int | None = None,
+            from_end: bool = False,
+            offset: int = 0,
+    ) -> list['Todo']:
+        query, is_reversed = cls._select_page_for_user(
+            user_id, limit, only_active, after_id, before_id, from_end, offset,
+        )
+        async with async_session_scope() as session:
+            todos = list(await session.scalars(query))
+        return todos[::-1] if is_reversed else todos
+
+    @classmethod
+    async def asearch_for_user(cls, user_id: int, query: str, *, limit: int) -> list['Todo']:
+        if (statement := cls._select_search_for_user(user_id, query, limit)) is None:
+            return []
+        async with async_session_scope() as session:
+            return list(await session.scalars(statement))
+
+    @classmethod
+    async def aget_reminders(cls, since: datetime | None, until: datetime) -> list[tuple[int, datetime]]:
+        async with async_session_scope() as session:
+            return list((await session.execute(cls._select_reminders(since, until))).tuples())
+
+    @classmethod
+    async def acreate_for_user(cls, user_id: int, title: str, content: str, is_done: bool = False):
+        todo = cls(
+            title=title,
+            content=content,
+            tg_user_id=user_id,
+            is_done=is_done,
+        )
+        await cls._awrite(partial(cls._add, todo=todo), partial(cls._aadd, todo=todo))
+
+    @classmethod
+    async def adelete(cls, todo_id: int):
+        await cls._awrite(
+            partial(cls._delete_by_id, todo_id=todo_id),
+            partial(cls._adelete_by_id, todo_id=todo_id),
+        )
+
+    @classmethod
+    async def aupdate(cls, todo_id: int, **kwargs):
+        await cls._awrite(
+            partial(cls._update_by_id, todo_id=todo_id, values=kwargs),
+            partial(cls._aupdate_by_id, todo_id=todo_id, values=kwargs),
+        )
+
+    @classmethod
+    async def aset_due_at(cls, todo_id: int, due_at: datetime | None):
+        scheduler = BaseTimerScheduler.default_scheduler.get(None)
+        await cls._awrite(
+            partial(cls._set_due_at_by_id, todo_id=todo_id, due_at=due_at, scheduler=scheduler),
+            partial(cls._aset_due_at_by_id, todo_id=todo_id, due_at=due_at, scheduler=scheduler),
+        )
+
+    @classmethod
+    async def aclaim_reminder(cls, todo_id: int, now: datetime) -> 'Todo | None':
+        return await cls._awrite(
+            partial(cls._claim_reminder_by_id, todo_id=todo_id, now=now),
+            partial(cls._aclaim_reminder_by_id, todo_id=todo_id, now=now),
+        )
+
+    @staticmethod
+    def _write(write: Callable[[Session], ResultType]) -> ResultType:
+        """Commit the write with writes of other handlers when the group commit writer is set up,
+        otherwise in the session of the current unit of work."""
+        if writer := GroupCommitWriter.default_writer.get(None):
+            return writer.write(write)
+        with session_scope() as session:
+            return write(session)
+
+    @staticmethod
+    async def _awrite(
+            write: Callable[[Session], ResultType],
+            awrite: Callable[[AsyncSession], Awaitable[ResultType]],
+    ) -> ResultType:
+        if writer := GroupCommitWriter.default_writer.get(None):
+            return await writer.awrite(write)
+        async with async_session_scope() as session:
+            return await awrite(session)
+
+    @classmethod
+    def _add(cls, session: Session, todo: 'Todo') -> None:
+        session.add(todo)
+        cls._invalidate_cache(session, todo.tg_user_id)
+
+    @classmethod
+    def _delete_by_id(cls, session: Session, todo_id: int) -> None:
+        if todo := session.get(cls, todo_id):
+            cls._invalidate_cache(session, todo.tg_user_id)
+        session.execute(sql_delete(cls).filter_by(id=todo_id))
+
+    @classmethod
+    def _update_by_id(cls, session: Session, todo_id: int, values: dict) -> None:
+        if todo := session.get(cls, todo_id):
+            cls._invalidate_cache(session, todo.tg_user_id)
+        session.execute(sql_update(cls).filter_by(id=todo_id).values(**values))
+
+    @classmethod
+    def _set_due_at_by_id(
+            cls,
+            session: Session,
+            todo_id: int,
+            due_at: datetime | None,
+            scheduler: BaseTimerScheduler | None,
+    ) -> None:
+        if todo := session.get(cls, todo_id):
+            cls._invalidate_cache(session, todo.tg_user_id)
+        session.execute(sql_update(cls).filter_by(id=todo_id).values(due_at=due_at, is_reminded=False))
+        cls._schedule_reminder(session, todo_id, due_at, scheduler)
+
+    @classmethod
+    def _claim_reminder_by_id(cls, session: Session, todo_id: int, now: datetime) -> 'Todo | None':
+        result = session.execute(cls._update_claimed_reminder(todo_id, now))
+        if not result.rowcount:
+            return None
+        todo = session.get(cls, todo_id)
+        cls._invalidate_cache(session, todo.tg_user_id)
+        return todo
+
+    @classmethod
+    async def _aadd(cls, session: AsyncSession, todo: 'Todo') -> None:
+        session.add(todo)
+        cls._invalidate_cache(session, todo.tg_user_id)
+
+    @classmethod
+    async def _adelete_by_id(cls, session: AsyncSession, todo_id: int) -> None:
+        if todo := await session.get(cls, todo_id):
+            cls._invalidate_cache(session, todo.tg_user_id)
+        await session.execute(sql_delete(cls).filter_by(id=todo_id))
+
+    @classmethod
+    async def _aupdate_by_id(cls, session: AsyncSession, todo_id: int, values: dict) -> None:
+        if todo := await session.get(cls, todo_id):
+            cls._invalidate_cache(session, todo.tg_user_id)
+        await session.execute(sql_update(cls).filter_by(id=todo_id).values(**values))
+
+    @classmethod
+    async def _aset_due_at_by_id(
+            cls,
+            session: AsyncSession,
+            todo_id: int,
+            due_at: datetime | None,
+            scheduler: BaseTimerScheduler | None,
+    ) -> None:
+        if todo := await session.get(cls, todo_id):
+            cls._invalidate_cache(session, todo.tg_user_id)
+        await session.execute(sql_update(cls).filter_by(id=todo_id).values(due_at=due_at, is_reminded=False))
+        cls._schedule_reminder(session, todo_id, due_at, scheduler)
+
+    @classmethod
+    async def _aclaim_reminder_by_id(cls, session: AsyncSession, todo_id: int, now: datetime) -> 'Todo | None':
+        result = await session.execute(cls._update_claimed_reminder(todo_id, now))
+        if not result.rowcount:
+            return None
+        todo = await session.get(cls, todo_id)
+        cls._invalidate_cache(session, todo.tg_user_id)
+        return todo
+
+    @staticmethod
+    def _schedule_reminder(
+            session: Session | AsyncSession,
+            todo_id: int,
+            due_at: datetime | None,
+            scheduler: BaseTimerScheduler | None,
+    ) -> None:
+        """Replace the reminder of the todo once the new due date is committed."""
+        if not scheduler:
+            return
+
+        def on_transaction_end(committed: bool) -> None:
+            if not committed:
+                return
+            if due_at is None:
+                scheduler.cancel(todo_id)
+            else:
+                scheduler.schedule(todo_id, due_at.replace(tzinfo=timezone.utc).timestamp())
+
+        after_transaction(session, on_transaction_end)
+
+    @classmethod
+    def _select_for_user(cls, user_id: int, *, only_active: bool = False) -> Select:
+        query = select(cls).filter_by(tg_user_id=user_id)
+        if only_active:
+            query = query.filter_by(is_done=False)
+        return query.order_by(cls.id)
+
+    @classmethod
+    def _select_count_for_user(cls, user_id: int, *, only_active: bool = False) -> Select:
+        query = select(func.count()).select_from(cls).filter_by(tg_user_id=user_id)
+        if only_active:
+            query = query.filter_by(is_done=False)
+        return query
+
+    @classmethod
+    def _select_page_for_user(
+            cls,
+            user_id: int,
+            limit: int,
+            only_active: bool,
+            after_id: int | None,
+            before_id: int | None,
+            from_end: bool,
+            offset: int,
+    ) -> tuple[Select, bool]:
+        """Return the page query and whether its rows are in the reversed order."""
+        query = select(cls).filter_by(tg_user_id=user_id)
+        if only_active:
+            query = query.filter_by(is_done=False)
+        if after_id is not None:
+            query = query.filter(cls.id > after_id)
+        if before_id is not None:
+            query = query.filter(cls.id < before_id)
+
+        if before_id is not None or from_end:
+            return query.order_by(cls.id.desc()).offset(offset).limit(limit), True
+        return query.order_by(cls.id).offset(offset).limit(limit), False
+
+    @classmethod
+    def _select_reminders(cls, since: datetime | None, until: datetime) -> Select:
+        query = select(cls.id, cls.due_at).filter(cls.due_at < until).filter_by(is_done=False, is_reminded=False)
+        if since is not None:
+            query = query.filter(cls.due_at >= since)
+        return query
+
+    @classmethod
+    def _update_claimed_reminder(cls, todo_id: int, now: datetime):
+        return (
+            sql_update(cls)
+            .filter_by(id=todo_id, is_done=False, is_reminded=False)
+            .filter(cls.due_at <= now)
+            .values(is_reminded=True)
+        )
+
+    @classmethod
+    def _select_search_for_user(cls, user_id: int, query: str, limit: int) -> Select | None:
+        """Return the search query or None if the query has no words to search for."""
+        if not (words := get_search_words(query)):
+            return None
+        statement = select(cls).filter_by(tg_user_id=user_id)
+        if is_full_text_search_supported(get_engine()):
+            return match_todos(statement, cls.id, words).limit(limit)
+        for word in words:
+            statement = statement.filter(
+                or_(cls.title.icontains(word, autoescape=True), cls.content.icontains(word, autoescape=True)),
+            )
+        return statement.order_by(cls.id).limit(limit)
+
+    @staticmethod
+    def _invalidate_cache(session: Session | AsyncSession, user_id: int):
+        todo_cache.begin_write(user_id, session)
+        after_transaction(session, lambda committed: todo_cache.end_write(user_id, session, committed=committed))
+
+
+class UserSession(Base):
+    """Locator, history and context of a user, written behind by `SqlSessionRepository`."""
+    __tablename__ = 'user_sessions'
+
+    user_id: Mapped[int] = mapped_column(BigInteger, primary_key=True, autoincrement=False)
+    locator: Mapped[list] = mapped_column(JSON)
+    history: Mapped[list] = mapped_column(JSON)
+    context: Mapped[dict] = mapped_column(JSON)
+    updated_at: Mapped[datetime] = mapped_column(DateTime)
+
+
+def upgrade_schema(bind: Engine | Connection) -> None:
+    """Create missing tables, columns and indexes, `create_all` skips tables that already exist."""
+    if isinstance(bind, Engine):
+        with bind.begin() as connection:
+            upgrade_schema(connection)
+        return
+
+    Base.metadata.create_all(bind, checkfirst=True)
+    inspector = inspect(bind)
+    for table in Base.metadata.sorted_tables:
+        existing_columns = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing_columns:
+                column_ddl = CreateColumn(column).compile(dialect=bind.dialect)
+                bind.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column_ddl}'))
+
+        existing_indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing_indexes:
+                index.create(bind)
+
+    if is_full_text_search_supported(bind):
+        create_search_index(bind)
+
+
+async def aupgrade_schema(engine: AsyncEngine) -> None:
+    async with engine.begin() as connection:
+        await connection.run_sync(upgrade_schema)
 
 
-Todo.metadata.create_all(engine, checkfirst=True)
+upgrade_schema(get_engine())
@@ -0,0 +1,69 @@
+from core.state_machine import BasePageSource, Page
+
+from .models import Todo
+
+
+class TodoPageSource(BasePageSource):
+    """Pages of user todos loaded by keyset queries, cursors are `a<id>` for todos after the id and
+    `b<id>` for todos before the id."""
+
+    def __init__(self, user_id: int, *, only_active: bool):
+        self.user_id = user_id
+        self.only_active = only_active
+
+    def count(self) -> int:
+        return Todo.count_for_user(self.user_id, only_active=self.only_active)
+
+    async def acount(self) -> int:
+        return await Todo.acount_for_user(self.user_id, only_active=self.only_active)
+
+    def get_page(self, page_number: int, page_size: int, total_items: int, cursor: str | None = None) -> Page:
+        todos = []
+        if keyset_query := self._get_keyset_query(page_size, cursor):
+            todos = self._get_todos(**keyset_query)
+        if not todos:
+            todos = self._get_todos(**self._get_offset_query(page_number, page_size, total_items))
+        return self._make_page(todos)
+
+    async def aget_page(self, page_number: int, page_size: int, total_items: int, cursor: str | None = None) -> Page:
+        todos = []
+        if keyset_query := self._get_keyset_query(page_size, cursor):
+            todos = await self._aget_todos(**keyset_query)
+        if not todos:
+            todos = await self._aget_todos(**self._get_offset_query(page_number, page_size, total_items))
+        return self._make_page(todos)
+
+    @staticmethod
+    def _get_keyset_query(page_size: int, cursor: str | None) -> dict | None:
+        if not cursor or not cursor[1:].isdigit():
+            return None
+        direction, todo_id = cursor[0], int(cursor[1:])
+        if direction == 'a':
+            return {'limit': page_size, 'after_id': todo_id}
+        if direction == 'b':
+            return {'limit': page_size, 'before_id': todo_id}
+
+    @staticmethod
+    def _get_offset_query(page_number: int, page_size: int, total_items: int) -> dict:
+        last_page_number = max(1, -(-total_items // page_size))
+        if page_number == last_page_number:
+            return {'limit': total_items - (page_number - 1) * page_size, 'from_end': True}
+        # Cursor is absent or stale, e.g. todos were deleted since the keyboard was sent
+        return {'limit': page_size, 'offset': (page_number - 1) * page_size}
+
+    @staticmethod
+    def _make_page(todos: list[Todo]) -> Page:
+        if not todos:
+            return Page(todos)
+        return Page(
+            todos,
+            cursor=f'a{todos[0].id - 1}',
+            prev_cursor=f'b{todos[0].id}',
+            next_cursor=f'a{todos[-1].id}',
+        )
+
+    def _get_todos(self, **kwargs) -> list[Todo]:
+        return Todo.get_page_for_user(self.user_id, only_active=self.only_active, **kwargs)
+
+    async def _aget_todos(self, **kwargs) -> list[Todo]:
+        return await Todo.aget_page_for_user(self.user_id, only_active=self.only_active, **kwargs)
@@ -0,0 +1,79 @@
+"""Full-text search over todos of a user.
+
+SQLite keeps an FTS5 index of titles and contents, updated by triggers on the `todos` table, and ranks
+matches with bm25 giving titles more weight. Other databases fall back to substring search.
+"""
+import re
+
+from sqlalchemy import Connection, Engine, Select, column, func, inspect, literal_column, table, text
+from sqlalchemy.orm import InstrumentedAttribute
+
+FTS_TABLE = 'todos_fts'
+TITLE_WEIGHT = 10.0
+CONTENT_WEIGHT = 1.0
+MAX_QUERY_WORDS = 10
+
+todos_fts = table(FTS_TABLE, column('rowid'))
+
+_SEARCH_INDEX_DDL = (
+    f"""
+    CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(
+        title,
+        content,
+        content='todos',
+        content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_after_insert AFTER INSERT ON todos BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, title, content) VALUES (new.id, new.title, new.content);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_after_delete AFTER DELETE ON todos BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, content) VALUES ('delete', old.id, old.title, old.content);
+    END
+    """,
+    # Marking a todo as done does not touch the index
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_after_update AFTER UPDATE OF title, content ON todos BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, content) VALUES ('delete', old.id, old.title, old.content);
+        INSERT INTO {FTS_TABLE}(rowid, title, content) VALUES (new.id, new.title, new.content);
+    END
+    """,
+)
+
+
+def is_full_text_search_supported(bind: Engine | Connection) -> bool:
+    return bind.dialect.name == 'sqlite'
+
+
+def create_search_index(connection: Connection) -> None:
+    """Create the FTS5 table and its triggers if they are missing, the new table indexes existing todos."""
+    if FTS_TABLE in inspect(connection).get_table_names():
+        statements = _SEARCH_INDEX_DDL[1:]
+    else:
+        statements = (*_SEARCH_INDEX_DDL, f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+    for statement in statements:
+        connection.execute(text(statement))
+
+
+def get_search_words(query: str) -> list[str]:
+    return re.findall(r'\w+', query)[:MAX_QUERY_WORDS]
+
+
+def make_match_expression(words: list[str]) -> str:
+    """Return FTS5 query matching todos containing all the words, the words match as prefixes."""
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+def match_todos(query: Select, todo_id: InstrumentedAttribute, words: list[str]) -> Select:
+    """Join the query of todos with the index, keep the todos matching the words and order them by rank."""
+    fts_column = literal_column(FTS_TABLE)
+    return (
+        query
+        .join(todos_fts, todos_fts.c.rowid == todo_id)
+        .filter(fts_column.op('MATCH')(make_match_expression(words)))
+        .order_by(func.bm25(fts_column, TITLE_WEIGHT, CONTENT_WEIGHT))
+    )
@@ -1,34 +1,368 @@
+import threading
+import traceback
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass, replace
+from datetime import datetime, timezone
+from sys import getsizeof
+from time import monotonic
+from typing import Generator
+
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
 from core.state_machine import BaseSessionRepository, Locator
 
+from .db import session_scope
+from .models import UserSession
+
+
+@dataclass
+class SessionRepositoryStats:
+    users: int = 0
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    expirations: int = 0
+    history_items: int = 0
+    # Estimate of the memory taken by the sessions and their access order
+    approx_bytes: int = 0
+
 
 class MemorySessionRepository(BaseSessionRepository):
+    """Keeps sessions of users in memory.
+
+    With `max_users` the least recently used sessions are evicted, with `ttl` the sessions not accessed for
+    `ttl` seconds expire. Access order is kept in an OrderedDict, so a touch and an eviction are O(1).
+    A user without a session starts from the start state.
+    """
 
-    def __init__(self, *, max_history_length: int = 50):
+    def __init__(self, *, max_history_length: int = 50, max_users: int | None = None, ttl: float | None = None):
         super().__init__()
         self.max_history_length = max_history_length
+        self.max_users = max_users
+        self.ttl = ttl
+        self._accessed_at: OrderedDict[int, float] = OrderedDict()
+        self._stats = SessionRepositoryStats()
+        self._lock = threading.RLock()
 
     def save_user_locator(self, user_id: int, locator: Locator):
-        if user_id not in self:
-            self[user_id] = {
+        if (entry := self._get_entry(user_id)) is None:
+            entry = {
                 'locator': locator,
                 'history': [],
                 'context': {},
             }
+            self._add_entry(user_id, entry)
         else:
-            self[user_id]['locator'] = locator
-        self.save_user_history(user_id, locator)
+            entry['locator'] = locator
+        self._append_history(entry, locator)
 
     def get_locator_by_user_id(self, user_id: int) -> Locator | None:
-        return self.get(user_id, {}).get('locator')
+        return (self._get_entry(user_id) or {}).get('locator')
 
     def save_user_history(self, user_id: int, locator: Locator):
-        if user_id in self:
-            self[user_id]['history'].append(locator)
-            if len(self[user_id]['history']) > self.max_history_length:
-                self[user_id]['history'] = self[user_id]['history'][:self.max_history_length]
+        if entry := self._get_entry(user_id):
+            self._append_history(entry, locator)
+
+    def get_user_history(self, user_id: int) -> list[Locator]:
+        return (self._get_entry(user_id) or {}).get('history', [])
+
+    def get_user_context(self, user_id: int) -> dict:
+        return (self._get_entry(user_id) or {}).get('context', {})
+
+    def get_stats(self) -> SessionRepositoryStats:
+        """Return the counters and the memory estimate, the estimate walks all the sessions."""
+        with self._lock:
+            history_items = sum(len(entry['history']) for entry in self.values())
+            approx_bytes = getsizeof(self) + getsizeof(self._accessed_at) + sum(map(get_entry_size, self.values()))
+            return replace(self._stats, users=len(self), history_items=history_items, approx_bytes=approx_bytes)
+
+    def _append_history(self, entry: dict, locator: Locator) -> None:
+        entry['history'].append(locator)
+        if len(entry['history']) > self.max_history_length:
+            entry['history'] = entry['history'][:self.max_history_length]
+
+    def _get_entry(self, user_id: int) -> dict | None:
+        with self._lock:
+            now = monotonic()
+            self._evict_expired(now)
+            entry = self.get(user_id)
+            if entry is None:
+                self._stats.misses += 1
+                return None
+            self._stats.hits += 1
+            self._accessed_at[user_id] = now
+            self._accessed_at.move_to_end(user_id)
+            return entry
+
+    def _add_entry(self, user_id: int, entry: dict) -> None:
+        with self._lock:
+            self[user_id] = entry
+            self._accessed_at[user_id] = monotonic()
+            self._accessed_at.move_to_end(user_id)
+            while self.max_users is not None and len(self._accessed_at) > self.max_users:
+                self._evict(next(iter(self._accessed_at)))
+                self._stats.evictions += 1
+
+    def _evict_expired(self, now: float) -> None:
+        if self.ttl is None:
+            return
+        while self._accessed_at:
+            user_id, accessed_at = next(iter(self._accessed_at.items()))
+            if now - accessed_at < self.ttl:
+                return
+            self._evict(user_id)
+            self._stats.expirations += 1
+
+    def _evict(self, user_id: int) -> None:
+        del self._accessed_at[user_id]
+        self._on_evict(user_id, self.pop(user_id))
+
+    def _on_evict(self, user_id: int, entry: dict) -> None:
+        pass
+
+
+def get_entry_size(entry: dict) -> int:
+    size = getsizeof(entry) + getsizeof(entry['history']) + getsizeof(entry['context'])
+    for locator in (entry['locator'], *entry['history']):
+        size += getsizeof(locator) + getsizeof(locator.params)
+    return size
+
+
+@dataclass
+class SessionWriterStats:
+    loads: int = 0
+    flushes: int = 0
+    written: int = 0
+    failed_flushes: int = 0
+    pending: int = 0
+
+
+class SqlSessionRepository(MemorySessionRepository):
+    """Keeps sessions in memory and writes them behind to the `user_sessions` table.
+
+    Reads are dict lookups, a user unknown to the process is looked up in the table once. A changed session
+    is marked dirty and the writer thread saves dirty sessions every `flush_interval` seconds or as soon as
+    `max_batch_size` of them are dirty, with one upsert per batch, so many changes of a session between
+    flushes cost one row write. Contexts are changed by states in place, so a requested context marks
+    the session dirty too. Sessions are saved only while the writer runs.
+
+    The table is the cold store of the evicted sessions: an evicted session is loaded back on the next
+    access, a session evicted before it is saved is kept aside until the writer saves it.
+
+    Usage:
+
+        with session_repository.write_behind():
+            state_machine.process(update)
+    """
+
+    def __init__(
+            self,
+            *,
+            max_history_length: int = 50,
+            max_users: int | None = None,
+            ttl: float | None = None,
+            flush_interval: float = 1.0,
+            max_batch_size: int = 500,
+    ):
+        super().__init__(max_history_length=max_history_length, max_users=max_users, ttl=ttl)
+        self.flush_interval = flush_interval
+        self.max_batch_size = max_batch_size
+        self._dirty_user_ids: set[int] = set()
+        self._flushing_user_ids: set[int] = set()
+        self._evicted_unsaved: dict[int, dict] = {}
+        # Users looked up in the table without a session are not looked up again until they are forgotten
+        # like sessions, by `ttl` and `max_users`
+        self._missing_user_ids: OrderedDict[int, float] = OrderedDict()
+        self._condition = threading.Condition()
+        self._stopped = False
+        self._thread: threading.Thread | None = None
+        self._writer_stats = SessionWriterStats()
+        # Error of the final flush, raised by stop
+        self._unsaved_error: Exception | None = None
+
+    @contextmanager
+    def write_behind(self) -> Generator['SqlSessionRepository', None, None]:
+        self.start()
+        try:
+            yield self
+        finally:
+            self.stop()
+
+    def start(self) -> None:
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name='session-writer', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Save the dirty sessions and stop the writer thread.
+
+        Raise RuntimeError if the sessions could not be saved, the error of the flush is its cause.
+        """
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+        self._thread.join()
+        if error := self._unsaved_error:
+            self._unsaved_error = None
+            raise RuntimeError(f'Sessions of {len(self._dirty_user_ids)} users are not saved') from error
+
+    def get_stats(self) -> SessionRepositoryStats:
+        stats = super().get_stats()
+        with self._lock, self._condition:
+            stats.approx_bytes += (
+                getsizeof(self._missing_user_ids)
+                + getsizeof(self._evicted_unsaved)
+                + sum(map(get_entry_size, self._evicted_unsaved.values()))
+            )
+        return stats
+
+    def get_writer_stats(self) -> SessionWriterStats:
+        with self._condition:
+            return replace(self._writer_stats, pending=len(self._dirty_user_ids))
+
+    def save_user_locator(self, user_id: int, locator: Locator):
+        self._load(user_id)
+        super().save_user_locator(user_id, locator)
+        self._missing_user_ids.pop(user_id, None)
+        self._mark_dirty(user_id)
+
+    def get_locator_by_user_id(self, user_id: int) -> Locator | None:
+        self._load(user_id)
+        return super().get_locator_by_user_id(user_id)
 
     def get_user_history(self, user_id: int) -> list[Locator]:
-        return self.get(user_id, {}).get('history', [])
+        self._load(user_id)
+        return super().get_user_history(user_id)
 
     def get_user_context(self, user_id: int) -> dict:
-        return self.get(user_id, {}).get('context', {})
+        self._load(user_id)
+        if user_id in self:
+            self._mark_dirty(user_id)
+        return super().get_user_context(user_id)
+
+    def _load(self, user_id: int) -> None:
+        with self._lock:
+            # An expired session is loaded back instead of being dropped on the access
+            now = monotonic()
+            self._evict_expired(now)
+            self._forget_expired_missing(now)
+        if user_id in self or user_id in self._missing_user_ids:
+            return
+        with self._condition:
+            entry = self._evicted_unsaved.pop(user_id, None)
+        if entry is None:
+            with session_scope() as session:
+                user_session = session.get(UserSession, user_id)
+            with self._condition:
+                self._writer_stats.loads += 1
+            if not user_session:
+                self._add_missing(user_id)
+                return
+            entry = {
+                'locator': Locator(*user_session.locator),
+                'history': [Locator(*locator) for locator in user_session.history],
+                'context': dict(user_session.context),
+            }
+        self._add_entry(user_id, entry)
+
+    def _add_missing(self, user_id: int) -> None:
+        with self._lock:
+            self._missing_user_ids[user_id] = monotonic()
+            self._missing_user_ids.move_to_end(user_id)
+            if self.max_users is not None and len(self._missing_user_ids) > self.max_users:
+                self._missing_user_ids.popitem(last=False)
+
+    def _forget_expired_missing(self, now: float) -> None:
+        while self.ttl is not None and self._missing_user_ids:
+            user_id, missed_at = next(iter(self._missing_user_ids.items()))
+            if now - missed_at < self.ttl:
+                return
+            del self._missing_user_ids[user_id]
+
+    def _on_evict(self, user_id: int, entry: dict) -> None:
+        with self._condition:
+            if user_id in self._dirty_user_ids or user_id in self._flushing_user_ids:
+                self._evicted_unsaved[user_id] = entry
+
+    def _mark_dirty(self, user_id: int) -> None:
+        with self._condition:
+            self._dirty_user_ids.add(user_id)
+            if len(self._dirty_user_ids) == 1 or len(self._dirty_user_ids) >= self.max_batch_size:
+                self._condition.notify()
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                while not self._dirty_user_ids and not self._stopped:
+                    self._condition.wait()
+                if not self._stopped and len(self._dirty_user_ids) < self.max_batch_size:
+                    # Let changes of the interval accumulate
+                    self._condition.wait(self.flush_interval)
+                if not self._dirty_user_ids:
+                    return
+                user_ids = self._flushing_user_ids = self._dirty_user_ids
+                self._dirty_user_ids = set()
+                stopped = self._stopped
+
+            if (error := self._flush(user_ids)) is None:
+                continue
+            if stopped:
+                self._unsaved_error = error
+                return
+            with self._condition:
+                # Retry after the interval, not at once, while the database fails
+                if not self._stopped:
+                    self._condition.wait(self.flush_interval)
+
+    def _flush(self, user_ids: set[int]) -> Exception | None:
+        """Save sessions of the users, return the error if they are not saved."""
+        updated_at = datetime.now(timezone.utc).replace(tzinfo=None)
+        rows = [
+            {
+                'user_id': user_id,
+                'locator': list(entry['locator']),
+                'history': [list(locator) for locator in entry['history']],
+                'context': dict(entry['context']),
+                'updated_at': updated_at,
+            }
+            for user_id in user_ids
+            if (entry := self.get(user_id) or self._evicted_unsaved.get(user_id))
+        ]
+        try:
+            with session_scope() as session:
+                for first_row in range(0, len(rows), self.max_batch_size):
+                    upsert_user_sessions(session, rows[first_row:first_row + self.max_batch_size])
+        except Exception as ex:
+            traceback.print_exc()
+            with self._condition:
+                self._dirty_user_ids |= user_ids
+                self._flushing_user_ids = set()
+                self._writer_stats.failed_flushes += 1
+            return ex
+
+        with self._condition:
+            self._flushing_user_ids = set()
+            for user_id in user_ids - self._dirty_user_ids:
+                self._evicted_unsaved.pop(user_id, None)
+            self._writer_stats.flushes += 1
+            self._writer_stats.written += len(rows)
+        return None
+
+
+def upsert_user_sessions(session: Session, rows: list[dict]) -> None:
+    dialect_name = session.get_bind().dialect.name
+    if dialect_name not in ('sqlite', 'postgresql'):
+        for row in rows:
+            session.merge(UserSession(**row))
+        return
+
+    insert = sqlite_insert if dialect_name == 'sqlite' else postgresql_insert
+    statement = insert(UserSession)
+    statement = statement.on_conflict_do_update(
+        index_elements=[UserSession.user_id],
+        set_={name: statement.excluded[name] for name in ('locator', 'history', 'context', 'updated_at')},
+    )
+    session.connection().execute(statement, rows)
@@ -0,0 +1,52 @@
+"""Pragma profiles applied to every new SQLite connection.
+
+`balanced` trades durability of the last transactions on a power loss for commits without fsync,
+WAL keeps the database consistent anyway. `durable` syncs every commit. `legacy` leaves SQLite defaults:
+rollback journal, in which readers block writers.
+"""
+import re
+
+SQLITE_PROFILES: dict[str, dict[str, str | int]] = {
+    'legacy': {},
+    'durable': {
+        'journal_mode': 'WAL',
+        'synchronous': 'FULL',
+        'busy_timeout': 5000,
+    },
+    'balanced': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': 5000,
+        # Negative cache size is in KiB
+        'cache_size': -64 * 1024,
+        'mmap_size': 256 * 1024 * 1024,
+        'temp_store': 'MEMORY',
+    },
+}
+DEFAULT_SQLITE_PROFILE = 'balanced'
+
+_PRAGMA_NAME = re.compile(r'[a-z_]+')
+_PRAGMA_VALUE = re.compile(r'-?\d+|[A-Za-z]+')
+
+
+def get_sqlite_pragmas(profile: str = DEFAULT_SQLITE_PROFILE, overrides: str | None = None) -> dict[str, str | int]:
+    """Return pragmas of the profile updated by overrides like `synchronous=FULL,cache_size=-2000`."""
+    if profile not in SQLITE_PROFILES:
+        raise ValueError(f'Unknown SQLite profile {profile!r}, expected one of {", ".join(SQLITE_PROFILES)}')
+    pragmas = dict(SQLITE_PROFILES[profile])
+    for override in filter(None, (overrides or '').split(',')):
+        name, _, value = override.partition('=')
+        pragmas[name.strip()] = value.strip()
+    return pragmas
+
+
+def apply_sqlite_pragmas(dbapi_connection, pragmas: dict[str, str | int]) -> None:
+    # Async drivers adapt cursors to DB-API, not the `execute` shortcut of sqlite3 connections
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in pragmas.items():
+            if not _PRAGMA_NAME.fullmatch(name) or not _PRAGMA_VALUE.fullmatch(str(value)):
+                raise ValueError(f'Invalid SQLite pragma {name}={value}')
+            cursor.execute(f'PRAGMA {name}={value}')
+    finally:
+        cursor.close()
@@ -0,0 +1,240 @@
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from functools import partial, wraps
+from time import monotonic
+from typing import Any, Awaitable, Callable, Hashable
+
+from sqlalchemy import inspect
+from sqlalchemy.orm import Session, make_transient_to_detached
+
+
+@dataclass
+class TodoCacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    expirations: int = 0
+    invalidations: int = 0
+    users: int = 0
+    items: int = 0
+
+    @property
+    def hit_ratio(self) -> float:
+        requests = self.hits + self.misses
+        return self.hits / requests if requests else 0
+
+
+class _UserEntry:
+    __slots__ = ('results', 'items', 'expires_at')
+
+    def __init__(self, expires_at: float):
+        self.results: dict[Hashable, object] = {}
+        self.items = 0
+        self.expires_at = expires_at
+
+
+@dataclass(frozen=True)
+class _ObjectSnapshot:
+    """Column values of an ORM object, every cache hit is given a new object made of them."""
+    cls: type
+    values: tuple[tuple[str, Any], ...]
+
+
+def _count_items(result) -> int:
+    return len(result) if isinstance(result, (list, tuple)) else 1
+
+
+def _take_snapshot(result):
+    """Return an immutable copy of the result, the loaded objects stay with the caller who may change them."""
+    if isinstance(result, list):
+        return tuple(_take_snapshot(item) for item in result)
+    if hasattr(type(result), '__mapper__'):
+        column_keys = (attribute.key for attribute in inspect(result).mapper.column_attrs)
+        return _ObjectSnapshot(type(result), tuple((key, getattr(result, key)) for key in column_keys))
+    return result
+
+
+def _restore_snapshot(snapshot, transaction: Hashable):
+    """Return a copy of the result, objects are added to the session of the transaction like the loaded ones."""
+    if isinstance(snapshot, tuple):
+        return [_restore_snapshot(item, transaction) for item in snapshot]
+    if not isinstance(snapshot, _ObjectSnapshot):
+        return snapshot
+    obj = snapshot.cls(**dict(snapshot.values))
+    # Detached as if it was loaded by a closed session, adding it to a session does not insert it again
+    make_transient_to_detached(obj)
+    session = getattr(transaction, 'sync_session', transaction)
+    if not isinstance(session, Session):
+        return obj
+    # The object in the session may have changes of the transaction that are not flushed yet
+    if (existing := session.identity_map.get(inspect(obj).key)) is not None:
+        return existing
+    return session.merge(obj, load=False)
+
+
+class TodoCache:
+    """Query results of user todos kept in memory between updates, keyed by `tg_user_id`.
+
+    Users are evicted in LRU order when there are more than `max_users` of them or their results hold
+    more than `max_items` todos. Results of a user live `ttl` seconds since the first query.
+
+    The cache keeps snapshots of the results and every hit gets its own copy: lists and ORM objects
+    given to one caller are not shared with another thread or session.
+
+    Writes to the user todos are wrapped in `begin_write` and `end_write`. While a write transaction is open
+    only the transaction itself, passed to the reads, reads and stores results of the user: they see its
+    uncommitted changes and stay valid once it commits.
+    """
+
+    def __init__(self, *, max_users: int = 1000, max_items: int = 50_000, ttl: float = 300):
+        self.max_users = max_users
+        self.max_items = max_items
+        self.ttl = ttl
+        self._entries: OrderedDict[int, _UserEntry] = OrderedDict()
+        self._items = 0
+        # Bumped by every invalidation, a result loaded while a write happened is not stored
+        self._generation = 0
+        self._writers: dict[int, set[Hashable]] = {}
+        self._stats = TodoCacheStats()
+        self._lock = threading.Lock()
+
+    def get_or_load(self, user_id: int, key: Hashable, load: Callable, transaction: Hashable = None):
+        is_cached, result, generation = self._lookup(user_id, key, transaction)
+        if is_cached:
+            return _restore_snapshot(result, transaction)
+        result = load()
+        if generation is not None:
+            self._store(user_id, key, _take_snapshot(result), transaction, generation)
+        return result
+
+    async def aget_or_load(
+            self,
+            user_id: int,
+            key: Hashable,
+            load: Callable[[], Awaitable],
+            transaction: Hashable = None,
+    ):
+        is_cached, result, generation = self._lookup(user_id, key, transaction)
+        if is_cached:
+            return _restore_snapshot(result, transaction)
+        result = await load()
+        if generation is not None:
+            self._store(user_id, key, _take_snapshot(result), transaction, generation)
+        return result
+
+    def invalidate(self, user_id: int) -> None:
+        with self._lock:
+            self._generation += 1
+            if self._pop_entry(user_id):
+                self._stats.invalidations += 1
+
+    def begin_write(self, user_id: int, transaction: Hashable = None) -> None:
+        with self._lock:
+            self._writers.setdefault(user_id, set()).add(transaction)
+        self.invalidate(user_id)
+
+    def end_write(self, user_id: int, transaction: Hashable = None, *, committed: bool) -> None:
+        with self._lock:
+            writers = self._writers.get(user_id, set())
+            writers.discard(transaction)
+            if not writers:
+                self._writers.pop(user_id, None)
+        if not committed:
+            self.invalidate(user_id)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self._items = 0
+
+    def get_stats(self) -> TodoCacheStats:
+        with self._lock:
+            return TodoCacheStats(
+                hits=self._stats.hits,
+                misses=self._stats.misses,
+                evictions=self._stats.evictions,
+                expirations=self._stats.expirations,
+                invalidations=self._stats.invalidations,
+                users=len(self._entries),
+                items=self._items,
+            )
+
+    def cached(self, get_transaction: Callable[[], Hashable]) -> Callable[[Callable], Callable]:
+        """Cache results of a query method taking the user id as the first argument after the class."""
+
+        def decorator(func: Callable) -> Callable:
+            @wraps(func)
+            def wrapper(cls, user_id: int, *args, **kwargs):
+                key = (func.__name__, args, tuple(sorted(kwargs.items())))
+                load = partial(func, cls, user_id, *args, **kwargs)
+                return self.get_or_load(user_id, key, load, get_transaction())
+
+            return wrapper
+
+        return decorator
+
+    def acached(self, get_transaction: Callable[[], Hashable]) -> Callable[[Callable], Callable]:
+
+        def decorator(func: Callable) -> Callable:
+            @wraps(func)
+            async def wrapper(cls, user_id: int, *args, **kwargs):
+                key = (func.__name__, args, tuple(sorted(kwargs.items())))
+                load = partial(func, cls, user_id, *args, **kwargs)
+                return await self.aget_or_load(user_id, key, load, get_transaction())
+
+            return wrapper
+
+        return decorator
+
+    def _lookup(self, user_id: int, key: Hashable, transaction: Hashable) -> tuple[bool, object, int | None]:
+        """Return whether the result is cached, the result and the generation to store a loaded result with."""
+        with self._lock:
+            if not self._writers.get(user_id, set()) <= {transaction}:
+                # Written by another transaction, the result is loaded and not stored
+                self._stats.misses += 1
+                return False, None, None
+            entry = self._get_entry(user_id)
+            if entry and key in entry.results:
+                self._stats.hits += 1
+                return True, entry.results[key], None
+            self._stats.misses += 1
+            return False, None, self._generation
+
+    def _store(self, user_id: int, key: Hashable, result, transaction: Hashable, generation: int | None) -> None:
+        with self._lock:
+            if generation != self._generation or not self._writers.get(user_id, set()) <= {transaction}:
+                return
+            entry = self._get_entry(user_id)
+            if entry is None:
+                entry = self._entries[user_id] = _UserEntry(monotonic() + self.ttl)
+            if key not in entry.results:
+                entry.results[key] = result
+                entry.items += _count_items(result)
+                self._items += _count_items(result)
+                self._evict()
+
+    def _get_entry(self, user_id: int) -> _UserEntry | None:
+        entry = self._entries.get(user_id)
+        if entry is None:
+            return None
+        if entry.expires_at <= monotonic():
+            self._pop_entry(user_id)
+            self._stats.expirations += 1
+            return None
+        self._entries.move_to_end(user_id)
+        return entry
+
+    def _pop_entry(self, user_id: int) -> _UserEntry | None:
+        entry = self._entries.pop(user_id, None)
+        if entry:
+            self._items -= entry.items
+        return entry
+
+    def _evict(self) -> None:
+        # The most recent user is kept even if it alone holds more than `max_items` todos
+        while len(self._entries) > 1 and (len(self._entries) > self.max_users or self._items > self.max_items):
+            user_id = next(iter(self._entries))
+            self._pop_entry(user_id)
+            self._stats.evictions += 1
@@ -1,6 +1,6 @@
 from core import BaseState, Locator
 from core.tg_api import Update
-from core.tg_api.shortcuts import edit_inline_keyboard
+from core.tg_api.shortcuts import edit_inline_keyboard, aedit_inline_keyboard
 
 
 class ClassicState(BaseState):
@@ -10,12 +10,24 @@ class ClassicState(BaseState):
         if update.message:
             return self.handle_text_message(update.message.text)
 
+    async def aprocess(self, update: Update) -> Locator | None:
+        if update.callback_query:
+            return await self.ahandle_inline_buttons(update.callback_query.data)
+        if update.message:
+            return await self.ahandle_text_message(update.message.text)
+
     def handle_inline_buttons(self, callback_data: str) -> Locator | None:
         pass
 
     def handle_text_message(self, message_text: str) -> Locator | None:
         pass
 
+    async def ahandle_inline_buttons(self, callback_data: str) -> Locator | None:
+        return self.handle_inline_buttons(callback_data)
+
+    async def ahandle_text_message(self, message_text: str) -> Locator | None:
+        return self.handle_text_message(message_text)
+
 
 class DestroyInlineKeyboardMixin:
     """Удаляет клавиатуру при выходе из состояния при нажатии на кнопку"""
@@ -26,4 +38,15 @@ class DestroyInlineKeyboardMixin:
                 chat_id=update.chat_id,
                 message_id=message_id,
                 keyboard=None,
+                wait=False,
+            )
+
+    async def aexit_state(self, update: Update) -> None:
+        if update.callback_query:
+            message_id = update.callback_query.message.message_id
+            await aedit_inline_keyboard(
+                chat_id=update.chat_id,
+                message_id=message_id,
+                keyboard=None,
+                wait=False,
             )
@@ -1,7 +1,6 @@
+import os
 import textwrap
-from typing import Literal
-
-import more_itertools
+from typing import ClassVar, Literal
 
 from core import (
     StateRouter,
@@ -10,19 +9,42 @@ from core import (
     Paginator,
     BaseState,
 )
+from core.state_machine import Page
 from core.tg_api import (
     Update,
     InlineKeyboardButton,
-    EditMessageTextRequest,
+    Message,
     send_text_message,
+    asend_text_message,
     edit_inline_keyboard,
+    aedit_inline_keyboard,
+    edit_text_message,
+    aedit_text_message,
+)
+from .reminders import format_due_at, parse_due_at
+from .repositories import (
+    Todo,
+    TodoPageSource,
+    MemorySessionRepository,
+    SqlSessionRepository,
 )
-from .repositories import Todo, MemorySessionRepository
 from .state_classes import ClassicState, DestroyInlineKeyboardMixin
 
 router = StateRouter()
 start_state_locator = Locator('/')
-session_repository = MemorySessionRepository()
+# Sessions of users idle for a week are evicted, a user without a session starts from the start state
+session_limits = {
+    'max_users': int(os.getenv('BOT_SESSION_MAX_USERS', 100_000)),
+    'ttl': float(os.getenv('BOT_SESSION_TTL', 7 * 24 * 3600)),
+}
+if os.getenv('BOT_SESSION_STORE') == 'db':
+    # Conversations survive restarts and evictions, run.py starts the writer
+    session_repository = SqlSessionRepository(
+        **session_limits,
+        flush_interval=float(os.getenv('BOT_SESSION_FLUSH_INTERVAL', 1)),
+    )
+else:
+    session_repository = MemorySessionRepository(**session_limits)
 
 state_machine = StateMachine(
     state_router=router,
@@ -30,50 +52,104 @@ state_machine = StateMachine(
     start_state_locator=start_state_locator,
     commands_map={
         '/start': start_state_locator,
-    }
+        '/search': Locator('/search/'),
+    },
 )
 
 
 @router.register('/')
 class StartState(BaseState):
     page_number: int = 1
+    page_cursor: str | None = None
     show_done: bool = False
     edit_message_id: int | None = None
     page_size: int = 6
 
-    def enter_state(self, update: Update) -> Locator | None:  # noqa
+    def get_paginator(self) -> Paginator:
+        return Paginator(
+            page_source=TodoPageSource(self.chat_id, only_active=not self.show_done),
+            **self.get_paginator_options(),
+        )
+
+    async def aget_paginator(self) -> Paginator:
+        return await Paginator.acreate(
+            page_source=TodoPageSource(self.chat_id, only_active=not self.show_done),
+            **self.get_paginator_options(),
+        )
+
+    def get_paginator_options(self) -> dict:
+        return {
+            'button_text_getter': lambda todo: textwrap.shorten(
+                str(todo), 40,
+                placeholder='...',
+            ),
+            'button_callback_data_getter': lambda todo: todo.id,
+            'page_size': self.page_size,
+        }
+
+    def get_page(self, paginator: Paginator) -> Page | None:
+        if not paginator.total_items:
+            return None
+        return paginator.get_page(self.page_number, self.page_cursor)
+
+    async def aget_page(self, paginator: Paginator) -> Page | None:
+        if not paginator.total_items:
+            return None
+        return await paginator.aget_page(self.page_number, self.page_cursor)
+
+    def get_message(
+            self,
+            paginator: Paginator,
+            page: Page | None = None,
+    ) -> tuple[str, list[list[InlineKeyboardButton]]]:
         if self.show_done:
-            todos = Todo.get_all_for_user(self.chat_id)
             show_done_button = InlineKeyboardButton('Скрыть сделанные', callback_data='show_active')
         else:
-            todos = Todo.get_active_for_user(self.chat_id)
             show_done_button = InlineKeyboardButton('Показать все', callback_data='show_done')
 
-        if not todos:
+        if not paginator.total_items:
             text = 'Привет!\nУ тебя еще нет задач. Добавь первую.'
             keyboard = []
         else:
             text = 'Привет!\nВот список твоих текущих задач:'
-            keyboard = Paginator(
-                todos,
-                button_text_getter=lambda todo: textwrap.shorten(
-                    str(todo), 40,
-                    placeholder='...',
-                ),
-                button_callback_data_getter=lambda todo: todo.id,
-                page_size=self.page_size,
-            ).get_keyboard(self.page_number)
+            keyboard = paginator.get_keyboard(self.page_number, self.page_cursor, page=page)
 
         keyboard.append([
             InlineKeyboardButton('Добавить', callback_data='add'),
+            InlineKeyboardButton('Поиск', callback_data='search'),
             show_done_button,
         ])
+        return text, keyboard
+
+    @staticmethod
+    def get_page_items(page: Page | None) -> list[str]:
+        return [str(todo) for todo in page.items] if page else []
+
+    def remember_page(self, page: Page | None) -> None:
+        # The list is described on exit as the user saw it, without loading it again
+        session_repository.get_user_context(self.chat_id)['page_items'] = self.get_page_items(page)
+
+    def pop_page_items(self) -> list[str] | None:
+        return session_repository.get_user_context(self.chat_id).pop('page_items', None)
+
+    @staticmethod
+    def get_exit_text(page_items: list[str]) -> str:
+        text = 'Привет!\nВот список твоих текущих задач:\n\n'
+        text += '\n'.join(page_items)
+        return text
+
+    def enter_state(self, update: Update) -> Locator | None:  # noqa
+        paginator = self.get_paginator()
+        page = self.get_page(paginator)
+        self.remember_page(page)
+        text, keyboard = self.get_message(paginator, page)
 
         if self.edit_message_id:
             edit_inline_keyboard(
                 self.chat_id,
                 self.edit_message_id,
                 keyboard,
+                wait=False,
             )
         else:
             send_text_message(
@@ -82,6 +158,26 @@ class StartState(BaseState):
                 keyboard,
             )
 
+    async def aenter_state(self, update: Update) -> Locator | None:  # noqa
+        paginator = await self.aget_paginator()
+        page = await self.aget_page(paginator)
+        self.remember_page(page)
+        text, keyboard = self.get_message(paginator, page)
+
+        if self.edit_message_id:
+            await aedit_inline_keyboard(
+                self.chat_id,
+                self.edit_message_id,
+                keyboard,
+                wait=False,
+            )
+        else:
+            await asend_text_message(
+                text,
+                self.chat_id,
+                keyboard,
+            )
+
     def process(self, update: Update) -> Locator | None:
         if not update.callback_query:
             return
@@ -89,20 +185,18 @@ class StartState(BaseState):
         match update.callback_query.data:
             case 'add':
                 return Locator('/todo/title/')
+            case 'search':
+                return Locator('/search/')
             case 'show_done':
                 return Locator('/', {'show_done': True})
             case 'show_active':
                 return Locator('/')
-            case callback_data if 'page#' in callback_data:
+            case callback_data if callback_data.startswith('page#'):
                 params = {
                     'edit_message_id': update.callback_query.message.message_id,
                     'show_done': self.show_done,
                 }
-                _, page_number = callback_data.rsplit('#', 1)
-                if page_number.isdigit():
-                    params['page_number'] = int(page_number)
-                else:
-                    params['page_number'] = 1
+                params['page_number'], params['page_cursor'] = Paginator.parse_callback_data(callback_data)
                 return Locator('/', params)
             case callback_data if callback_data.isdigit():
                 return Locator('/todo/', {'todo_id': int(callback_data)})
@@ -110,48 +204,107 @@ class StartState(BaseState):
                 return Locator('/', {'switch_page': True})
 
     def exit_state(self, update: Update) -> None:
+        page_items = self.pop_page_items()
         if not update.callback_query:
             return
 
-        if self.show_done:
-            todos = Todo.get_all_for_user(self.chat_id)
-        else:
-            todos = Todo.get_active_for_user(self.chat_id)
+        if page_items is None:
+            # The list was shown before the context was kept
+            page_items = self.get_page_items(self.get_page(self.get_paginator()))
+        self.finish_message(update, page_items)
+
+    async def aexit_state(self, update: Update) -> None:
+        page_items = self.pop_page_items()
+        if not update.callback_query:
+            return
+
+        if page_items is None:
+            page_items = self.get_page_items(await self.aget_page(await self.aget_paginator()))
+        await self.afinish_message(update, page_items)
 
-        if not todos:
+    def finish_message(self, update: Update, page_items: list[str]) -> None:
+        if not page_items:
             edit_inline_keyboard(
                 chat_id=self.chat_id,
                 message_id=update.callback_query.message.message_id,
-                keyboard=None
+                keyboard=None,
+                wait=False,
             )
             return
-        else:
-            text = 'Привет!\nВот список твоих текущих задач:\n\n'
-            pages = list(more_itertools.chunked(
-                [str(todo) for todo in todos],
-                self.page_size,
-            ))
-            text += '\n'.join(pages[self.page_number - 1])
-
-        EditMessageTextRequest(
-            text=text,
+
+        edit_text_message(
             chat_id=self.chat_id,
             message_id=update.callback_query.message.message_id,
-            reply_markup=None,
-        ).send()
-
+            text=self.get_exit_text(page_items),
+            wait=False,
+        )
 
-@router.register('/todo/title/')
-class AddTodoTitleState(DestroyInlineKeyboardMixin, ClassicState):
+    async def afinish_message(self, update: Update, page_items: list[str]) -> None:
+        if not page_items:
+            await aedit_inline_keyboard(
+                chat_id=self.chat_id,
+                message_id=update.callback_query.message.message_id,
+                keyboard=None,
+                wait=False,
+            )
+            return
 
-    def enter_state(self, update: Update) -> Locator | None:  # noqa
-        message = send_text_message(
-            text='Как назовем задачу?',
+        await aedit_text_message(
             chat_id=self.chat_id,
-            keyboard=[[InlineKeyboardButton('Отмена', callback_data='cancel')]],
+            message_id=update.callback_query.message.message_id,
+            text=self.get_exit_text(page_items),
+            wait=False,
         )
-        context = session_repository.get_user_context(update.chat_id)
-        context['last_message_id'] = message.message_id
+
+
+class PromptState(DestroyInlineKeyboardMixin, ClassicState):
+    """Asks the user for a text message, the keyboard of the last prompt is removed when the state is left."""
+    prompt: ClassVar[str]
+
+    def get_prompt_keyboard(self) -> list[list[InlineKeyboardButton]]:
+        return [[InlineKeyboardButton('Отмена', callback_data='cancel')]]
+
+    def pop_prompt_message_id(self) -> int | None:
+        return session_repository.get_user_context(self.chat_id).pop('last_message_id', None)
+
+    def remember_prompt(self, message: Message) -> None:
+        session_repository.get_user_context(self.chat_id)['last_message_id'] = message.message_id
+
+    def remove_prompt_keyboard(self) -> None:
+        if message_id := self.pop_prompt_message_id():
+            edit_inline_keyboard(self.chat_id, message_id, keyboard=None, wait=False)
+
+    async def aremove_prompt_keyboard(self) -> None:
+        if message_id := self.pop_prompt_message_id():
+            await aedit_inline_keyboard(self.chat_id, message_id, keyboard=None, wait=False)
+
+    def send_prompt(self, text: str, keyboard: list[list[InlineKeyboardButton]]) -> None:
+        # Only the latest prompt keeps the keyboard
+        self.remove_prompt_keyboard()
+        self.remember_prompt(send_text_message(text, self.chat_id, keyboard))
+
+    async def asend_prompt(self, text: str, keyboard: list[list[InlineKeyboardButton]]) -> None:
+        await self.aremove_prompt_keyboard()
+        self.remember_prompt(await asend_text_message(text, self.chat_id, keyboard))
+
+    def enter_state(self, update: Update) -> Locator | None:  # noqa
+        self.send_prompt(self.prompt, self.get_prompt_keyboard())
+
+    async def aenter_state(self, update: Update) -> Locator | None:  # noqa
+        await self.asend_prompt(self.prompt, self.get_prompt_keyboard())
+
+    def exit_state(self, update: Update) -> None:
+        super().exit_state(update)
+        self.remove_prompt_keyboard()
+
+    async def aexit_state(self, update: Update) -> None:
+        await super().aexit_state(update)
+        await self.aremove_prompt_keyboard()
+
+
+@router.register('/todo/title/')
+class AddTodoTitleState(PromptState):
+    prompt = 'Как назовем задачу?'
 
     def handle_text_message(self, message_text: str) -> Locator:
         return Locator('/todo/content/', {'title': message_text})
@@ -160,55 +313,60 @@ class AddTodoTitleState(DestroyInlineKeyboardMixin, ClassicState):
         if callback_data == 'cancel':
             return Locator('/')
 
-    def exit_state(self, update: Update) -> None:
-        super().exit_state(update)
-        context = session_repository.get_user_context(update.chat_id)
-        if message_id := context.pop('last_message_id', None):
-            edit_inline_keyboard(
-                update.chat_id,
-                message_id,  # noqa
-                keyboard=None,
-            )
-
 
 @router.register('/todo/content/')
-class AddTodoContentState(DestroyInlineKeyboardMixin, ClassicState):
+class AddTodoContentState(PromptState):
+    prompt = 'ОК. Опиши суть задачи.'
+    saved_text: ClassVar[str] = 'ОК. Сохранил задачу'
     title: str
 
-    def enter_state(self, update: Update) -> Locator | None:  # noqa
-        message = send_text_message(
-            text='ОК. Опиши суть задачи.',
-            chat_id=self.chat_id,
-            keyboard=[[InlineKeyboardButton('Отмена', callback_data='cancel')]],
-        )
-        context = session_repository.get_user_context(update.chat_id)
-        context['last_message_id'] = message.message_id
-
     def handle_text_message(self, message_text: str) -> Locator:
-        Todo.create_for_user(
-            user_id=self.chat_id,
-            title=self.title,
-            content=message_text
-        )
-        send_text_message(
-            text='ОК. Сохранил задачу',
-            chat_id=self.chat_id,
-        )
+        Todo.create_for_user(user_id=self.chat_id, title=self.title, content=message_text)
+        send_text_message(self.saved_text, self.chat_id)
+        return Locator('/')
+
+    async def ahandle_text_message(self, message_text: str) -> Locator:
+        await Todo.acreate_for_user(user_id=self.chat_id, title=self.title, content=message_text)
+        await asend_text_message(self.saved_text, self.chat_id)
         return Locator('/')
 
     def handle_inline_buttons(self, callback_data: str) -> Locator | None:
         if callback_data == 'cancel':
             return Locator('/')
 
-    def exit_state(self, update: Update) -> None:
-        super().exit_state(update)
-        context = session_repository.get_user_context(update.chat_id)
-        if message_id := context.pop('last_message_id', None):
-            edit_inline_keyboard(
-                update.chat_id,
-                message_id,  # noqa
-                keyboard=None,
-            )
+
+@router.register('/search/')
+class SearchState(PromptState):
+    prompt = 'Что ищем? Пришли слова из названия или описания задачи.'
+    results_limit: int = 10
+
+    @staticmethod
+    def get_message(query: str, todos: list[Todo]) -> tuple[str, list[list[InlineKeyboardButton]]]:
+        if todos:
+            text = f'Вот что нашел по запросу «{query}».\nМожешь прислать другой запрос.'
+        else:
+            text = f'По запросу «{query}» ничего не нашел.\nПопробуй другие слова.'
+        keyboard = [
+            [InlineKeyboardButton(textwrap.shorten(str(todo), 40, placeholder='...'), callback_data=str(todo.id))]
+            for todo in todos
+        ]
+        keyboard.append([InlineKeyboardButton('Вернуться к списку', callback_data='back')])
+        return text, keyboard
+
+    def handle_text_message(self, message_text: str) -> Locator | None:
+        # The user stays in the search to try other words
+        todos = Todo.search_for_user(self.chat_id, message_text, limit=self.results_limit)
+        self.send_prompt(*self.get_message(message_text, todos))
+
+    async def ahandle_text_message(self, message_text: str) -> Locator | None:
+        todos = await Todo.asearch_for_user(self.chat_id, message_text, limit=self.results_limit)
+        await self.asend_prompt(*self.get_message(message_text, todos))
+
+    def handle_inline_buttons(self, callback_data: str) -> Locator | None:
+        if callback_data in ('cancel', 'back'):
+            return Locator('/')
+        if callback_data.isdigit():
+            return Locator('/todo/', {'todo_id': int(callback_data)})
 
 
 @router.register('/todo/')
@@ -216,32 +374,29 @@ class TodoState(DestroyInlineKeyboardMixin, BaseState):
     todo_id: int
 
     def enter_state(self, update: Update) -> Locator | None:
-        todo = Todo.get_by_id(self.todo_id)
-        if not todo:
+        if not (todo := Todo.get_by_id(self.todo_id)):
             return Locator('/')
+        text, keyboard = self.get_message(todo)
+        send_text_message(text, self.chat_id, keyboard, parse_mode='HTML')
 
-        text = f'<b>{todo}</b>\n\n{todo.content}'
-        keyboard_modes = ('normal', 'done')
-        send_text_message(
-            text,
-            update.chat_id,
-            self.get_keyboard(keyboard_modes[todo.is_done]),
-            parse_mode='HTML'
-        )
-
-    def mark_todo_as_done(self, is_done: bool) -> Locator:
-        Todo.update(self.todo_id, is_done=is_done)
-        return Locator('/')
+    async def aenter_state(self, update: Update) -> Locator | None:
+        if not (todo := await Todo.aget_by_id(self.todo_id)):
+            return Locator('/')
+        text, keyboard = self.get_message(todo)
+        await asend_text_message(text, self.chat_id, keyboard, parse_mode='HTML')
 
-    def delete_todo(self) -> Locator:
-        Todo.delete(self.todo_id)
-        return Locator('/')
+    def get_message(self, todo: Todo) -> tuple[str, list]:
+        text = f'<b>{todo}</b>\n\n{todo.content}'
+        if todo.due_at:
+            text += f'\n\nСрок: {format_due_at(todo.due_at)}'
+        return text, self.get_keyboard('done' if todo.is_done else 'normal')
 
     @staticmethod
     def get_keyboard(mode: Literal['normal', 'edit', 'done']):
         if mode == 'edit':
             return [
                 [('Редактировать название', 'edit_title'), ('Редактировать содержимое', 'edit_content')],
+                [('Изменить срок', 'edit_due')],
                 [('Отмена', 'cancel_edit')],
             ]
 
@@ -258,102 +413,123 @@ class TodoState(DestroyInlineKeyboardMixin, BaseState):
                 [('Вернуться к списку', 'back')],
             ]
 
-    def switch_keyboard_to_edit_mode(self, update: Update):
-        edit_inline_keyboard(
-            update.chat_id,
-            update.callback_query.message.message_id,
-            self.get_keyboard('edit'),
-        )
-
-    def switch_keyboard_to_normal_mode(self, update: Update):
-        edit_inline_keyboard(
-            update.chat_id,
-            update.callback_query.message.message_id,
-            self.get_keyboard('normal'),
-        )
-
     def process(self, update: Update) -> Locator | None:
         if not update.callback_query:
             return
 
-        match update.callback_query.data:
-            case 'done':
-                return self.mark_todo_as_done(True)
-            case 'undone':
-                return self.mark_todo_as_done(False)
-            case 'edit':
-                self.switch_keyboard_to_edit_mode(update)
+        match callback_data := update.callback_query.data:
+            case 'done' | 'undone':
+                Todo.update(self.todo_id, is_done=callback_data == 'done')
+            case 'delete':
+                Todo.delete(self.todo_id)
+            case 'edit' | 'cancel_edit':
+                edit_inline_keyboard(
+                    self.chat_id,
+                    update.callback_query.message.message_id,
+                    self.get_keyboard('edit' if callback_data == 'edit' else 'normal'),
+                    wait=False,
+                )
+        return self.get_next_locator(callback_data)
+
+    async def aprocess(self, update: Update) -> Locator | None:
+        if not update.callback_query:
+            return
+
+        match callback_data := update.callback_query.data:
+            case 'done' | 'undone':
+                await Todo.aupdate(self.todo_id, is_done=callback_data == 'done')
+            case 'delete':
+                await Todo.adelete(self.todo_id)
+            case 'edit' | 'cancel_edit':
+                await aedit_inline_keyboard(
+                    self.chat_id,
+                    update.callback_query.message.message_id,
+                    self.get_keyboard('edit' if callback_data == 'edit' else 'normal'),
+                    wait=False,
+                )
+        return self.get_next_locator(callback_data)
+
+    def get_next_locator(self, callback_data: str) -> Locator | None:
+        match callback_data:
+            case 'done' | 'undone' | 'delete' | 'back':
+                return Locator('/')
             case 'edit_title':
                 return Locator('/todo/edit/title/', {'todo_id': self.todo_id})
             case 'edit_content':
                 return Locator('/todo/edit/content/', {'todo_id': self.todo_id})
-            case 'cancel_edit':
-                self.switch_keyboard_to_normal_mode(update)
-            case 'delete':
-                return self.delete_todo()
-            case 'back':
-                return Locator('/')
+            case 'edit_due':
+                return Locator('/todo/edit/due/', {'todo_id': self.todo_id})
 
 
-@router.register('/todo/edit/title/')
-class EditTodoTitleState(DestroyInlineKeyboardMixin, ClassicState):
+class EditTodoState(PromptState):
+    """Asks for a new value of a todo field and returns to the todo."""
     todo_id: int
 
-    def enter_state(self, update: Update) -> Locator | None:  # noqa
-        message = send_text_message(
-            'Как переименовать задачу?',
-            update.chat_id,
-            keyboard=[[InlineKeyboardButton('Отмена', callback_data='cancel')]],
-        )
-        context = session_repository.get_user_context(update.chat_id)
-        context['last_message_id'] = message.message_id
-
-    def handle_text_message(self, message_text: str) -> Locator | None:
-        Todo.update(todo_id=self.todo_id, title=message_text)
+    def get_todo_locator(self) -> Locator:
         return Locator('/todo/', {'todo_id': self.todo_id})
 
     def handle_inline_buttons(self, callback_data: str) -> Locator | None:
         if callback_data == 'cancel':
-            return Locator('/todo/', {'todo_id': self.todo_id})
+            return self.get_todo_locator()
 
-    def exit_state(self, update: Update) -> None:
-        super().exit_state(update)
-        context = session_repository.get_user_context(update.chat_id)
-        if message_id := context.pop('last_message_id', None):
-            edit_inline_keyboard(
-                update.chat_id,
-                message_id,  # noqa
-                keyboard=None,
-            )
+
+class EditTodoTextState(EditTodoState):
+    field: ClassVar[Literal['title', 'content']]
+
+    def handle_text_message(self, message_text: str) -> Locator | None:
+        Todo.update(todo_id=self.todo_id, **{self.field: message_text})
+        return self.get_todo_locator()
+
+    async def ahandle_text_message(self, message_text: str) -> Locator | None:
+        await Todo.aupdate(todo_id=self.todo_id, **{self.field: message_text})
+        return self.get_todo_locator()
+
+
+@router.register('/todo/edit/title/')
+class EditTodoTitleState(EditTodoTextState):
+    prompt = 'Как переименовать задачу?'
+    field = 'title'
 
 
 @router.register('/todo/edit/content/')
-class EditTodoContentState(DestroyInlineKeyboardMixin, ClassicState):
-    todo_id: int
+class EditTodoContentState(EditTodoTextState):
+    prompt = 'Пришли новое описание'
+    field = 'content'
 
-    def enter_state(self, update: Update) -> Locator | None:  # noqa
-        message = send_text_message(
-            'Пришли новое описание',
-            update.chat_id,
-            keyboard=[[InlineKeyboardButton('Отмена', callback_data='cancel')]],
-        )
-        context = session_repository.get_user_context(update.chat_id)
-        context['last_message_id'] = message.message_id
+
+@router.register('/todo/edit/due/')
+class EditTodoDueState(EditTodoState):
+    prompt = 'Когда напомнить о задаче? Пришли дату и время, например 31.12 18:00, или только время.'
+    invalid_date_text: ClassVar[str] = 'Не понял дату. Пришли ее так: 31.12 18:00'
+
+    def get_prompt_keyboard(self) -> list[list[InlineKeyboardButton]]:
+        return [[
+            InlineKeyboardButton('Убрать срок', callback_data='remove'),
+            InlineKeyboardButton('Отмена', callback_data='cancel'),
+        ]]
 
     def handle_text_message(self, message_text: str) -> Locator | None:
-        Todo.update(todo_id=self.todo_id, content=message_text)
-        return Locator('/todo/', {'todo_id': self.todo_id})
+        if not (due_at := parse_due_at(message_text)):
+            send_text_message(self.invalid_date_text, self.chat_id)
+            return
+        Todo.set_due_at(self.todo_id, due_at)
+        return self.get_todo_locator()
 
-    def handle_inline_buttons(self, callback_data: str) -> Locator | None:
-        if callback_data == 'cancel':
-            return Locator('/todo/', {'todo_id': self.todo_id})
+    async def ahandle_text_message(self, message_text: str) -> Locator | None:
+        if not (due_at := parse_due_at(message_text)):
+            await asend_text_message(self.invalid_date_text, self.chat_id)
+            return
+        await Todo.aset_due_at(self.todo_id, due_at)
+        return self.get_todo_locator()
 
-    def exit_state(self, update: Update) -> None:
-        super().exit_state(update)
-        context = session_repository.get_user_context(update.chat_id)
-        if message_id := context.pop('last_message_id', None):
-            edit_inline_keyboard(
-                update.chat_id,
-                message_id,  # noqa
-                keyboard=None,
-            )
+    def handle_inline_buttons(self, callback_data: str) -> Locator | None:
+        if callback_data == 'remove':
+            Todo.set_due_at(self.todo_id, None)
+            return self.get_todo_locator()
+        return super().handle_inline_buttons(callback_data)
+
+    async def ahandle_inline_buttons(self, callback_data: str) -> Locator | None:
+        if callback_data == 'remove':
+            await Todo.aset_due_at(self.todo_id, None)
+            return self.get_todo_locator()
+        return super().handle_inline_buttons(callback_data)
@@ -0,0 +1,14 @@
+import pytest
+
+from ..repositories import session_scope
+from ..repositories.models import Base, todo_cache
+
+
+@pytest.fixture
+def database():
+    """Empty the tables and the todo cache after the test."""
+    yield
+    with session_scope() as session:
+        for table in reversed(Base.metadata.sorted_tables):
+            session.execute(table.delete())
+    todo_cache.clear()
@@ -0,0 +1,188 @@
+import asyncio
+import os
+
+import pytest
+from sqlalchemy import create_engine, inspect, select, text
+from sqlalchemy.exc import OperationalError
+
+from ..repositories import (
+    Todo,
+    async_session_scope,
+    configure,
+    configure_async,
+    get_async_dsn,
+    get_dsn,
+    get_engine,
+    session_scope,
+)
+from ..repositories.db import after_transaction
+from ..repositories.models import upgrade_schema
+
+
+def make_todo(title: str) -> Todo:
+    return Todo(title=title, content='', is_done=False, tg_user_id=1)
+
+
+def test_get_dsn(monkeypatch):
+    monkeypatch.delenv('DB_DSN', raising=False)
+    monkeypatch.delenv('POSTGRES_DSN', raising=False)
+    assert get_dsn() == 'sqlite:///db.db'
+
+    # Heroku style URLs are rewritten for SQLAlchemy
+    monkeypatch.setenv('POSTGRES_DSN', 'postgres://bot:secret@db:5432/todos')
+    assert get_dsn() == 'postgresql://bot:secret@db:5432/todos'
+
+    monkeypatch.setenv('DB_DSN', 'sqlite:///other.db')
+    assert get_dsn() == 'sqlite:///other.db'
+
+
+def test_get_async_dsn():
+    assert get_async_dsn('sqlite:///db.db') == 'sqlite+aiosqlite:///db.db'
+    assert get_async_dsn('postgresql://bot:secret@db:5432/todos') == 'postgresql+asyncpg://bot:secret@db:5432/todos'
+    assert get_async_dsn('postgresql+psycopg2://bot@db/todos') == 'postgresql+asyncpg://bot@db/todos'
+    with pytest.raises(ValueError):
+        get_async_dsn('mysql://bot@db/todos')
+
+
+def check_session_scope() -> None:
+    transactions = []
+    with session_scope() as session:
+        session.add(make_todo('Committed'))
+        after_transaction(session, transactions.append)
+        # Nested scopes share the session of the outermost one
+        with session_scope() as nested_session:
+            assert nested_session is session
+
+    with pytest.raises(ValueError), session_scope() as session:
+        session.add(make_todo('Rolled back'))
+        session.flush()
+        after_transaction(session, transactions.append)
+        raise ValueError('Broken update')
+
+    assert transactions == [True, False]
+    with session_scope() as session:
+        assert session.scalars(select(Todo.title)).all() == ['Committed']
+
+
+async def acheck_async_session_scope() -> None:
+    transactions = []
+    async with async_session_scope() as session:
+        session.add(make_todo('Committed async'))
+        after_transaction(session, transactions.append)
+        async with async_session_scope() as nested_session:
+            assert nested_session is session
+
+    with pytest.raises(ValueError):
+        async with async_session_scope() as session:
+            session.add(make_todo('Rolled back async'))
+            await session.flush()
+            after_transaction(session, transactions.append)
+            raise ValueError('Broken update')
+
+    assert transactions == [True, False]
+    async with async_session_scope() as session:
+        assert (await session.scalars(select(Todo.title))).all() == ['Committed async']
+
+
+def test_session_scope(database):
+    check_session_scope()
+
+
+def test_async_session_scope_on_aiosqlite(database):
+    async def main():
+        engine = configure_async(get_async_dsn(get_dsn()))
+        try:
+            await acheck_async_session_scope()
+        finally:
+            await engine.dispose()
+
+    asyncio.run(main())
+
+
+# Table of the first release, before the indexes, reminders and search
+BASELINE_TODOS_DDL = """
+CREATE TABLE todos (
+    id INTEGER NOT NULL,
+    title VARCHAR(64) NOT NULL,
+    content VARCHAR NOT NULL,
+    is_done BOOLEAN NOT NULL,
+    tg_user_id BIGINT NOT NULL,
+    PRIMARY KEY (id),
+    UNIQUE (id)
+)
+"""
+
+
+def get_query_plan(connection, query) -> str:
+    sql = query.compile(connection, compile_kwargs={'literal_binds': True})
+    return '\n'.join(row.detail for row in connection.execute(text(f'EXPLAIN QUERY PLAN {sql}')))
+
+
+def test_upgrade_schema_of_baseline_database(tmp_path):
+    engine = create_engine(f'sqlite:///{tmp_path}/baseline.db')
+    with engine.begin() as connection:
+        connection.execute(text(BASELINE_TODOS_DDL))
+        connection.execute(text("INSERT INTO todos VALUES (1, 'Existing todo', 'Content', 0, 1)"))
+
+    try:
+        # Upgrade is repeated on every start
+        upgrade_schema(engine)
+        upgrade_schema(engine)
+
+        inspector = inspect(engine)
+        assert {'due_at', 'is_reminded'} <= {column['name'] for column in inspector.get_columns('todos')}
+        assert {index['name'] for index in inspector.get_indexes('todos')} >= {
+            'ix_todos_tg_user_id_is_done_id',
+            'ix_todos_due_at',
+        }
+        assert 'todos_fts' in inspector.get_table_names()
+
+        with engine.connect() as connection:
+            assert connection.execute(text('SELECT due_at, is_reminded FROM todos')).all() == [(None, False)]
+            for only_active in (False, True):
+                query, _ = Todo._select_page_for_user(1, 5, only_active, 1, None, False, 0)
+                assert 'ix_todos_tg_user_id_is_done_id' in get_query_plan(connection, query)
+    finally:
+        engine.dispose()
+
+
+@pytest.fixture
+def postgres_dsn():
+    """DSN of a disposable PostgreSQL database given by `TEST_POSTGRES_DSN`, the test is skipped without it."""
+    if not (dsn := os.getenv('TEST_POSTGRES_DSN')):
+        pytest.skip('TEST_POSTGRES_DSN is not set')
+    pytest.importorskip('psycopg2')
+    engine = create_engine(dsn)
+    try:
+        with engine.connect():
+            pass
+    except OperationalError as ex:
+        pytest.skip(f'PostgreSQL server is not available: {ex}')
+    finally:
+        engine.dispose()
+
+    sqlite_dsn = get_dsn()
+    configure(dsn)
+    upgrade_schema(get_engine())
+    yield dsn
+    with session_scope() as session:
+        session.execute(Todo.__table__.delete())
+    configure(sqlite_dsn)
+
+
+def test_session_scope_on_postgresql(postgres_dsn):
+    assert get_engine().dialect.name == 'postgresql'
+    check_session_scope()
+
+
+def test_async_session_scope_on_asyncpg(postgres_dsn):
+    pytest.importorskip('asyncpg')
+
+    async def main():
+        engine = configure_async(get_async_dsn(postgres_dsn))
+        try:
+            await acheck_async_session_scope()
+        finally:
+            await engine.dispose()
+
+    asyncio.run(main())
@@ -0,0 +1,75 @@
+from time import monotonic
+
+import pytest
+from sqlalchemy import select
+
+from ..repositories import GroupCommitWriter, Todo, session_scope
+
+
+def add_todo(title: str):
+    def write(session):
+        session.add(Todo(title=title, content='', is_done=False, tg_user_id=1))
+        session.flush()
+        return title
+
+    return write
+
+
+def fail(session):
+    raise ValueError('Broken write')
+
+
+def get_titles() -> list[str]:
+    with session_scope() as session:
+        return sorted(session.scalars(select(Todo.title)))
+
+
+def test_batch_is_committed_when_full(database):
+    with GroupCommitWriter.setup(max_batch_size=3, max_delay=60) as writer:
+        futures = [writer.submit(add_todo(title)) for title in ('A', 'B', 'C')]
+        assert [future.result(timeout=5) for future in futures] == ['A', 'B', 'C']
+        stats = writer.get_stats()
+
+    assert stats.batches == 1
+    assert stats.operations == 3
+    assert get_titles() == ['A', 'B', 'C']
+
+
+def test_batch_is_committed_after_max_delay(database):
+    with GroupCommitWriter.setup(max_batch_size=100, max_delay=0.05) as writer:
+        submitted_at = monotonic()
+        future = writer.submit(add_todo('A'))
+        assert future.result(timeout=5) == 'A'
+        assert monotonic() - submitted_at >= 0.04
+        assert writer.get_stats().batches == 1
+
+    assert get_titles() == ['A']
+
+
+def test_failed_operation_raises_only_to_its_caller(database):
+    with GroupCommitWriter.setup(max_batch_size=3, max_delay=60) as writer:
+        first_future = writer.submit(add_todo('A'))
+        failed_future = writer.submit(fail)
+        last_future = writer.submit(add_todo('B'))
+
+        assert first_future.result(timeout=5) == 'A'
+        assert last_future.result(timeout=5) == 'B'
+        with pytest.raises(ValueError):
+            failed_future.result(timeout=5)
+        stats = writer.get_stats()
+
+    assert stats.operations == 3
+    assert stats.failed_operations == 1
+    assert get_titles() == ['A', 'B']
+
+
+def test_stop_commits_pending_operations(database):
+    writer = GroupCommitWriter(max_batch_size=100, max_delay=60)
+    writer.start()
+    futures = [writer.submit(add_todo(title)) for title in ('A', 'B')]
+    writer.stop()
+
+    assert all(future.done() for future in futures)
+    assert get_titles() == ['A', 'B']
+    with pytest.raises(RuntimeError):
+        writer.submit(add_todo('C'))
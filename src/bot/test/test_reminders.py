@@ -0,0 +1,27 @@
+from datetime import datetime
+
+import pytest
+
+from ..reminders import parse_due_at
+
+# 15:00 in the time zone of the users, UTC+3
+NOW = datetime(2028, 3, 1, 12)
+
+
+@pytest.mark.parametrize('text, due_at', [
+    ('18:00', datetime(2028, 3, 1, 15)),
+    ('10:00', datetime(2028, 3, 2, 7)),
+    ('02.03 9.30', datetime(2028, 3, 2, 6, 30)),
+    ('01.03 10:00', datetime(2029, 3, 1, 7)),
+    ('31.12.27 18:00', datetime(2027, 12, 31, 15)),
+    ('29.02.2028 10:00', datetime(2028, 2, 29, 7)),
+    # The leap day of this year has passed, the next one is in 2032
+    ('29.02 10:00', datetime(2032, 2, 29, 7)),
+])
+def test_parse_due_at(text, due_at):
+    assert parse_due_at(text, NOW) == due_at
+
+
+@pytest.mark.parametrize('text', ['tomorrow', '25:00', '31.04 10:00', '29.02.2027 10:00', '32.01.2028 10:00'])
+def test_parse_due_at_rejects_invalid_dates(text):
+    assert parse_due_at(text, NOW) is None
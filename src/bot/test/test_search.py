@@ -0,0 +1,95 @@
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import Session
+
+from ..repositories import Todo, get_engine
+from ..repositories import models, search
+from ..repositories.models import upgrade_schema
+
+USER_ID = 1
+
+
+def create_todos(*todos: tuple[str, str]) -> list[int]:
+    for title, content in todos:
+        Todo.create_for_user(USER_ID, title, content)
+    return [todo.id for todo in Todo.get_all_for_user(USER_ID)]
+
+
+def search_titles(query: str) -> list[str]:
+    return [todo.title for todo in Todo.search_for_user(USER_ID, query, limit=10)]
+
+
+def get_indexed_ids(bind, query: str) -> list[int]:
+    """Return ids matched by the FTS index itself, the join with todos would hide its stale rows."""
+    statement = text(f'SELECT rowid FROM {search.FTS_TABLE} WHERE {search.FTS_TABLE} MATCH :query ORDER BY rowid')
+    with bind.connect() as connection:
+        return list(connection.scalars(statement, {'query': query}))
+
+
+def test_title_matches_rank_first(database, monkeypatch):
+    create_todos(
+        ('Groceries', 'milk, milk and more milk'),
+        ('Milk', 'from the farm shop'),
+        ('Cleaning', 'wash the floor'),
+    )
+
+    assert search_titles('milk') == ['Milk', 'Groceries']
+    # Without the title weight the repeated word in the content wins
+    monkeypatch.setattr(search, 'TITLE_WEIGHT', search.CONTENT_WEIGHT)
+    assert search_titles('milk') == ['Groceries', 'Milk']
+
+
+def test_all_words_match_as_prefixes(database):
+    create_todos(('Call plumber', 'kitchen sink'), ('Call mom', 'birthday'))
+
+    assert search_titles('plumb kitch') == ['Call plumber']
+    assert sorted(search_titles('call')) == ['Call mom', 'Call plumber']
+    assert search_titles('call dentist') == []
+    assert search_titles('?!') == []
+
+
+def test_index_follows_updates_and_deletes(database):
+    renamed_id, deleted_id = create_todos(('Old title', 'Old content'), ('Deleted', 'Content'))
+
+    Todo.update(renamed_id, title='New title', content='New content')
+    Todo.update(renamed_id, is_done=True)
+    Todo.delete(deleted_id)
+
+    assert get_indexed_ids(get_engine(), 'old') == []
+    assert get_indexed_ids(get_engine(), 'new') == [renamed_id]
+    assert get_indexed_ids(get_engine(), 'deleted') == []
+    assert search_titles('new') == ['New title']
+    assert search_titles('deleted') == []
+
+
+def test_index_is_built_for_existing_todos(tmp_path):
+    engine = create_engine(f'sqlite:///{tmp_path}/existing.db')
+    try:
+        with engine.begin() as connection:
+            Todo.__table__.create(connection)
+            connection.execute(Todo.__table__.insert(), [
+                {'title': 'Existing todo', 'content': 'Content', 'is_done': False, 'tg_user_id': USER_ID},
+            ])
+
+        upgrade_schema(engine)
+
+        assert get_indexed_ids(engine, 'existing') == [1]
+        with Session(engine) as session:
+            statement = Todo._select_search_for_user(USER_ID, 'existing', limit=10)
+            assert [todo.title for todo in session.scalars(statement)] == ['Existing todo']
+    finally:
+        engine.dispose()
+
+
+def test_substring_search_without_full_text_index(database, monkeypatch):
+    monkeypatch.setattr(models, 'is_full_text_search_supported', lambda bind: False)
+    create_todos(('Buy MILK', 'and bread'), ('Bake bread', 'no milk'), ('100% done', 'Content'))
+
+    statement = Todo._select_search_for_user(USER_ID, 'milk', limit=10)
+    assert search.FTS_TABLE not in str(statement)
+    # Case-insensitive substrings of the title or the content, all the words have to match
+    assert search_titles('milk') == ['Buy MILK', 'Bake bread']
+    assert search_titles('ilk brea') == ['Buy MILK', 'Bake bread']
+    assert search_titles('milk bake') == ['Bake bread']
+    # Wildcards of LIKE are matched literally
+    assert search_titles('100') == ['100% done']
+    assert search_titles('_') == []
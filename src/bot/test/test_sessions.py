@@ -0,0 +1,193 @@
+from time import monotonic, sleep
+
+import pytest
+
+from core.state_machine import Locator
+from ..repositories import MemorySessionRepository, SqlSessionRepository, session_scope
+from ..repositories import sessions
+from ..repositories.models import UserSession
+
+
+def wait_for(condition, timeout: float = 5) -> bool:
+    deadline = monotonic() + timeout
+    while not condition():
+        if monotonic() > deadline:
+            return False
+        sleep(0.005)
+    return True
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(sessions, 'monotonic', clock)
+    return clock
+
+
+def get_saved_locators() -> dict[int, Locator]:
+    with session_scope() as session:
+        return {row.user_id: Locator(*row.locator) for row in session.query(UserSession)}
+
+
+def test_changes_of_session_are_coalesced(database):
+    repository = SqlSessionRepository(flush_interval=60)
+    with repository.write_behind():
+        for todo_id in range(5):
+            repository.save_user_locator(1, Locator('/todo/', {'todo_id': todo_id}))
+        repository.get_user_context(1)['page'] = 2
+        assert repository.get_writer_stats().pending == 1
+
+    stats = repository.get_writer_stats()
+    assert stats.flushes == 1
+    assert stats.written == 1
+    assert get_saved_locators() == {1: Locator('/todo/', {'todo_id': 4})}
+
+
+def test_full_batch_is_flushed_at_once(database):
+    repository = SqlSessionRepository(flush_interval=60, max_batch_size=3)
+    with repository.write_behind():
+        for user_id in range(3):
+            repository.save_user_locator(user_id, Locator('/'))
+        assert wait_for(lambda: repository.get_writer_stats().flushes == 1)
+        assert len(get_saved_locators()) == 3
+
+
+def test_failed_flush_keeps_sessions_dirty(database, monkeypatch):
+    def fail(session, rows):
+        raise RuntimeError('Database is down')
+
+    monkeypatch.setattr(sessions, 'upsert_user_sessions', fail)
+    repository = SqlSessionRepository(flush_interval=60, max_batch_size=1)
+    repository.start()
+    repository.save_user_locator(1, Locator('/'))
+    assert wait_for(lambda: repository.get_writer_stats().failed_flushes == 1)
+    assert repository.get_writer_stats().pending == 1
+
+    monkeypatch.undo()
+    repository.stop()
+    assert get_saved_locators() == {1: Locator('/')}
+
+
+def test_stop_raises_when_sessions_are_not_saved(database, monkeypatch):
+    def fail(session, rows):
+        raise RuntimeError('Database is down')
+
+    monkeypatch.setattr(sessions, 'upsert_user_sessions', fail)
+    repository = SqlSessionRepository(flush_interval=60)
+    repository.start()
+    repository.save_user_locator(1, Locator('/'))
+    with pytest.raises(RuntimeError, match='Sessions of 1 users are not saved'):
+        repository.stop()
+
+
+def test_stop_saves_dirty_sessions(database):
+    repository = SqlSessionRepository(flush_interval=60)
+    with repository.write_behind():
+        repository.save_user_locator(1, Locator('/'))
+        repository.save_user_locator(2, Locator('/todo/', {'todo_id': 7}))
+        assert get_saved_locators() == {}
+
+    assert get_saved_locators() == {1: Locator('/'), 2: Locator('/todo/', {'todo_id': 7})}
+
+
+def test_session_is_loaded_by_new_repository(database):
+    repository = SqlSessionRepository(flush_interval=60)
+    with repository.write_behind():
+        repository.save_user_locator(1, Locator('/'))
+        repository.save_user_locator(1, Locator('/todo/', {'todo_id': 7}))
+        repository.get_user_context(1)['page'] = 2
+
+    restarted_repository = SqlSessionRepository()
+    assert restarted_repository.get_locator_by_user_id(1) == Locator('/todo/', {'todo_id': 7})
+    assert restarted_repository.get_user_history(1) == [Locator('/'), Locator('/todo/', {'todo_id': 7})]
+    assert restarted_repository.get_user_context(1) == {'page': 2}
+    assert restarted_repository.get_locator_by_user_id(2) is None
+    assert restarted_repository.get_writer_stats().loads == 2
+
+
+def test_least_recently_used_sessions_are_evicted():
+    repository = MemorySessionRepository(max_users=2)
+    repository.save_user_locator(1, Locator('/'))
+    repository.save_user_locator(2, Locator('/'))
+    # An access touches the session, the second user becomes the least recently used one
+    repository.get_user_context(1)
+    repository.save_user_locator(3, Locator('/'))
+
+    assert set(repository) == {1, 3}
+    assert repository.get_locator_by_user_id(2) is None
+    assert repository.get_locator_by_user_id(1) == Locator('/')
+    assert repository.get_stats().evictions == 1
+
+
+def test_idle_sessions_expire(clock):
+    repository = MemorySessionRepository(ttl=10)
+    repository.save_user_locator(1, Locator('/'))
+    clock.now = 5
+    repository.save_user_locator(2, Locator('/'))
+    clock.now = 12
+
+    assert repository.get_locator_by_user_id(2) == Locator('/')
+    assert repository.get_locator_by_user_id(1) is None
+    assert set(repository) == {2}
+    assert repository.get_stats().expirations == 1
+
+
+def test_session_repository_stats():
+    repository = MemorySessionRepository(max_users=2)
+    repository.save_user_locator(1, Locator('/'))
+    repository.save_user_locator(1, Locator('/todo/', {'todo_id': 7}))
+    repository.save_user_locator(2, Locator('/'))
+    repository.save_user_locator(3, Locator('/'))
+    assert repository.get_locator_by_user_id(1) is None
+
+    stats = repository.get_stats()
+    assert stats.users == 2
+    assert stats.hits == 1
+    assert stats.misses == 4
+    assert stats.evictions == 1
+    assert stats.expirations == 0
+    assert stats.history_items == 2
+    assert stats.approx_bytes > 0
+
+
+def test_evicted_session_is_loaded_from_table(database):
+    repository = SqlSessionRepository(max_users=1, flush_interval=60)
+    with repository.write_behind():
+        repository.save_user_locator(1, Locator('/todo/', {'todo_id': 7}))
+        repository.get_user_context(1)['page'] = 2
+        # The first session is evicted before it is saved, it is kept aside until the flush
+        repository.save_user_locator(2, Locator('/'))
+        assert set(repository) == {2}
+        assert repository.get_locator_by_user_id(1) == Locator('/todo/', {'todo_id': 7})
+        assert repository.get_user_context(1) == {'page': 2}
+        assert repository.get_writer_stats().loads == 2
+
+    # Saved sessions are loaded from the table after an eviction
+    assert set(repository) == {1}
+    assert repository.get_locator_by_user_id(2) == Locator('/')
+    assert repository.get_writer_stats().loads == 3
+    assert repository.get_stats().evictions == 3
+
+
+def test_users_without_session_are_forgotten(database, clock):
+    repository = SqlSessionRepository(max_users=2, ttl=10)
+
+    def count_loads(user_id: int) -> int:
+        loads = repository.get_writer_stats().loads
+        assert repository.get_locator_by_user_id(user_id) is None
+        return repository.get_writer_stats().loads - loads
+
+    assert [count_loads(user_id) for user_id in range(3)] == [1, 1, 1]
+    # Users without a session are looked up once until they are pushed out by newer ones or expire
+    assert count_loads(2) == 0
+    assert count_loads(0) == 1
+    clock.now = 10
+    assert count_loads(0) == 1
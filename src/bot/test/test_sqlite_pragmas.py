@@ -0,0 +1,81 @@
+import asyncio
+import sqlite3
+
+import pytest
+from sqlalchemy import text
+
+from ..repositories import configure, configure_async, get_async_dsn, get_dsn, get_sqlite_pragmas
+from ..repositories.sqlite_pragmas import apply_sqlite_pragmas
+
+# journal_mode, synchronous (0 OFF, 1 NORMAL, 2 FULL) and busy_timeout read back from a new connection,
+# the driver sets the busy timeout of the legacy profile to its default 5 seconds
+EXPECTED_PRAGMAS = {
+    'legacy': ('delete', 2, 5000),
+    'durable': ('wal', 2, 5000),
+    'balanced': ('wal', 1, 5000),
+}
+READ_PRAGMAS = 'SELECT * FROM pragma_journal_mode, pragma_synchronous, pragma_busy_timeout'
+
+
+@pytest.fixture
+def reconfigure():
+    """Configure the engine for the test, the engine of the tests is restored after it."""
+    yield configure
+    configure(get_dsn())
+
+
+@pytest.mark.parametrize('profile', EXPECTED_PRAGMAS)
+def test_profile_is_applied_to_new_connections(profile, tmp_path, reconfigure):
+    engine = reconfigure(f'sqlite:///{tmp_path}/{profile}.db', sqlite_pragmas=get_sqlite_pragmas(profile))
+    with engine.connect() as connection:
+        assert tuple(connection.execute(text(READ_PRAGMAS)).one()) == EXPECTED_PRAGMAS[profile]
+
+
+def test_profile_is_applied_to_new_async_connections(tmp_path):
+    async def main():
+        engine = configure_async(
+            get_async_dsn(f'sqlite:///{tmp_path}/durable.db'),
+            sqlite_pragmas=get_sqlite_pragmas('durable'),
+        )
+        try:
+            async with engine.connect() as connection:
+                return tuple((await connection.execute(text(READ_PRAGMAS))).one())
+        finally:
+            await engine.dispose()
+
+    assert asyncio.run(main()) == EXPECTED_PRAGMAS['durable']
+
+
+def test_get_sqlite_pragmas():
+    pragmas = get_sqlite_pragmas('durable', 'synchronous=NORMAL, cache_size=-2000')
+    assert pragmas == {'journal_mode': 'WAL', 'synchronous': 'NORMAL', 'busy_timeout': 5000, 'cache_size': '-2000'}
+    # Profiles are not changed by overrides
+    assert get_sqlite_pragmas('durable')['synchronous'] == 'FULL'
+
+    with pytest.raises(ValueError):
+        get_sqlite_pragmas('fast')
+
+
+@pytest.mark.parametrize('pragmas', [
+    {'journal-mode': 'WAL'},
+    {'journal_mode; DROP TABLE todos': 'WAL'},
+    {'synchronous': 'FULL; DROP TABLE todos'},
+    {'cache_size': '-20.5'},
+    {'temp_store': ''},
+])
+def test_invalid_pragmas_are_rejected(pragmas):
+    connection = sqlite3.connect(':memory:')
+    try:
+        with pytest.raises(ValueError):
+            apply_sqlite_pragmas(connection, pragmas)
+    finally:
+        connection.close()
+
+
+def test_engine_rejects_invalid_pragma_overrides(tmp_path, reconfigure):
+    engine = reconfigure(
+        f'sqlite:///{tmp_path}/invalid.db',
+        sqlite_pragmas=get_sqlite_pragmas('balanced', 'synchronous=OFF;PRAGMA writable_schema=ON'),
+    )
+    with pytest.raises(ValueError):
+        engine.connect()
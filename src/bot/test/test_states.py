@@ -0,0 +1,249 @@
+import asyncio
+import json
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from time import perf_counter
+
+import httpx
+import pytest
+from sqlalchemy import Engine, event
+
+from core.tg_api import AsyncTgClient, SyncTgClient, Update
+from .. import states
+from ..repositories import MemorySessionRepository, Todo, configure_async, get_async_dsn, get_dsn, get_engine
+from ..repositories.models import todo_cache
+from ..states import state_machine
+
+CHAT_ID = 1000
+
+
+class FakeBotServer:
+    """Answers Telegram methods with a message and keeps the requests."""
+
+    def __init__(self):
+        self.requests = []
+
+    def handler(self, request: httpx.Request) -> httpx.Response:
+        method = request.url.path.rsplit('/', 1)[-1].lower()
+        self.requests.append((method, json.loads(request.content)))
+        message = {'message_id': len(self.requests), 'date': 0, 'chat': {'id': CHAT_ID, 'type': 'private'}}
+        return httpx.Response(200, json={'ok': True, 'result': message})
+
+
+class Bot:
+    """Processes updates with the bot state machine in the sync or the async runtime."""
+
+    def __init__(self, runtime: str):
+        self.runtime = runtime
+        self.server = FakeBotServer()
+
+    def process(self, *updates: Update) -> list[str]:
+        """Return SQL statements of the last update."""
+        if self.runtime == 'sync':
+            return self._process(updates)
+        return asyncio.run(self._aprocess(updates))
+
+    def _process(self, updates: tuple[Update, ...]) -> list[str]:
+        session = httpx.Client(transport=httpx.MockTransport(self.server.handler))
+        with SyncTgClient.setup('token', session=session):
+            for update in updates[:-1]:
+                state_machine.process(update)
+            with count_queries(get_engine()) as statements:
+                state_machine.process(updates[-1])
+        return statements
+
+    async def _aprocess(self, updates: tuple[Update, ...]) -> list[str]:
+        engine = configure_async(get_async_dsn(get_dsn()))
+        session = httpx.AsyncClient(transport=httpx.MockTransport(self.server.handler))
+        try:
+            async with AsyncTgClient.setup('token', session=session):
+                for update in updates[:-1]:
+                    await state_machine.aprocess(update)
+                with count_queries(engine.sync_engine) as statements:
+                    await state_machine.aprocess(updates[-1])
+        finally:
+            await engine.dispose()
+        return statements
+
+    def get_sent_texts(self) -> list[str]:
+        return [payload['text'] for method, payload in self.server.requests if method == 'sendmessage']
+
+
+@contextmanager
+def count_queries(engine: Engine):
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+
+
+def make_message_update(text: str) -> Update:
+    return Update.parse_obj({
+        'update_id': 1,
+        'message': {'message_id': 1, 'date': 0, 'chat': {'id': CHAT_ID, 'type': 'private'}, 'text': text},
+    })
+
+
+def make_callback_update(callback_data: str) -> Update:
+    return Update.parse_obj({
+        'update_id': 2,
+        'callback_query': {
+            'id': '1',
+            'from': {'id': CHAT_ID, 'is_bot': False, 'first_name': 'User'},
+            'chat_instance': '1',
+            'message': {'message_id': 1, 'date': 0, 'chat': {'id': CHAT_ID, 'type': 'private'}},
+            'data': callback_data,
+        },
+    })
+
+
+@pytest.fixture
+def sessions(monkeypatch):
+    session_repository = MemorySessionRepository()
+    monkeypatch.setattr(states, 'session_repository', session_repository)
+    monkeypatch.setattr(state_machine, 'session_repository', session_repository)
+    # Todo cache would hide the queries of the states
+    monkeypatch.setattr(todo_cache, 'ttl', 0)
+
+
+@pytest.fixture(params=['sync', 'async'])
+def bot(request, database, sessions) -> Bot:
+    return Bot(request.param)
+
+
+@pytest.fixture
+def todos(database) -> list[Todo]:
+    for number in range(8):
+        Todo.create_for_user(CHAT_ID, f'Todo {number}', 'Content')
+    return Todo.get_all_for_user(CHAT_ID)
+
+
+def get_locator():
+    return state_machine.session_repository.get_locator_by_user_id(CHAT_ID)
+
+
+def test_tap_on_todo_does_not_load_the_list_again(bot, todos):
+    statements = bot.process(make_message_update('/start'), make_callback_update(str(todos[0].id)))
+
+    # Only the tapped todo is loaded, the list is described as it was shown
+    assert len(statements) == 1
+    method, payload = bot.server.requests[-2]
+    assert method == 'editmessagetext'
+    assert payload['text'].splitlines()[3:] == [f'Todo {number}' for number in range(6)]
+    assert bot.server.requests[-1][0] == 'sendmessage'
+
+
+def test_todo_is_added(bot):
+    bot.process(
+        make_message_update('/start'),
+        make_callback_update('add'),
+        make_message_update('Title'),
+        make_message_update('Content'),
+    )
+
+    [todo] = Todo.get_all_for_user(CHAT_ID)
+    assert (todo.title, todo.content, todo.is_done) == ('Title', 'Content', False)
+    assert bot.get_sent_texts()[1:4] == ['Как назовем задачу?', 'ОК. Опиши суть задачи.', 'ОК. Сохранил задачу']
+    # Keyboards of the list and of both prompts are removed once they are answered
+    removed_keyboards = [
+        payload['message_id']
+        for method, payload in bot.server.requests
+        if method == 'editmessagereplymarkup' and payload['reply_markup'] == {'inline_keyboard': [[]]}
+    ]
+    assert removed_keyboards == [1, 3, 5]
+    assert get_locator().state_name == '/'
+
+
+def test_todo_is_edited(bot, todos):
+    todo_id = todos[0].id
+    bot.process(
+        make_message_update('/start'),
+        make_callback_update(str(todo_id)),
+        make_callback_update('edit'),
+        make_callback_update('edit_title'),
+        make_message_update('New title'),
+        make_callback_update('edit_content'),
+        make_message_update('New content'),
+        make_callback_update('edit_due'),
+        make_message_update('not a date'),
+        make_message_update('31.12 18:00'),
+        make_callback_update('done'),
+    )
+
+    todo = Todo.get_by_id(todo_id)
+    assert (todo.title, todo.content, todo.is_done) == ('New title', 'New content', True)
+    assert todo.due_at is not None
+    assert 'Не понял дату. Пришли ее так: 31.12 18:00' in bot.get_sent_texts()
+    assert get_locator().state_name == '/'
+
+
+def test_due_date_is_removed(bot, todos):
+    todo_id = todos[0].id
+    Todo.set_due_at(todo_id, datetime(2030, 1, 1))
+    bot.process(
+        make_message_update('/start'),
+        make_callback_update(str(todo_id)),
+        make_callback_update('edit_due'),
+        make_callback_update('remove'),
+    )
+
+    assert Todo.get_by_id(todo_id).due_at is None
+    assert get_locator() == ('/todo/', {'todo_id': todo_id})
+
+
+def test_todo_is_found_and_deleted(bot, todos):
+    todo_id = todos[3].id
+    bot.process(
+        make_message_update('/search'),
+        make_message_update('nothing'),
+        make_message_update('Todo 3'),
+        make_callback_update(str(todo_id)),
+        make_callback_update('delete'),
+    )
+
+    assert Todo.get_by_id(todo_id) is None
+    texts = bot.get_sent_texts()
+    assert texts[1].startswith('По запросу «nothing» ничего не нашел')
+    assert texts[2].startswith('Вот что нашел по запросу «Todo 3»')
+    assert get_locator().state_name == '/'
+
+
+def test_other_chat_writes_while_message_is_sent(database, sessions, todos):
+    bot = Bot('sync')
+    todo_id = todos[0].id
+    bot.process(make_message_update('/start'), make_callback_update(str(todo_id)))
+
+    sending = threading.Event()
+    sent = threading.Event()
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        sending.set()
+        sent.wait(10)
+        return bot.server.handler(request)
+
+    def mark_todo_as_done():
+        # The list is sent after the todo is updated
+        session = httpx.Client(transport=httpx.MockTransport(handler))
+        with SyncTgClient.setup('token', session=session):
+            state_machine.process(make_callback_update('done'))
+
+    thread = threading.Thread(target=mark_todo_as_done)
+    thread.start()
+    try:
+        assert sending.wait(5)
+        started_at = perf_counter()
+        Todo.create_for_user(CHAT_ID + 1, 'Other chat', 'Content')
+        assert perf_counter() - started_at < 1
+    finally:
+        sent.set()
+        thread.join()
+
+    assert Todo.get_by_id(todo_id).is_done
+    assert [todo.title for todo in Todo.get_all_for_user(CHAT_ID + 1)] == ['Other chat']
@@ -0,0 +1,160 @@
+import pytest
+from sqlalchemy.orm import Session, make_transient_to_detached
+
+from ..repositories import Todo, TodoCache
+from ..repositories import todo_cache as todo_cache_module
+
+
+class CountingLoader:
+    def __init__(self, result):
+        self.result = result
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return self.result
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(todo_cache_module, 'monotonic', clock)
+    return clock
+
+
+def test_results_are_cached():
+    cache = TodoCache()
+    load = CountingLoader(['todo'])
+    assert cache.get_or_load(1, 'all', load) == ['todo']
+    assert cache.get_or_load(1, 'all', load) == ['todo']
+    assert load.calls == 1
+
+    stats = cache.get_stats()
+    assert (stats.hits, stats.misses, stats.users, stats.items) == (1, 1, 1, 1)
+
+
+def test_write_of_other_transaction_blocks_storing():
+    cache = TodoCache()
+    load = CountingLoader(['todo'])
+    cache.begin_write(1, 'writer')
+
+    # Other transactions do not see the uncommitted write, their results are not stored
+    cache.get_or_load(1, 'all', load, 'reader')
+    cache.get_or_load(1, 'all', load, 'reader')
+    assert load.calls == 2
+
+    # The writing transaction reads its own changes, they stay valid once it commits
+    cache.get_or_load(1, 'all', load, 'writer')
+    cache.end_write(1, 'writer', committed=True)
+    cache.get_or_load(1, 'all', load, 'reader')
+    assert load.calls == 3
+
+
+def test_write_during_load_blocks_storing():
+    cache = TodoCache()
+
+    def load():
+        cache.begin_write(1, 'writer')
+        cache.end_write(1, 'writer', committed=True)
+        return ['stale todo']
+
+    cache.get_or_load(1, 'all', load, 'reader')
+    assert cache.get_stats().users == 0
+
+
+def test_rollback_invalidates():
+    cache = TodoCache()
+    load = CountingLoader(['todo'])
+    cache.begin_write(1, 'writer')
+    cache.get_or_load(1, 'all', load, 'writer')
+    cache.end_write(1, 'writer', committed=False)
+
+    # The stored result has seen the rolled back changes
+    cache.get_or_load(1, 'all', load, 'reader')
+    assert load.calls == 2
+    assert cache.get_stats().invalidations == 1
+
+
+def test_results_expire(clock):
+    cache = TodoCache(ttl=10)
+    load = CountingLoader(['todo'])
+    cache.get_or_load(1, 'all', load)
+    clock.now = 9
+    cache.get_or_load(1, 'all', load)
+    assert load.calls == 1
+
+    clock.now = 10
+    cache.get_or_load(1, 'all', load)
+    assert load.calls == 2
+    assert cache.get_stats().expirations == 1
+
+
+def test_least_recently_used_users_are_evicted():
+    cache = TodoCache(max_users=2)
+    for user_id in (1, 2):
+        cache.get_or_load(user_id, 'all', CountingLoader([]))
+    cache.get_or_load(1, 'all', CountingLoader([]))
+    cache.get_or_load(3, 'all', CountingLoader([]))
+
+    load = CountingLoader([])
+    cache.get_or_load(2, 'all', load)
+    assert load.calls == 1
+    assert cache.get_stats().evictions == 2
+
+
+def test_users_are_evicted_over_max_items():
+    cache = TodoCache(max_items=3)
+    cache.get_or_load(1, 'all', CountingLoader(['a', 'b']))
+    cache.get_or_load(2, 'all', CountingLoader(['c', 'd']))
+
+    stats = cache.get_stats()
+    assert (stats.users, stats.items, stats.evictions) == (1, 2, 1)
+    # The most recent user is kept even if it alone holds more todos
+    cache.get_or_load(3, 'all', CountingLoader(['e', 'f', 'g', 'h']))
+    assert cache.get_stats().users == 1
+    assert cache.get_stats().items == 4
+
+
+def make_todo(todo_id: int, title: str) -> Todo:
+    return Todo(id=todo_id, title=title, content='', is_done=False, tg_user_id=1)
+
+
+def test_callers_get_copies_of_cached_todos():
+    cache = TodoCache()
+    loaded = [make_todo(1, 'First'), make_todo(2, 'Second')]
+    assert cache.get_or_load(1, 'all', CountingLoader(loaded)) is loaded
+
+    # Changes of the loaded and of the cached results do not reach other callers
+    loaded[0].title = 'Changed by the loader'
+    first_hit = cache.get_or_load(1, 'all', CountingLoader([]))
+    first_hit[1].is_done = True
+    first_hit.pop(0)
+    second_hit = cache.get_or_load(1, 'all', CountingLoader([]))
+
+    assert [(todo.id, todo.title, todo.is_done) for todo in second_hit] == [(1, 'First', False), (2, 'Second', False)]
+    assert second_hit[1] is not first_hit[0]
+
+
+def test_cached_todos_join_session_of_transaction():
+    cache = TodoCache()
+    cache.get_or_load(1, 'all', CountingLoader([make_todo(1, 'First'), make_todo(2, 'Second')]))
+    session = Session()
+    in_session = make_todo(2, 'Second')
+    make_transient_to_detached(in_session)
+    session.add(in_session)
+    in_session.title = 'Changed in the session'
+
+    first, second = cache.get_or_load(1, 'all', CountingLoader([]), session)
+
+    assert first in session and first not in session.dirty
+    # Objects the session already has are returned as they are
+    assert second is in_session
+    assert second.title == 'Changed in the session'
@@ -0,0 +1,6 @@
+import os
+import tempfile
+
+# Bot modules configure the database on import, tests run on a database of their own
+_database_directory = tempfile.TemporaryDirectory(prefix='todo-bot-test-')
+os.environ['DB_DSN'] = f'sqlite:///{_database_directory.name}/test.db'
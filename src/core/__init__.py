@@ -1,3 +1,11 @@
-from .state_machine import StateMachine, Locator, StateRouter, Paginator, BaseState
+from .state_machine import (
+    StateMachine,
+    Locator,
+    StateRouter,
+    Paginator,
+    BaseState,
+    SyncUpdateDispatcher,
+    AsyncUpdateDispatcher,
+)
 from .tg_api import SyncTgClient, AsyncTgClient, GetUpdatesRequest
 
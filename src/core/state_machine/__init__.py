@@ -1,2 +1,5 @@
-from .paginator import Paginator
+from .paginator import Paginator, BasePageSource, ListPageSource, Page
 from .state_machine import StateMachine, Locator, BaseState, StateRouter, BaseSessionRepository
+from .dispatcher import SyncUpdateDispatcher, AsyncUpdateDispatcher, DispatcherStats
+from .deduplicator import UpdateDeduplicator, DeduplicatorStats
+from .timers import TimerWheel, BaseTimerScheduler, TimerScheduler, AsyncTimerScheduler, TimerSchedulerStats
@@ -0,0 +1,74 @@
+import threading
+from dataclasses import dataclass, replace
+
+
+@dataclass
+class DeduplicatorStats:
+    checked: int = 0
+    duplicates: int = 0
+    window_resets: int = 0
+
+
+class UpdateDeduplicator:
+    """Drops repeated updates looking at a sliding window of recent `update_id`s.
+
+    The window is a ring bitset of `window_size` bits, one bit per update id, so the memory footprint is
+    fixed and every check is O(1) amortized. An update id far behind the window means Telegram has
+    restarted the id sequence, the window is reset in this case instead of dropping the update.
+    """
+
+    def __init__(self, window_size: int = 65536):
+        if window_size < 8:
+            raise ValueError(f'window_size is too small: {window_size}')
+
+        self.window_size = window_size - window_size % 8
+        self._bits = bytearray(self.window_size // 8)
+        self._max_update_id: int | None = None
+        self._stats = DeduplicatorStats()
+        self._lock = threading.Lock()
+
+    def get_stats(self) -> DeduplicatorStats:
+        return replace(self._stats)
+
+    def is_duplicate(self, update_id: int) -> bool:
+        """Check update id and remember it. Return True if the id has been seen already."""
+        with self._lock:
+            self._stats.checked += 1
+
+            if self._max_update_id is None or update_id <= self._max_update_id - self.window_size:
+                if self._max_update_id is not None:
+                    self._stats.window_resets += 1
+                self._reset(update_id)
+            elif update_id > self._max_update_id:
+                self._slide(update_id)
+
+            byte_index, bit_mask = divmod(update_id % self.window_size, 8)
+            bit_mask = 1 << bit_mask
+            if self._bits[byte_index] & bit_mask:
+                self._stats.duplicates += 1
+                return True
+            self._bits[byte_index] |= bit_mask
+            return False
+
+    def forget(self, update_id: int) -> None:
+        """Unmark update id, so the update is not a duplicate when it is checked again."""
+        with self._lock:
+            if self._max_update_id is None or update_id <= self._max_update_id - self.window_size:
+                return
+            byte_index, bit = divmod(update_id % self.window_size, 8)
+            self._bits[byte_index] &= ~(1 << bit) & 0xFF
+
+    def _reset(self, update_id: int) -> None:
+        self._bits[:] = bytes(len(self._bits))
+        self._max_update_id = update_id
+
+    def _slide(self, update_id: int) -> None:
+        """Forget ids that fall out of the window when it moves forward to `update_id`."""
+        if update_id - self._max_update_id >= self.window_size:
+            self._reset(update_id)
+            return
+
+        for stale_update_id in range(self._max_update_id + 1, update_id + 1):
+            byte_index, bit = divmod(stale_update_id % self.window_size, 8)
+            self._bits[byte_index] &= ~(1 << bit) & 0xFF
+        self._max_update_id = update_id
@@ -0,0 +1,325 @@
+import asyncio
+import contextvars
+import queue
+import threading
+import traceback
+from collections import deque
+from dataclasses import dataclass, replace
+from typing import Awaitable, Callable, Hashable
+
+from core.tg_api import Update
+from .deduplicator import UpdateDeduplicator
+
+_STOP = object()
+
+
+@dataclass
+class DispatcherStats:
+    submitted: int = 0
+    processed: int = 0
+    failed: int = 0
+    duplicates: int = 0
+    pending: int = 0
+    max_pending: int = 0
+    active_chats: int = 0
+    max_chat_queue_depth: int = 0
+
+
+class BaseUpdateDispatcher:
+    """Shards updates by chat into per-chat queues.
+
+    Updates of one chat are processed strictly in order, different chats are processed by a pool of workers
+    in parallel. A chat is handed to a worker only while it has queued updates, so the number of workers
+    bounds the concurrency regardless of the number of chats.
+
+    `on_processed` is called for every update once its processing is finished, even if the handler failed,
+    e.g. to acknowledge the update to the updates poller.
+
+    With `deduplicator` given repeated updates are dropped on submit, they are reported to `on_processed`
+    without being processed.
+    """
+
+    def __init__(
+            self,
+            *,
+            workers: int,
+            max_pending: int,
+            on_processed: Callable[[Update], None] | None = None,
+            deduplicator: UpdateDeduplicator | None = None,
+    ):
+        if workers < 1:
+            raise ValueError(f'Dispatcher requires at least one worker, got {workers}')
+        if max_pending < 1:
+            raise ValueError(f'max_pending must be positive, got {max_pending}')
+
+        self.workers = workers
+        self.max_pending = max_pending
+        self.on_processed = on_processed
+        self.deduplicator = deduplicator
+        self._chat_queues: dict[Hashable, deque[Update]] = {}
+        self._stats = DispatcherStats()
+
+    def get_stats(self) -> DispatcherStats:
+        return replace(self._stats, active_chats=len(self._chat_queues))
+
+    def get_queue_depths(self) -> dict[Hashable, int]:
+        return {chat_id: len(chat_queue) for chat_id, chat_queue in self._chat_queues.items()}
+
+    def _is_duplicate(self, update: Update) -> bool:
+        if not self.deduplicator or not self.deduplicator.is_duplicate(update.update_id):
+            return False
+        self._stats.duplicates += 1
+        return True
+
+    def _forget(self, update: Update) -> None:
+        # The update was not accepted, the caller may submit it again
+        if self.deduplicator:
+            self.deduplicator.forget(update.update_id)
+
+    def _drop_duplicate(self, update: Update) -> None:
+        if self.on_processed:
+            self.on_processed(update)
+
+    def _enqueue(self, update: Update) -> bool:
+        """Put update into the chat queue. Return True if the chat has to be scheduled for a worker."""
+        chat_id = update.chat_id
+        chat_queue = self._chat_queues.get(chat_id)
+        is_new_chat = chat_queue is None
+        if is_new_chat:
+            chat_queue = self._chat_queues[chat_id] = deque()
+        chat_queue.append(update)
+
+        self._stats.submitted += 1
+        self._stats.pending += 1
+        self._stats.max_pending = max(self._stats.max_pending, self._stats.pending)
+        self._stats.max_chat_queue_depth = max(self._stats.max_chat_queue_depth, len(chat_queue))
+        return is_new_chat
+
+    def _peek(self, chat_id: Hashable) -> Update:
+        return self._chat_queues[chat_id][0]
+
+    def _complete(self, chat_id: Hashable, *, failed: bool) -> bool:
+        """Drop processed update from the chat queue. Return True if the chat has more updates to process."""
+        chat_queue = self._chat_queues[chat_id]
+        chat_queue.popleft()
+
+        self._stats.pending -= 1
+        self._stats.processed += 1
+        if failed:
+            self._stats.failed += 1
+
+        if chat_queue:
+            return True
+        del self._chat_queues[chat_id]
+        return False
+
+
+class SyncUpdateDispatcher(BaseUpdateDispatcher):
+    """Processes updates on a pool of threads.
+
+    Usage:
+
+        with SyncUpdateDispatcher(state_machine.process, workers=8) as dispatcher:
+            for update in GetUpdatesRequest().listen_updates():
+                dispatcher.submit(update)
+    """
+
+    def __init__(
+            self,
+            handler: Callable[[Update], None],
+            *,
+            workers: int = 8,
+            max_pending: int = 1000,
+            on_processed: Callable[[Update], None] | None = None,
+            deduplicator: UpdateDeduplicator | None = None,
+    ):
+        super().__init__(
+            workers=workers,
+            max_pending=max_pending,
+            on_processed=on_processed,
+            deduplicator=deduplicator,
+        )
+        self.handler = handler
+        self._lock = threading.Lock()
+        self._drained = threading.Condition(self._lock)
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._ready_chats = queue.SimpleQueue()
+        self._threads: list[threading.Thread] = []
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop(drain=exc_type is None)
+
+    def start(self) -> None:
+        for number in range(self.workers):
+            # Worker threads inherit the context to see the default Telegram client
+            context = contextvars.copy_context()
+            thread = threading.Thread(
+                target=context.run,
+                args=(self._work,),
+                name=f'update-dispatcher-{number}',
+                daemon=True,
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, *, drain: bool = True) -> None:
+        if drain:
+            self.drain()
+        for _ in self._threads:
+            self._ready_chats.put(_STOP)
+        for thread in self._threads:
+            thread.join()
+        self._threads.clear()
+
+    def get_stats(self) -> DispatcherStats:
+        with self._lock:
+            return super().get_stats()
+
+    def get_queue_depths(self) -> dict[Hashable, int]:
+        with self._lock:
+            return super().get_queue_depths()
+
+    def submit(self, update: Update, *, timeout: float | None = None) -> bool:
+        """Queue update for processing.
+
+        Blocks while `max_pending` updates are waiting, returns False if `timeout` expired before a slot was freed.
+        """
+        with self._lock:
+            is_duplicate = self._is_duplicate(update)
+        if is_duplicate:
+            self._drop_duplicate(update)
+            return True
+        if not self._slots.acquire(timeout=timeout):
+            self._forget(update)
+            return False
+        with self._lock:
+            is_new_chat = self._enqueue(update)
+        if is_new_chat:
+            self._ready_chats.put(update.chat_id)
+        return True
+
+    def drain(self, timeout: float | None = None) -> bool:
+        """Wait until all submitted updates are processed."""
+        with self._drained:
+            return self._drained.wait_for(lambda: not self._stats.pending, timeout=timeout)
+
+    def _work(self) -> None:
+        while True:
+            chat_id = self._ready_chats.get()
+            if chat_id is _STOP:
+                return
+
+            with self._lock:
+                update = self._peek(chat_id)
+            failed = False
+            try:
+                self.handler(update)
+            except Exception:
+                failed = True
+                traceback.print_exc()
+            if self.on_processed:
+                self.on_processed(update)
+
+            with self._lock:
+                has_more_updates = self._complete(chat_id, failed=failed)
+                if not self._stats.pending:
+                    self._drained.notify_all()
+            self._slots.release()
+            if has_more_updates:
+                self._ready_chats.put(chat_id)
+
+
+class AsyncUpdateDispatcher(BaseUpdateDispatcher):
+    """Processes updates on a pool of asyncio tasks.
+
+    Usage:
+
+        async with AsyncUpdateDispatcher(state_machine.aprocess, workers=64) as dispatcher:
+            async for update in GetUpdatesRequest().alisten_updates():
+                await dispatcher.submit(update)
+    """
+
+    def __init__(
+            self,
+            handler: Callable[[Update], Awaitable[None]],
+            *,
+            workers: int = 64,
+            max_pending: int = 1000,
+            on_processed: Callable[[Update], None] | None = None,
+            deduplicator: UpdateDeduplicator | None = None,
+    ):
+        super().__init__(
+            workers=workers,
+            max_pending=max_pending,
+            on_processed=on_processed,
+            deduplicator=deduplicator,
+        )
+        self.handler = handler
+        self._slots = asyncio.BoundedSemaphore(max_pending)
+        self._ready_chats = asyncio.Queue()
+        self._drained = asyncio.Event()
+        self._drained.set()
+        self._tasks: list[asyncio.Task] = []
+
+    async def __aenter__(self):
+        self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.stop(drain=exc_type is None)
+
+    def start(self) -> None:
+        self._tasks = [
+            asyncio.create_task(self._work(), name=f'update-dispatcher-{number}')
+            for number in range(self.workers)
+        ]
+
+    async def stop(self, *, drain: bool = True) -> None:
+        if drain:
+            await self.drain()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+
+    async def submit(self, update: Update) -> None:
+        """Queue update for processing. Waits while `max_pending` updates are waiting."""
+        if self._is_duplicate(update):
+            self._drop_duplicate(update)
+            return
+        try:
+            await self._slots.acquire()
+        except asyncio.CancelledError:
+            self._forget(update)
+            raise
+        self._drained.clear()
+        if self._enqueue(update):
+            self._ready_chats.put_nowait(update.chat_id)
+
+    async def drain(self) -> None:
+        """Wait until all submitted updates are processed."""
+        await self._drained.wait()
+
+    async def _work(self) -> None:
+        while True:
+            chat_id = await self._ready_chats.get()
+            update = self._peek(chat_id)
+            failed = False
+            try:
+                await self.handler(update)
+            except Exception:
+                failed = True
+                traceback.print_exc()
+            if self.on_processed:
+                self.on_processed(update)
+
+            has_more_updates = self._complete(chat_id, failed=failed)
+            self._slots.release()
+            if has_more_updates:
+                self._ready_chats.put_nowait(chat_id)
+            elif not self._stats.pending:
+                self._drained.set()
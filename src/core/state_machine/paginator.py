@@ -1,34 +1,122 @@
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
 from typing import Callable
 
-import more_itertools
-
 from core.tg_api import InlineKeyboardButton
 
 
+@dataclass
+class Page:
+    """Items of one page with cursors pointing to this page and its neighbours."""
+    items: list
+    cursor: str | None = None
+    prev_cursor: str | None = None
+    next_cursor: str | None = None
+
+
+class BasePageSource(ABC):
+    """Lazy source of paginated items, only the items of the requested page are loaded.
+
+    Cursors are opaque strings made by the source, they are passed back in the callback data of page buttons.
+    A source may ignore them and find a page by its number.
+    """
+
+    @abstractmethod
+    def count(self) -> int:
+        pass
+
+    @abstractmethod
+    def get_page(self, page_number: int, page_size: int, total_items: int, cursor: str | None = None) -> Page:
+        pass
+
+    async def acount(self) -> int:
+        return self.count()
+
+    async def aget_page(self, page_number: int, page_size: int, total_items: int, cursor: str | None = None) -> Page:
+        return self.get_page(page_number, page_size, total_items, cursor)
+
+
+class ListPageSource(BasePageSource):
+
+    def __init__(self, item_list: list):
+        self.item_list = item_list
+
+    def count(self) -> int:
+        return len(self.item_list)
+
+    def get_page(self, page_number: int, page_size: int, total_items: int, cursor: str | None = None) -> Page:
+        start = (page_number - 1) * page_size
+        return Page(self.item_list[start:start + page_size])
+
+
 class Paginator:
 
     def __init__(
             self,
-            item_list: list,
-            button_text_getter: Callable,
-            button_callback_data_getter: Callable,
+            item_list: list | None = None,
+            button_text_getter: Callable = str,
+            button_callback_data_getter: Callable = str,
             page_size: int = 10,
-            page_callback_data_prefix: str = 'page'
+            page_callback_data_prefix: str = 'page',
+            *,
+            page_source: BasePageSource | None = None,
+            total_items: int | None = None,
     ):
+        if (item_list is None) == (page_source is None):
+            raise ValueError('Either item_list or page_source is required')
+
         self.button_callback_data_getter = button_callback_data_getter
         self.button_text_getter = button_text_getter
-        self.item_list = item_list
+        self.page_source = page_source or ListPageSource(item_list)
         self.page_size = page_size
-        self.pages = list(more_itertools.chunked(self.item_list, self.page_size))
-        self.total_pages = len(self.pages)
+        self.total_items = self.page_source.count() if total_items is None else total_items
+        self.total_pages = max(1, -(-self.total_items // self.page_size))
         self.is_paginated = self.total_pages > 1
         self.page_callback_data_prefix = page_callback_data_prefix
 
+    @classmethod
+    async def acreate(cls, *, page_source: BasePageSource, **kwargs) -> 'Paginator':
+        """Create a paginator counting the items of the source asynchronously."""
+        return cls(page_source=page_source, total_items=await page_source.acount(), **kwargs)
+
+    def get_page(self, page_number: int = 1, cursor: str | None = None) -> Page:
+        page_number, cursor = self._get_page_location(page_number, cursor)
+        return self.page_source.get_page(page_number, self.page_size, self.total_items, cursor)
+
+    async def aget_page(self, page_number: int = 1, cursor: str | None = None) -> Page:
+        page_number, cursor = self._get_page_location(page_number, cursor)
+        return await self.page_source.aget_page(page_number, self.page_size, self.total_items, cursor)
+
+    def _get_page_location(self, page_number: int, cursor: str | None) -> tuple[int, str | None]:
+        page_number = self.clamp_page_number(page_number)
+        if page_number in (1, self.total_pages):
+            # Edge pages are found without cursors, so the buttons to them stay the same
+            cursor = None
+        return page_number, cursor
+
+    def clamp_page_number(self, page_number: int) -> int:
+        return min(max(1, page_number), self.total_pages)
+
+    @staticmethod
+    def parse_callback_data(callback_data: str, prefix: str = 'page') -> tuple[int, str | None] | None:
+        """Return page number and cursor from callback data of a page button or None for other buttons."""
+        callback_data_prefix, _, page = callback_data.partition('#')
+        if callback_data_prefix != prefix:
+            return None
+        page_number, _, cursor = page.partition('#')
+        if not page_number.isdigit():
+            return 1, None
+        return int(page_number), cursor or None
+
     def get_keyboard(
             self,
             page_number: int = 1,
+            cursor: str | None = None,
+            *,
+            page: Page | None = None,
     ) -> list[list[InlineKeyboardButton]]:
-        page_number = min(max(1, page_number), self.total_pages)
+        page_number = self.clamp_page_number(page_number)
+        page = page or self.get_page(page_number, cursor)
         prev_page_number = max(page_number - 1, 1)
         next_page_number = min(page_number + 1, self.total_pages)
 
@@ -37,30 +125,43 @@ class Paginator:
                 self.button_text_getter(item),
                 callback_data=self.button_callback_data_getter(item)
             )]
-            for item in self.pages[page_number - 1]
+            for item in page.items
         ]
         if self.is_paginated:
             pagination_keyboard = [
                 InlineKeyboardButton(
                     '1',
-                    callback_data=f'{self.page_callback_data_prefix}#1'
+                    callback_data=self.make_callback_data(1)
                 ),
                 InlineKeyboardButton(
                     '<',
-                    callback_data=f'{self.page_callback_data_prefix}#{prev_page_number}'
+                    callback_data=self.make_callback_data(prev_page_number, page.prev_cursor)
                 ),
                 InlineKeyboardButton(
                     str(page_number),
-                    callback_data=f'{self.page_callback_data_prefix}#{page_number}'
+                    callback_data=self.make_callback_data(page_number, page.cursor)
                 ),
                 InlineKeyboardButton(
                     '>',
-                    callback_data=f'{self.page_callback_data_prefix}#{next_page_number}'
+                    callback_data=self.make_callback_data(next_page_number, page.next_cursor)
                 ),
                 InlineKeyboardButton(
                     str(self.total_pages),
-                    callback_data=f'{self.page_callback_data_prefix}#{self.total_pages}'
+                    callback_data=self.make_callback_data(self.total_pages)
                 )
             ]
             page_keyboard.append(pagination_keyboard)
         return page_keyboard
+
+    async def aget_keyboard(
+            self,
+            page_number: int = 1,
+            cursor: str | None = None,
+    ) -> list[list[InlineKeyboardButton]]:
+        page = await self.aget_page(page_number, cursor)
+        return self.get_keyboard(page_number, cursor, page=page)
+
+    def make_callback_data(self, page_number: int, cursor: str | None = None) -> str:
+        if cursor is None or page_number in (1, self.total_pages):
+            return f'{self.page_callback_data_prefix}#{page_number}'
+        return f'{self.page_callback_data_prefix}#{page_number}#{cursor}'
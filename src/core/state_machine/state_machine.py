@@ -1,5 +1,6 @@
 from abc import ABC, abstractmethod
-from typing import Type, NamedTuple, ClassVar, final
+from contextlib import AbstractAsyncContextManager, AbstractContextManager, asynccontextmanager, nullcontext
+from typing import AsyncIterator, Callable, Type, NamedTuple, ClassVar, final
 
 from pydantic import BaseModel, Field
 
@@ -29,6 +30,15 @@ class BaseState(BaseModel):
     def process(self, update) -> Locator | None:
         pass
 
+    async def aenter_state(self, update: Update) -> Locator | None:
+        return self.enter_state(update)
+
+    async def aexit_state(self, update: Update) -> None:
+        self.exit_state(update)
+
+    async def aprocess(self, update) -> Locator | None:
+        return self.process(update)
+
 
 @final
 class StateRouter(dict[str, Type[BaseState]]):
@@ -80,11 +90,32 @@ class StateMachine(BaseModel):
     session_repository: BaseSessionRepository
     start_state_locator: Locator
     commands_map: dict[str, Locator] = Field(default_factory=dict)
+    # Called once per update, the context is shared by all state hooks processing the update. It spans
+    # the Telegram requests of the hooks, so it should not hold a database transaction open
+    unit_of_work: Callable[[], AbstractContextManager] | None = None
+    # Entered by `aprocess` inside of the sync unit of work
+    async_unit_of_work: Callable[[], AbstractAsyncContextManager] | None = None
 
     class Config:
         arbitrary_types_allowed = True
 
+    def begin_unit_of_work(self) -> AbstractContextManager:
+        return self.unit_of_work() if self.unit_of_work else nullcontext()
+
+    @asynccontextmanager
+    async def abegin_unit_of_work(self) -> AsyncIterator[None]:
+        with self.begin_unit_of_work():
+            if not self.async_unit_of_work:
+                yield
+                return
+            async with self.async_unit_of_work():
+                yield
+
     def process(self, update: Update):
+        with self.begin_unit_of_work():
+            self._process(update)
+
+    def _process(self, update: Update):
         if locator := self.get_locator_from_command(update):
             self.switch_state(locator, update)
             return
@@ -122,3 +153,40 @@ class StateMachine(BaseModel):
             if next_state_locator and state_locator.state_name != next_state_locator.state_name:
                 state.exit_state(update)
             state_locator = next_state_locator
+
+    async def aprocess(self, update: Update):
+        async with self.abegin_unit_of_work():
+            await self._aprocess(update)
+
+    async def _aprocess(self, update: Update):
+        if locator := self.get_locator_from_command(update):
+            await self.aswitch_state(locator, update)
+            return
+
+        locator = self.session_repository.get_locator_by_user_id(update.chat_id)
+        if not locator:
+            await self.aswitch_state(self.start_state_locator, update)
+            return
+
+        state = self.state_router.restore_state(locator, update.chat_id)
+        next_locator = await state.aprocess(update)
+
+        if next_locator and locator.state_name != next_locator.state_name:
+            await state.aexit_state(update)
+
+        await self.aswitch_state(next_locator, update)
+
+    async def aswitch_state(self, state_locator: Locator, update: Update) -> None:
+        states_chain_length = 0
+        while state_locator:
+            self.session_repository.save_user_locator(update.chat_id, state_locator)
+            states_chain_length += 1
+            if states_chain_length >= MAX_STATES_CHAIN_LEN:
+                break
+            print(f'Switching to state with locator: {state_locator}')
+            state = self.state_router.restore_state(state_locator, update.chat_id)
+            print(f'State: {state.__class__.__name__}')
+            next_state_locator = await state.aenter_state(update)
+            if next_state_locator and state_locator.state_name != next_state_locator.state_name:
+                await state.aexit_state(update)
+            state_locator = next_state_locator
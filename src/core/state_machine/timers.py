@@ -0,0 +1,462 @@
+import asyncio
+import contextvars
+import threading
+import traceback
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar, Token
+from dataclasses import dataclass, replace
+from math import ceil, floor
+from operator import itemgetter
+from time import time
+from typing import AsyncGenerator, Awaitable, Callable, ClassVar, Generator, Hashable, Iterable
+
+# A failed load of the timers is repeated after this number of seconds
+LOAD_RETRY_DELAY = 5
+
+TimerLoader = Callable[[float | None, float], Iterable[tuple[Hashable, float]]]
+AsyncTimerLoader = Callable[[float | None, float], Awaitable[Iterable[tuple[Hashable, float]]]]
+
+
+class TimerWheel:
+    """Hierarchical timing wheel of timers identified by keys.
+
+    Level 0 has `slots` slots of one `tick`, a slot of every next level spans a whole turn of the previous
+    level. A timer is put on the lowest level that reaches its deadline and moves a level down every time
+    the wheel enters its slot, so scheduling and cancelling are O(1) and a timer is moved at most
+    `levels - 1` times. Timers beyond the last level wait in the overflow. The wheel skips the ticks
+    without timers to expire. It is not thread safe and takes the current time as argument, like
+    `OutboundQueue`.
+    """
+
+    def __init__(self, *, tick: float = 1.0, slots: int = 64, levels: int = 4, now: float):
+        if tick <= 0 or slots < 2 or levels < 1:
+            raise ValueError(f'Invalid wheel: tick={tick}, slots={slots}, levels={levels}')
+        self.tick = tick
+        self.slots = slots
+        self.levels = levels
+        self._origin = now
+        self._current_tick = 0
+        self._spans = [slots ** level for level in range(levels)]
+        self._wheel: list[list[dict[Hashable, float]]] = [[{} for _ in range(slots)] for _ in range(levels)]
+        self._level_sizes = [0] * levels
+        self._expired: dict[Hashable, float] = {}
+        self._overflow: dict[Hashable, float] = {}
+        # Level of every timer, -1 for the expired ones and `levels` for the overflow, and the dict holding it
+        self._locations: dict[Hashable, tuple[int, dict[Hashable, float]]] = {}
+
+    def __len__(self) -> int:
+        return len(self._locations)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._locations
+
+    def schedule(self, key: Hashable, deadline: float) -> None:
+        """Add the timer, a timer with the same key is replaced."""
+        if key in self._locations:
+            self.cancel(key)
+        self._place(key, deadline)
+
+    def cancel(self, key: Hashable) -> bool:
+        location = self._locations.pop(key, None)
+        if location is None:
+            return False
+        level, timers = location
+        del timers[key]
+        if 0 <= level < self.levels:
+            self._level_sizes[level] -= 1
+        return True
+
+    def advance(self, now: float) -> list[tuple[Hashable, float]]:
+        """Move the wheel to the time and remove the expired timers. Return their keys and deadlines."""
+        target_tick = floor((now - self._origin) / self.tick)
+        while self._current_tick < target_tick:
+            next_tick = self._get_next_tick()
+            if next_tick is None or next_tick > target_tick:
+                self._current_tick = target_tick
+                break
+            self._current_tick = next_tick
+            self._cascade()
+
+        expired = sorted(self._expired.items(), key=itemgetter(1))
+        for key, _ in expired:
+            del self._locations[key]
+        self._expired.clear()
+        return expired
+
+    def get_delay(self, now: float) -> float | None:
+        """Seconds until the wheel has to be advanced or None if it has no timers."""
+        if self._expired:
+            return 0
+        next_tick = self._get_next_tick()
+        if next_tick is None:
+            return None
+        return max(0.0, self._origin + next_tick * self.tick - now)
+
+    def _get_next_tick(self) -> int | None:
+        """Return the next tick when timers expire or move down a level."""
+        for level, size in enumerate(self._level_sizes):
+            if size:
+                span = self._spans[level]
+                return (self._current_tick // span + 1) * span
+        if self._overflow:
+            span = self._spans[-1]
+            return (self._current_tick // span + 1) * span
+        return None
+
+    def _cascade(self) -> None:
+        top_span = self._spans[-1]
+        if self._overflow and not self._current_tick % top_span:
+            timers = list(self._overflow.items())
+            self._overflow.clear()
+            for key, deadline in timers:
+                self._place(key, deadline)
+
+        for level in range(self.levels - 1, 0, -1):
+            span = self._spans[level]
+            if self._current_tick % span:
+                continue
+            slot = self._wheel[level][self._current_tick // span % self.slots]
+            if not slot:
+                continue
+            timers = list(slot.items())
+            slot.clear()
+            self._level_sizes[level] -= len(timers)
+            for key, deadline in timers:
+                self._place(key, deadline)
+
+        slot = self._wheel[0][self._current_tick % self.slots]
+        if slot:
+            self._level_sizes[0] -= len(slot)
+            for key, deadline in slot.items():
+                self._expired[key] = deadline
+                self._locations[key] = (-1, self._expired)
+            slot.clear()
+
+    def _place(self, key: Hashable, deadline: float) -> None:
+        expires_at_tick = ceil((deadline - self._origin) / self.tick)
+        current_tick = self._current_tick
+        if expires_at_tick <= current_tick:
+            level, timers = -1, self._expired
+        else:
+            for level, span in enumerate(self._spans):
+                slot = expires_at_tick // span
+                if slot - current_tick // span < self.slots:
+                    timers = self._wheel[level][slot % self.slots]
+                    self._level_sizes[level] += 1
+                    break
+            else:
+                level, timers = self.levels, self._overflow
+        timers[key] = deadline
+        self._locations[key] = (level, timers)
+
+
+@dataclass
+class TimerSchedulerStats:
+    scheduled: int = 0
+    cancelled: int = 0
+    loads: int = 0
+    loaded: int = 0
+    fired: int = 0
+    failed: int = 0
+    pending: int = 0
+
+
+class BaseTimerScheduler(ABC):
+    """Calls `on_expired` with the key of every timer when its deadline, a Unix timestamp, comes.
+
+    Timers are kept in a `TimerWheel`. With `load` only the timers of the next `window` seconds are kept
+    in memory: `load(since, until)` returns keys and deadlines of the timers due before `until` and not
+    before `since`, `since` is None for the first load after a start. The next window is loaded when half
+    of the current one has passed, timers scheduled beyond the loaded window are left to be loaded.
+
+    `schedule` and `cancel` are thread safe in both runtimes, the default scheduler is shared by them.
+    """
+
+    default_scheduler: ClassVar[ContextVar['BaseTimerScheduler']] = ContextVar('default_timer_scheduler')
+
+    def __init__(
+            self,
+            *,
+            load: TimerLoader | AsyncTimerLoader | None = None,
+            window: float = 3600,
+            tick: float = 1.0,
+            slots: int = 64,
+            levels: int = 4,
+    ):
+        self.load = load
+        self.window = window
+        self.wheel = TimerWheel(tick=tick, slots=slots, levels=levels, now=time())
+        self._condition = threading.Condition()
+        self._stats = TimerSchedulerStats()
+        self._loaded_until: float | None = None
+        self._next_load_at = 0.0
+        # Timers scheduled or cancelled while a window is loading, the loaded deadlines of them are outdated
+        self._changed_while_loading: set[Hashable] | None = None
+
+    @contextmanager
+    def set_as_default(self) -> Generator[None, None, None]:
+        default_scheduler_token: Token = self.default_scheduler.set(self)
+        try:
+            yield
+        finally:
+            self.default_scheduler.reset(default_scheduler_token)
+
+    def schedule(self, key: Hashable, deadline: float) -> bool:
+        """Add the timer replacing the timer with the same key.
+
+        Return False if the deadline is beyond the loaded window, the timer is left to `load` then.
+        """
+        with self._condition:
+            self._stats.scheduled += 1
+            if self._changed_while_loading is not None:
+                self._changed_while_loading.add(key)
+            if self.load and (self._loaded_until is None or deadline >= self._loaded_until):
+                self.wheel.cancel(key)
+                return False
+            self.wheel.schedule(key, deadline)
+        self._wakeup()
+        return True
+
+    def cancel(self, key: Hashable) -> bool:
+        with self._condition:
+            if self._changed_while_loading is not None:
+                self._changed_while_loading.add(key)
+            cancelled = self.wheel.cancel(key)
+            self._stats.cancelled += cancelled
+            return cancelled
+
+    def get_stats(self) -> TimerSchedulerStats:
+        with self._condition:
+            return replace(self._stats, pending=len(self.wheel))
+
+    @abstractmethod
+    def _wakeup(self) -> None:
+        pass
+
+    def _start_load(self, now: float) -> tuple[float | None, float] | None:
+        """Return the range of deadlines to load or None if the loaded window lasts long enough."""
+        with self._condition:
+            if not self.load or now < self._next_load_at:
+                return None
+            if self._loaded_until is not None and self._loaded_until - now > self.window / 2:
+                return None
+            since = self._loaded_until
+            # Timers scheduled from now on within the window are put to the wheel, the load may miss them
+            self._loaded_until = now + self.window
+            self._changed_while_loading = set()
+            return since, self._loaded_until
+
+    def _finish_load(self, since: float | None, timers: Iterable[tuple[Hashable, float]] | None) -> None:
+        with self._condition:
+            changed_keys = self._changed_while_loading
+            self._changed_while_loading = None
+            if timers is None:
+                self._loaded_until = since
+                self._next_load_at = time() + LOAD_RETRY_DELAY
+                return
+            self._stats.loads += 1
+            for key, deadline in timers:
+                if key not in changed_keys:
+                    self.wheel.schedule(key, deadline)
+                    self._stats.loaded += 1
+
+    def _pop_expired(self, now: float) -> tuple[list[Hashable], float | None]:
+        """Return keys of the expired timers and seconds to wait for the next ones or the next load."""
+        with self._condition:
+            expired = self.wheel.advance(now)
+            delay = self.wheel.get_delay(now)
+            if self.load and self._loaded_until is not None:
+                next_load_at = max(self._loaded_until - self.window / 2, self._next_load_at)
+                delay = max(0.0, next_load_at - now) if delay is None else min(delay, max(0.0, next_load_at - now))
+            return [key for key, _ in expired], delay
+
+    def _complete(self, *, failed: bool) -> None:
+        with self._condition:
+            if failed:
+                self._stats.failed += 1
+            else:
+                self._stats.fired += 1
+
+
+class TimerScheduler(BaseTimerScheduler):
+    """Fires timers from a thread, `on_expired` is called by a pool of worker threads.
+
+    Usage:
+
+        with TimerScheduler.setup(send_reminder, load=load_reminders):
+            TimerScheduler.default_scheduler.get().schedule(todo_id, deadline)
+    """
+
+    def __init__(
+            self,
+            on_expired: Callable[[Hashable], None],
+            *,
+            load: TimerLoader | None = None,
+            workers: int = 4,
+            **kwargs,
+    ):
+        super().__init__(load=load, **kwargs)
+        self.on_expired = on_expired
+        self.workers = workers
+        self._stopped = False
+        self._executor: ThreadPoolExecutor | None = None
+        self._thread: threading.Thread | None = None
+
+    @classmethod
+    @contextmanager
+    def setup(cls, on_expired: Callable[[Hashable], None], **kwargs) -> Generator['TimerScheduler', None, None]:
+        scheduler = cls(on_expired, **kwargs)
+        scheduler.start()
+        try:
+            with scheduler.set_as_default():
+                yield scheduler
+        finally:
+            scheduler.stop()
+
+    def start(self) -> None:
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='timer-worker')
+        # Timers are fired with the context of the caller to see its default Telegram client
+        context = contextvars.copy_context()
+        self._thread = threading.Thread(target=context.run, args=(self._run,), name='timer-scheduler', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+        self._thread.join()
+        self._executor.shutdown(wait=True)
+
+    def _wakeup(self) -> None:
+        with self._condition:
+            self._condition.notify()
+
+    def _run(self) -> None:
+        while True:
+            if load_range := self._start_load(time()):
+                self._load(*load_range)
+
+            with self._condition:
+                if self._stopped:
+                    return
+                keys, delay = self._pop_expired(time())
+                if not keys:
+                    self._condition.wait(delay)
+                    continue
+            for key in keys:
+                self._executor.submit(contextvars.copy_context().run, self._fire, key)
+
+    def _load(self, since: float | None, until: float) -> None:
+        try:
+            timers = list(self.load(since, until))
+        except Exception:
+            traceback.print_exc()
+            timers = None
+        self._finish_load(since, timers)
+
+    def _fire(self, key: Hashable) -> None:
+        try:
+            self.on_expired(key)
+        except Exception:
+            traceback.print_exc()
+            self._complete(failed=True)
+        else:
+            self._complete(failed=False)
+
+
+class AsyncTimerScheduler(BaseTimerScheduler):
+    """Fires timers from an asyncio task, `on_expired` coroutines run concurrently up to `max_in_flight`.
+
+    Usage:
+
+        async with AsyncTimerScheduler.setup(asend_reminder, load=aload_reminders):
+            AsyncTimerScheduler.default_scheduler.get().schedule(todo_id, deadline)
+    """
+
+    def __init__(
+            self,
+            on_expired: Callable[[Hashable], Awaitable[None]],
+            *,
+            load: AsyncTimerLoader | None = None,
+            max_in_flight: int = 64,
+            **kwargs,
+    ):
+        super().__init__(load=load, **kwargs)
+        self.on_expired = on_expired
+        self.max_in_flight = max_in_flight
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._wakeup_event: asyncio.Event | None = None
+        self._in_flight: asyncio.Semaphore | None = None
+        self._task: asyncio.Task | None = None
+        self._firing_tasks: set[asyncio.Task] = set()
+
+    @classmethod
+    @asynccontextmanager
+    async def setup(
+            cls,
+            on_expired: Callable[[Hashable], Awaitable[None]],
+            **kwargs,
+    ) -> AsyncGenerator['AsyncTimerScheduler', None]:
+        scheduler = cls(on_expired, **kwargs)
+        scheduler.start()
+        try:
+            with scheduler.set_as_default():
+                yield scheduler
+        finally:
+            await scheduler.stop()
+
+    def start(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._wakeup_event = asyncio.Event()
+        self._in_flight = asyncio.Semaphore(self.max_in_flight)
+        self._task = asyncio.create_task(self._run(), name='timer-scheduler')
+
+    async def stop(self) -> None:
+        self._task.cancel()
+        await asyncio.gather(self._task, *self._firing_tasks, return_exceptions=True)
+
+    def _wakeup(self) -> None:
+        # Timers are scheduled from other threads too, e.g. by the group commit writer
+        if self._loop and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._wakeup_event.set)
+
+    async def _run(self) -> None:
+        while True:
+            if load_range := self._start_load(time()):
+                await self._load(*load_range)
+
+            self._wakeup_event.clear()
+            keys, delay = self._pop_expired(time())
+            if not keys:
+                try:
+                    await asyncio.wait_for(self._wakeup_event.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            for key in keys:
+                await self._in_flight.acquire()
+                task = asyncio.create_task(self._fire(key))
+                self._firing_tasks.add(task)
+                task.add_done_callback(self._firing_tasks.discard)
+
+    async def _load(self, since: float | None, until: float) -> None:
+        try:
+            timers = list(await self.load(since, until))
+        except Exception:
+            traceback.print_exc()
+            timers = None
+        self._finish_load(since, timers)
+
+    async def _fire(self, key: Hashable) -> None:
+        try:
+            await self.on_expired(key)
+        except Exception:
+            traceback.print_exc()
+            self._complete(failed=True)
+        else:
+            self._complete(failed=False)
+        finally:
+            self._in_flight.release()
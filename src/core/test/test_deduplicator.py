@@ -0,0 +1,86 @@
+import asyncio
+import threading
+
+from ..state_machine import UpdateDeduplicator, AsyncUpdateDispatcher, SyncUpdateDispatcher
+from .test_dispatcher import make_update
+
+
+def test_deduplicator_window():
+    deduplicator = UpdateDeduplicator(window_size=16)
+
+    assert not deduplicator.is_duplicate(100)
+    assert not deduplicator.is_duplicate(102)
+    assert deduplicator.is_duplicate(100)
+    assert not deduplicator.is_duplicate(101)
+    assert deduplicator.is_duplicate(102)
+
+    # Slide the window forward: 101 and 102 are still within it, ids reusing their bits are not duplicates
+    assert not deduplicator.is_duplicate(110)
+    assert deduplicator.is_duplicate(101)
+    assert not deduplicator.is_duplicate(117)
+    assert not deduplicator.is_duplicate(118)
+
+    stats = deduplicator.get_stats()
+    assert stats.checked == 9
+    assert stats.duplicates == 3
+    assert stats.window_resets == 0
+
+
+def test_deduplicator_resets_on_restarted_sequence():
+    deduplicator = UpdateDeduplicator(window_size=16)
+    assert not deduplicator.is_duplicate(1000)
+    assert not deduplicator.is_duplicate(5)
+    assert deduplicator.is_duplicate(5)
+    assert not deduplicator.is_duplicate(1000)
+    assert deduplicator.get_stats().window_resets == 1
+
+
+def test_deduplicator_forgets_update():
+    deduplicator = UpdateDeduplicator(window_size=16)
+    assert not deduplicator.is_duplicate(100)
+    assert not deduplicator.is_duplicate(101)
+    deduplicator.forget(100)
+    assert not deduplicator.is_duplicate(100)
+    assert deduplicator.is_duplicate(101)
+
+
+def test_dispatcher_accepts_update_resubmitted_after_timeout():
+    processed = []
+    unblocked = threading.Event()
+
+    def handler(update):
+        unblocked.wait(timeout=5)
+        processed.append(update.update_id)
+
+    with SyncUpdateDispatcher(handler, workers=1, max_pending=1, deduplicator=UpdateDeduplicator()) as dispatcher:
+        assert dispatcher.submit(make_update(1, chat_id=1))
+        # The queue is full while the first update is processed
+        assert not dispatcher.submit(make_update(2, chat_id=1), timeout=0.01)
+        unblocked.set()
+        assert dispatcher.submit(make_update(2, chat_id=1), timeout=5)
+
+    assert processed == [1, 2]
+    assert dispatcher.get_stats().duplicates == 0
+
+
+def test_dispatcher_drops_duplicates():
+    processed = []
+    acknowledged = []
+
+    async def handler(update):
+        processed.append(update.update_id)
+
+    async def main():
+        async with AsyncUpdateDispatcher(
+            handler,
+            deduplicator=UpdateDeduplicator(),
+            on_processed=lambda update: acknowledged.append(update.update_id),
+        ) as dispatcher:
+            for update_id in (1, 2, 1, 3, 2):
+                await dispatcher.submit(make_update(update_id, chat_id=1))
+        return dispatcher
+
+    dispatcher = asyncio.run(main())
+    assert processed == [1, 2, 3]
+    assert sorted(acknowledged) == [1, 1, 2, 2, 3]
+    assert dispatcher.get_stats().duplicates == 2
@@ -0,0 +1,97 @@
+import asyncio
+import threading
+import time
+
+from ..state_machine import SyncUpdateDispatcher, AsyncUpdateDispatcher
+from ..tg_api import Update
+
+
+def make_update(update_id: int, chat_id: int) -> Update:
+    return Update.parse_obj({
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': 0,
+            'chat': {'id': chat_id, 'type': 'private'},
+            'text': str(update_id),
+        },
+    })
+
+
+def test_sync_dispatcher_keeps_chat_order():
+    processed = {1: [], 2: [], 3: []}
+
+    def handler(update: Update):
+        time.sleep(0.001)
+        processed[update.chat_id].append(update.update_id)
+
+    with SyncUpdateDispatcher(handler, workers=4, max_pending=5) as dispatcher:
+        for update_id in range(60):
+            dispatcher.submit(make_update(update_id, update_id % 3 + 1))
+
+    assert processed[1] == list(range(0, 60, 3))
+    assert processed[2] == list(range(1, 60, 3))
+    assert processed[3] == list(range(2, 60, 3))
+
+    stats = dispatcher.get_stats()
+    assert stats.submitted == stats.processed == 60
+    assert stats.pending == 0
+    assert stats.max_pending <= 5
+    assert stats.active_chats == 0
+
+
+def test_sync_dispatcher_runs_chats_in_parallel():
+    barrier = threading.Barrier(2, timeout=5)
+
+    def handler(update: Update):
+        barrier.wait()
+
+    with SyncUpdateDispatcher(handler, workers=2) as dispatcher:
+        dispatcher.submit(make_update(1, 1))
+        dispatcher.submit(make_update(2, 2))
+
+    assert dispatcher.get_stats().failed == 0
+
+
+def test_sync_dispatcher_survives_handler_errors():
+    def handler(update: Update):
+        if update.update_id == 1:
+            raise ValueError('Broken update')
+
+    with SyncUpdateDispatcher(handler, workers=1) as dispatcher:
+        dispatcher.submit(make_update(1, 1))
+        dispatcher.submit(make_update(2, 1))
+
+    stats = dispatcher.get_stats()
+    assert stats.processed == 2
+    assert stats.failed == 1
+
+
+def test_async_dispatcher():
+    processed = {1: [], 2: []}
+    in_progress = set()
+    overlapped = False
+
+    async def handler(update: Update):
+        nonlocal overlapped
+        assert update.chat_id not in in_progress
+        in_progress.add(update.chat_id)
+        overlapped = overlapped or len(in_progress) > 1
+        await asyncio.sleep(0.001)
+        in_progress.remove(update.chat_id)
+        processed[update.chat_id].append(update.update_id)
+
+    async def main():
+        async with AsyncUpdateDispatcher(handler, workers=4, max_pending=3) as dispatcher:
+            for update_id in range(20):
+                await dispatcher.submit(make_update(update_id, update_id % 2 + 1))
+        return dispatcher
+
+    dispatcher = asyncio.run(main())
+
+    assert processed[1] == list(range(0, 20, 2))
+    assert processed[2] == list(range(1, 20, 2))
+    assert overlapped
+    stats = dispatcher.get_stats()
+    assert stats.processed == 20
+    assert stats.max_pending <= 3
@@ -0,0 +1,317 @@
+import asyncio
+import json
+from time import monotonic
+
+import httpx
+
+from ..tg_api import (
+    SyncTgClient,
+    AsyncTgClient,
+    OutboundScheduler,
+    AsyncOutboundScheduler,
+    TgRuntimeError,
+    Priority,
+    RetryPolicy,
+    SendMessageRequest,
+    EditMessageTextRequest,
+    EditMessageReplyMarkupRequest,
+    InlineKeyboardMarkup,
+    send_text_message,
+    asend_text_message,
+    edit_text_message,
+    edit_inline_keyboard,
+)
+from ..tg_api.outbound import OutboundJob, OutboundQueue
+from ..tg_api.shortcuts import merge_edit_requests
+
+
+class FakeRequest:
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def send(self) -> str:
+        return self.name
+
+    async def asend(self) -> str:
+        return self.name
+
+
+def make_job(chat_id: int, priority: Priority = Priority.NORMAL, name: str = '', **kwargs) -> OutboundJob:
+    return OutboundJob(request=FakeRequest(name), chat_id=chat_id, priority=priority, future=None, **kwargs)
+
+
+def pop_all_ready(queue: OutboundQueue, now: float) -> list[OutboundJob]:
+    jobs = []
+    while True:
+        job, _ = queue.pop(now)
+        if not job:
+            return jobs
+        jobs.append(job)
+        queue.complete(job, now)
+
+
+def test_chat_rate_limit():
+    queue = OutboundQueue(global_rate=100, chat_rate=1, chat_burst=1, now=0)
+    for _ in range(3):
+        queue.push(make_job(chat_id=1), now=0)
+
+    assert len(pop_all_ready(queue, now=0)) == 1
+    job, delay = queue.pop(now=0)
+    assert job is None
+    assert delay == 1
+    assert len(pop_all_ready(queue, now=1)) == 1
+    assert len(pop_all_ready(queue, now=2)) == 1
+    assert queue.pop(now=3) == (None, None)
+
+
+def test_global_rate_limit_and_priorities():
+    queue = OutboundQueue(global_rate=2, global_burst=2, chat_rate=10, chat_burst=10, now=0)
+    queue.push(make_job(chat_id=1, priority=Priority.LOW, name='low'), now=0)
+    queue.push(make_job(chat_id=2, priority=Priority.NORMAL, name='normal'), now=0)
+    queue.push(make_job(chat_id=3, priority=Priority.HIGH, name='high'), now=0)
+
+    assert [job.request.send() for job in pop_all_ready(queue, now=0)] == ['high', 'normal']
+    job, delay = queue.pop(now=0)
+    assert job is None
+    assert delay == 0.5
+    assert [job.request.send() for job in pop_all_ready(queue, now=0.5)] == ['low']
+
+
+def test_one_request_in_flight_per_chat():
+    queue = OutboundQueue(global_rate=100, chat_rate=100, chat_burst=100, now=0)
+    queue.push(make_job(chat_id=1, name='first'), now=0)
+    queue.push(make_job(chat_id=1, name='second'), now=0)
+
+    first_job, _ = queue.pop(now=0)
+    assert queue.pop(now=0) == (None, None)
+
+    queue.requeue(first_job, now=0, retry_after=5)
+    assert queue.pop(now=1)[0] is None
+    job, _ = queue.pop(now=5)
+    assert job.request.send() == 'first'
+    queue.complete(job, now=5)
+    job, _ = queue.pop(now=5)
+    assert job.request.send() == 'second'
+
+
+def test_scheduler_honors_retry_after():
+    attempts = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        attempts.append(request)
+        if len(attempts) == 1:
+            return httpx.Response(429, json={
+                'ok': False,
+                'error_code': 429,
+                'description': 'Too Many Requests: retry after 0',
+                'parameters': {'retry_after': 0},
+            })
+        return httpx.Response(200, json={'ok': True, 'result': {
+            'message_id': 1,
+            'date': 0,
+            'chat': {'id': 1, 'type': 'private'},
+            'text': 'Hello!',
+        }})
+
+    session = httpx.Client(transport=httpx.MockTransport(handler))
+    with (
+        SyncTgClient.setup('token', session=session, retry_policy=RetryPolicy(max_attempts=1)),
+        OutboundScheduler.setup() as scheduler,
+    ):
+        message = send_text_message('Hello!', 1)
+
+    assert message.text == 'Hello!'
+    assert len(attempts) == 2
+    stats = scheduler.get_stats()
+    assert stats.requeued == 1
+    assert stats.sent == 1
+
+
+class FloodServer:
+    """Answers the first request with a flood error and the others with a message."""
+
+    def __init__(self, retry_after: int):
+        self.retry_after = retry_after
+        self.sent_at = []
+
+    def handler(self, request: httpx.Request) -> httpx.Response:
+        self.sent_at.append(monotonic())
+        if len(self.sent_at) == 1:
+            return httpx.Response(429, json={
+                'ok': False,
+                'error_code': 429,
+                'description': f'Too Many Requests: retry after {self.retry_after}',
+                'parameters': {'retry_after': self.retry_after},
+            })
+        return httpx.Response(200, json={'ok': True, 'result': {
+            'message_id': len(self.sent_at),
+            'date': 0,
+            'chat': {'id': 1, 'type': 'private'},
+            'text': 'Hello!',
+        }})
+
+
+def test_scheduler_pauses_chat_on_short_retry_after():
+    server = FloodServer(retry_after=1)
+    session = httpx.Client(transport=httpx.MockTransport(server.handler))
+    # The default retry policy would wait a pause this short inside the request, holding the sender
+    with (
+        SyncTgClient.setup('token', session=session, retry_policy=RetryPolicy()),
+        OutboundScheduler.setup(chat_rate=100, chat_burst=100) as scheduler,
+    ):
+        futures = [scheduler.submit(SendMessageRequest(chat_id=1, text=text), chat_id=1) for text in ('1', '2')]
+        assert [future.result(timeout=5).result.message_id for future in futures] == [2, 3]
+
+    # No request to the chat is sent during the pause
+    assert len(server.sent_at) == 3
+    assert server.sent_at[1] - server.sent_at[0] >= 1
+    stats = scheduler.get_stats()
+    assert stats.requeued == 1
+    assert stats.sent == 2
+
+
+def test_async_scheduler_pauses_chat_on_short_retry_after():
+    server = FloodServer(retry_after=1)
+
+    async def main():
+        session = httpx.AsyncClient(transport=httpx.MockTransport(server.handler))
+        async with (
+            AsyncTgClient.setup('token', session=session, retry_policy=RetryPolicy()),
+            AsyncOutboundScheduler.setup(chat_rate=100, chat_burst=100) as scheduler,
+        ):
+            messages = await asyncio.gather(asend_text_message('1', 1), asend_text_message('2', 1))
+        return messages, scheduler.get_stats()
+
+    messages, stats = asyncio.run(main())
+    assert [message.message_id for message in messages] == [2, 3]
+    assert server.sent_at[1] - server.sent_at[0] >= 1
+    assert stats.requeued == 1
+
+
+def test_coalesce_queued_jobs():
+    queue = OutboundQueue(global_rate=100, chat_rate=100, chat_burst=100, now=0)
+    assert queue.push(make_job(chat_id=1, name='first', coalesce_key='edit', hold_until=1), now=0)
+    assert not queue.push(make_job(chat_id=1, name='second', coalesce_key='edit'), now=0)
+    assert queue.push(make_job(chat_id=2, name='other chat', coalesce_key='edit'), now=0)
+
+    assert [job.request.send() for job in pop_all_ready(queue, now=0)] == ['other chat']
+    job, delay = queue.pop(now=0)
+    assert job is None
+    assert delay == 1
+    job, _ = queue.pop(now=1)
+    assert job.request.send() == 'second'
+    assert len(job.coalesced_futures) == 1
+    assert queue.stats.coalesced == 1
+
+    assert queue.push(make_job(chat_id=1, name='third', coalesce_key='edit'), now=1)
+
+
+def test_merge_raises_priority_of_ready_chat():
+    queue = OutboundQueue(global_rate=1, global_burst=1, chat_rate=100, chat_burst=100, now=0)
+    queue.push(make_job(chat_id=1, priority=Priority.LOW, name='low edit', coalesce_key='edit'), now=0)
+    queue.push(make_job(chat_id=2, priority=Priority.NORMAL, name='normal'), now=0)
+    # Both chats become ready, the global bucket lets one job through per second
+    assert [job.request.send() for job in pop_all_ready(queue, now=0)] == ['normal']
+
+    queue.push(make_job(chat_id=3, priority=Priority.NORMAL, name='other normal'), now=0)
+    assert not queue.push(make_job(chat_id=1, priority=Priority.HIGH, name='high edit', coalesce_key='edit'), now=0)
+
+    assert [job.request.send() for job in pop_all_ready(queue, now=1)] == ['high edit']
+    assert [job.request.send() for job in pop_all_ready(queue, now=2)] == ['other normal']
+    assert queue.pop(now=3) == (None, None)
+
+
+def test_requeued_job_coalesces_later_jobs():
+    queue = OutboundQueue(global_rate=100, chat_rate=100, chat_burst=100, now=0)
+    queue.push(make_job(chat_id=1, name='first', coalesce_key='edit'), now=0)
+    job, _ = queue.pop(now=0)
+    # Edits queued while the first one is in flight and after it hit the flood limit go with it
+    assert queue.push(make_job(chat_id=1, name='second', coalesce_key='edit'), now=0)
+    queue.requeue(job, now=0, retry_after=5)
+    assert not queue.push(make_job(chat_id=1, name='third', coalesce_key='edit'), now=1)
+    assert queue.stats.queued == 1
+
+    job, _ = queue.pop(now=5)
+    assert job.request.send() == 'third'
+    assert len(job.coalesced_futures) == 2
+    queue.complete(job, now=5)
+    assert queue.pop(now=5) == (None, None)
+    assert queue.stats.coalesced == 2
+
+
+def test_merge_edit_requests():
+    markup = InlineKeyboardMarkup(inline_keyboard=[[]])
+    text_edit = EditMessageTextRequest(chat_id=1, message_id=1, text='new text')
+    markup_edit = EditMessageReplyMarkupRequest(chat_id=1, message_id=1, reply_markup=markup)
+
+    merged = merge_edit_requests(text_edit, markup_edit)
+    assert merged.text == 'new text'
+    assert merged.reply_markup == markup
+    assert merge_edit_requests(markup_edit, text_edit) is text_edit
+
+
+def test_scheduler_coalesces_edits():
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append((request.url.path.rsplit('/', 1)[-1], json.loads(request.content)))
+        return httpx.Response(200, json={'ok': True, 'result': {
+            'message_id': 1,
+            'date': 0,
+            'chat': {'id': 1, 'type': 'private'},
+            'text': 'third',
+        }})
+
+    session = httpx.Client(transport=httpx.MockTransport(handler))
+    with (
+        SyncTgClient.setup('token', session=session),
+        OutboundScheduler.setup(coalesce_window=0.2) as scheduler,
+    ):
+        edit_text_message(1, 1, 'first', wait=False)
+        edit_text_message(1, 1, 'second', wait=False)
+        edit_inline_keyboard(1, 1, [[('Button', 'data')]], wait=False)
+        message = edit_text_message(1, 1, 'third')
+
+    assert message.text == 'third'
+    assert len(requests) == 1
+    method, payload = requests[0]
+    assert method == 'editmessagetext'
+    assert payload['text'] == 'third'
+    stats = scheduler.get_stats()
+    assert stats.coalesced == 3
+    assert stats.sent == 1
+
+
+def test_scheduler_sends_queued_requests_on_stop():
+    with OutboundScheduler.setup(chat_rate=20, chat_burst=1) as scheduler:
+        futures = [scheduler.submit(FakeRequest(name), chat_id=1) for name in ('first', 'second', 'third')]
+
+    assert [future.result(timeout=0) for future in futures] == ['first', 'second', 'third']
+
+
+def test_scheduler_fails_requests_left_after_drain_timeout():
+    with OutboundScheduler.setup(chat_rate=1, chat_burst=1, drain_timeout=0.1) as scheduler:
+        futures = [scheduler.submit(FakeRequest(name), chat_id=1) for name in ('first', 'second')]
+        # The edit merged into the queued one is failed with it
+        futures.append(scheduler.submit(FakeRequest('edit'), chat_id=1, coalesce_key='edit'))
+        futures.append(scheduler.submit(FakeRequest('newer edit'), chat_id=1, coalesce_key='edit'))
+
+    assert futures[0].result(timeout=0) == 'first'
+    for future in futures[1:]:
+        assert isinstance(future.exception(timeout=0), TgRuntimeError)
+    assert scheduler.get_stats().queued == 0
+
+
+def test_async_scheduler_drains_and_fails_requests_on_stop():
+    async def main():
+        async with AsyncOutboundScheduler.setup(chat_rate=20, chat_burst=1) as scheduler:
+            sent = [scheduler.submit(FakeRequest(name), chat_id=1) for name in ('first', 'second')]
+        async with AsyncOutboundScheduler.setup(chat_rate=1, chat_burst=1, drain_timeout=0.1) as scheduler:
+            left = [scheduler.submit(FakeRequest(name), chat_id=1) for name in ('first', 'second')]
+        return sent, left
+
+    sent, left = asyncio.run(main())
+    assert [future.result() for future in sent] == ['first', 'second']
+    assert left[0].result() == 'first'
+    assert isinstance(left[1].exception(), TgRuntimeError)
@@ -0,0 +1,79 @@
+import asyncio
+
+from ..state_machine import Paginator, BasePageSource, Page
+
+
+class KeysetPageSource(BasePageSource):
+
+    def __init__(self, items: list[int]):
+        self.items = items
+        self.requests = []
+
+    def count(self) -> int:
+        return len(self.items)
+
+    def get_page(self, page_number: int, page_size: int, total_items: int, cursor: str | None = None) -> Page:
+        self.requests.append((page_number, cursor))
+        if cursor:
+            after = int(cursor)
+            items = [item for item in self.items if item > after][:page_size]
+        else:
+            start = (page_number - 1) * page_size
+            items = self.items[start:start + page_size]
+        return Page(items, cursor=str(items[0] - 1), prev_cursor=None, next_cursor=str(items[-1]))
+
+
+def get_callback_data(keyboard) -> list[str]:
+    return [button.callback_data for row in keyboard for button in row]
+
+
+def test_list_paginator():
+    paginator = Paginator(list(range(1, 8)), page_size=3)
+    keyboard = paginator.get_keyboard(2)
+
+    assert get_callback_data(keyboard) == ['4', '5', '6', 'page#1', 'page#1', 'page#2', 'page#3', 'page#3']
+    assert paginator.get_page(5).items == [7]
+
+
+def test_empty_list_paginator():
+    paginator = Paginator([], page_size=3)
+    assert paginator.get_keyboard() == []
+
+
+def test_page_source_cursors():
+    source = KeysetPageSource([10, 20, 30, 40, 50, 60, 70])
+    paginator = Paginator(page_source=source, page_size=2)
+
+    keyboard = paginator.get_keyboard(1)
+    next_page_data = keyboard[-1][3].callback_data
+    assert next_page_data == 'page#2#20'
+    assert Paginator.parse_callback_data(next_page_data) == (2, '20')
+
+    page = paginator.get_page(*Paginator.parse_callback_data(next_page_data))
+    assert page.items == [30, 40]
+    assert source.requests == [(1, None), (2, '20')]
+    # Edge pages are requested without cursors
+    assert paginator.get_page(4, '60').items == [70]
+
+
+def test_async_page_source():
+    class AsyncKeysetPageSource(KeysetPageSource):
+        def count(self) -> int:
+            raise AssertionError('Sync count is not expected')
+
+        async def acount(self) -> int:
+            return len(self.items)
+
+    async def get_keyboard():
+        paginator = await Paginator.acreate(page_source=AsyncKeysetPageSource([10, 20, 30, 40, 50]), page_size=2)
+        return paginator.total_pages, await paginator.aget_keyboard(2, '20')
+
+    total_pages, keyboard = asyncio.run(get_keyboard())
+    assert total_pages == 3
+    assert get_callback_data(keyboard) == ['30', '40', 'page#1', 'page#1', 'page#2#29', 'page#3', 'page#3']
+
+
+def test_parse_callback_data():
+    assert Paginator.parse_callback_data('page#3') == (3, None)
+    assert Paginator.parse_callback_data('page#x') == (1, None)
+    assert Paginator.parse_callback_data('add') is None
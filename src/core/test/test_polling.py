@@ -0,0 +1,256 @@
+import asyncio
+import json
+import time
+
+import httpx
+
+from ..tg_api import (
+    SyncTgClient,
+    UpdatesPoller,
+    AsyncTgClient,
+    AsyncUpdatesPoller,
+    RetryPolicy,
+    DeleteWebhookRequest,
+    GetUpdatesRequest,
+    FileOffsetStore,
+    SqliteOffsetStore,
+    OffsetCheckpointer,
+)
+
+
+def make_update(update_id: int) -> dict:
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': 0,
+            'chat': {'id': 1, 'type': 'private'},
+            'text': 'hello',
+        },
+    }
+
+
+class FakeUpdatesServer:
+    """Keeps updates like Telegram: `getUpdates` confirms the updates preceding its offset."""
+
+    def __init__(self, update_ids: range, *, limit: int = 2):
+        self.update_ids = update_ids
+        self.limit = limit
+        self.confirmed_offset = update_ids.start
+        self.requested_offsets = []
+
+    def handler(self, request: httpx.Request) -> httpx.Response:
+        offset = json.loads(request.content)['offset']
+        self.requested_offsets.append(offset)
+        self.confirmed_offset = max(self.confirmed_offset, offset)
+        updates = [
+            make_update(update_id)
+            for update_id in self.update_ids
+            if update_id >= self.confirmed_offset
+        ][:self.limit]
+        return httpx.Response(200, json={'ok': True, 'result': updates})
+
+
+def test_poller_prefetches_and_commits_acknowledged_offset():
+    server = FakeUpdatesServer(range(1, 7))
+    session = httpx.Client(transport=httpx.MockTransport(server.handler))
+    with SyncTgClient.setup('token', session=session):
+        poller = UpdatesPoller(GetUpdatesRequest(offset=1, timeout=0))
+        updates = poller.listen_updates()
+
+        first_update = next(updates)
+        second_update = next(updates)
+        assert [first_update.update_id, second_update.update_id] == [1, 2]
+        assert poller.committed_offset == 1
+
+        poller.ack(second_update)
+        assert poller.committed_offset == 1
+        poller.ack(first_update)
+        assert poller.committed_offset == 3
+        third_update = next(updates)
+        assert third_update.update_id == 3
+        poller.ack(third_update)
+        assert poller.committed_offset == 4
+        updates.close()
+
+    # Updates are never confirmed to Telegram before they are acknowledged
+    assert server.requested_offsets == sorted(server.requested_offsets)
+    assert set(server.requested_offsets) <= {1, 3, 4}
+
+
+def test_poller_receives_unacknowledged_updates_after_crash(tmp_path):
+    server = FakeUpdatesServer(range(1, 7))
+    session = httpx.Client(transport=httpx.MockTransport(server.handler))
+    store = FileOffsetStore(tmp_path / 'offset')
+    with SyncTgClient.setup('token', session=session):
+        poller = UpdatesPoller(
+            GetUpdatesRequest(offset=1, timeout=0),
+            checkpointer=OffsetCheckpointer(store, every_updates=1),
+        )
+        updates = poller.listen_updates()
+        poller.ack(next(updates))
+        poller.ack(next(updates))
+        # The process dies while the third update is processed and the next batch is prefetched
+        assert next(updates).update_id == 3
+        updates.close()
+        assert store.load() == 3
+
+        restarted_poller = UpdatesPoller(
+            GetUpdatesRequest(timeout=0),
+            checkpointer=OffsetCheckpointer(store, every_updates=1),
+        )
+        restarted_updates = restarted_poller.listen_updates()
+        received_update_ids = []
+        for update in restarted_updates:
+            received_update_ids.append(update.update_id)
+            restarted_poller.ack(update)
+            if update.update_id == 6:
+                break
+        restarted_updates.close()
+
+    assert received_update_ids == [3, 4, 5, 6]
+
+
+def test_poller_does_not_download_updates_in_flight_on_every_ack():
+    server = FakeUpdatesServer(range(1, 7), limit=3)
+    session = httpx.Client(transport=httpx.MockTransport(server.handler))
+    with SyncTgClient.setup('token', session=session):
+        poller = UpdatesPoller(GetUpdatesRequest(offset=1, timeout=0))
+        updates = poller.listen_updates()
+        for _ in range(6):
+            update = next(updates)
+            time.sleep(0.05)
+            if update.update_id == 6:
+                requested_offsets = list(server.requested_offsets)
+            poller.ack(update)
+        updates.close()
+
+    # A batch is downloaded again at most once, until all its updates are acknowledged
+    assert len(requested_offsets) <= 4
+    assert requested_offsets[0] == 1
+    assert 4 in requested_offsets
+
+
+def test_async_poller_does_not_download_updates_in_flight_on_every_ack():
+    server = FakeUpdatesServer(range(1, 7), limit=3)
+
+    async def main():
+        session = httpx.AsyncClient(transport=httpx.MockTransport(server.handler))
+        async with AsyncTgClient.setup('token', session=session):
+            poller = AsyncUpdatesPoller(GetUpdatesRequest(offset=1, timeout=0))
+            updates = poller.alisten_updates()
+            for _ in range(6):
+                update = await anext(updates)
+                await asyncio.sleep(0.05)
+                if update.update_id == 6:
+                    requested_offsets = list(server.requested_offsets)
+                poller.ack(update)
+            await updates.aclose()
+        return requested_offsets
+
+    requested_offsets = asyncio.run(main())
+    assert len(requested_offsets) <= 4
+    assert 4 in requested_offsets
+
+
+def make_flaky_handler(requests: list[httpx.Request]):
+    """Answer getUpdates with a server error, then with a rate limit error and then with an update."""
+    responses = [
+        httpx.Response(502, json={'ok': False, 'error_code': 502, 'description': 'Bad Gateway'}),
+        httpx.Response(429, json={
+            'ok': False,
+            'error_code': 429,
+            'description': 'Too Many Requests: retry after 0',
+            'parameters': {'retry_after': 0},
+        }),
+    ]
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        if len(requests) <= len(responses):
+            return responses[len(requests) - 1]
+        return httpx.Response(200, json={'ok': True, 'result': [make_update(1)]})
+
+    return handler
+
+
+def test_poller_recovers_from_server_and_rate_limit_errors():
+    requests = []
+    session = httpx.Client(transport=httpx.MockTransport(make_flaky_handler(requests)))
+    with SyncTgClient.setup('token', session=session):
+        poller = UpdatesPoller(GetUpdatesRequest(offset=1, timeout=0), retry_policy=RetryPolicy(base_delay=0.01))
+        updates = poller.listen_updates()
+        assert next(updates).update_id == 1
+        updates.close()
+
+    assert len(requests) >= 3
+
+
+def test_async_poller_recovers_from_server_and_rate_limit_errors():
+    requests = []
+
+    async def main():
+        session = httpx.AsyncClient(transport=httpx.MockTransport(make_flaky_handler(requests)))
+        async with AsyncTgClient.setup('token', session=session):
+            poller = AsyncUpdatesPoller(
+                GetUpdatesRequest(offset=1, timeout=0),
+                retry_policy=RetryPolicy(base_delay=0.01),
+            )
+            updates = poller.alisten_updates()
+            update = await anext(updates)
+            await updates.aclose()
+            return update
+
+    assert asyncio.run(main()).update_id == 1
+    assert len(requests) >= 3
+
+
+def test_checkpointer_batches_saves(tmp_path):
+    store = FileOffsetStore(tmp_path / 'offset')
+    checkpointer = OffsetCheckpointer(store, every_updates=3, every_seconds=3600)
+    assert checkpointer.load() is None
+
+    checkpointer.commit(2)
+    checkpointer.commit(3)
+    assert store.load() is None
+    checkpointer.commit(5)
+    checkpointer.commit(4)
+    assert store.load() == 5
+
+    checkpointer.commit(6)
+    checkpointer.close()
+    assert store.load() == 6
+
+
+def test_poller_resumes_from_stored_offset(tmp_path):
+    store = SqliteOffsetStore(tmp_path / 'offsets.db')
+    store.save(42)
+    poller = UpdatesPoller(checkpointer=OffsetCheckpointer(store))
+    assert poller.request.offset == 42
+    assert poller.committed_offset == 42
+    store.close()
+
+
+def test_long_polling_uses_dedicated_session():
+    polling_requests = []
+    requests = []
+
+    def polling_handler(request: httpx.Request) -> httpx.Response:
+        polling_requests.append(request)
+        return httpx.Response(200, json={'ok': True, 'result': []})
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        return httpx.Response(200, json={'ok': True, 'result': True})
+
+    client = SyncTgClient(
+        'token',
+        session=httpx.Client(transport=httpx.MockTransport(handler)),
+        polling_session=httpx.Client(transport=httpx.MockTransport(polling_handler)),
+    )
+    with client.set_as_default():
+        assert list(GetUpdatesRequest().send()) == []
+        DeleteWebhookRequest().send()
+
+    assert len(polling_requests) == 1
+    assert len(requests) == 1
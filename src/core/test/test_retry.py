@@ -0,0 +1,112 @@
+import asyncio
+
+import httpx
+import pytest
+
+from ..tg_api import (
+    SyncTgClient,
+    AsyncTgClient,
+    RetryPolicy,
+    RetryBudget,
+    TgHttpStatusError,
+    SendMessageRequest,
+    DeleteMessageRequest,
+)
+
+MESSAGE_RESPONSE = {'ok': True, 'result': {
+    'message_id': 1,
+    'date': 0,
+    'chat': {'id': 1, 'type': 'private'},
+    'text': 'Hello!',
+}}
+FLOOD_RESPONSE = {
+    'ok': False,
+    'error_code': 429,
+    'description': 'Too Many Requests: retry after 0',
+    'parameters': {'retry_after': 0},
+}
+SERVER_ERROR_RESPONSE = {'ok': False, 'error_code': 502, 'description': 'Bad Gateway'}
+
+
+def make_session(*responses: httpx.Response) -> tuple[httpx.Client, list[httpx.Request]]:
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        return responses[min(len(requests), len(responses)) - 1]
+
+    return httpx.Client(transport=httpx.MockTransport(handler)), requests
+
+
+def make_policy(**kwargs) -> RetryPolicy:
+    return RetryPolicy(base_delay=0, jitter=0, **kwargs)
+
+
+def test_retry_after_flood_error():
+    session, requests = make_session(
+        httpx.Response(429, json=FLOOD_RESPONSE),
+        httpx.Response(200, json=MESSAGE_RESPONSE),
+    )
+    with SyncTgClient.setup('token', session=session, retry_policy=make_policy()):
+        response = SendMessageRequest(chat_id=1, text='Hello!').send()
+
+    assert response.result.text == 'Hello!'
+    assert len(requests) == 2
+
+
+def test_server_errors_retried_for_idempotent_methods_only():
+    session, requests = make_session(httpx.Response(502, json=SERVER_ERROR_RESPONSE))
+    with SyncTgClient.setup('token', session=session, retry_policy=make_policy(max_attempts=3)):
+        with pytest.raises(TgHttpStatusError):
+            DeleteMessageRequest(chat_id=1, message_id=1).send()
+        assert len(requests) == 3
+
+        with pytest.raises(TgHttpStatusError):
+            SendMessageRequest(chat_id=1, text='Hello!').send()
+        assert len(requests) == 4
+
+
+def test_long_retry_after_is_raised():
+    flood_response = {**FLOOD_RESPONSE, 'parameters': {'retry_after': 30}}
+    session, requests = make_session(httpx.Response(429, json=flood_response))
+    with SyncTgClient.setup('token', session=session, retry_policy=make_policy()):
+        with pytest.raises(TgHttpStatusError):
+            SendMessageRequest(chat_id=1, text='Hello!').send()
+    assert len(requests) == 1
+
+
+def test_retry_budget():
+    budget = RetryBudget(ratio=0.5, min_per_second=0, max_tokens=1)
+    assert budget.try_spend()
+    assert not budget.try_spend()
+    budget.record_request()
+    assert not budget.try_spend()
+    budget.record_request()
+    assert budget.try_spend()
+
+
+def test_backoff():
+    policy = RetryPolicy(base_delay=1, max_delay=5, jitter=0)
+    assert [policy.get_backoff(attempt) for attempt in range(5)] == [1, 2, 4, 5, 5]
+
+    policy = RetryPolicy(base_delay=1, max_delay=5, jitter=0.5)
+    assert all(0.5 <= policy.get_backoff(0) <= 1 for _ in range(100))
+
+
+def test_async_retry_on_connect_error():
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        if len(requests) == 1:
+            raise httpx.ConnectError('Connection refused', request=request)
+        return httpx.Response(200, json=MESSAGE_RESPONSE)
+
+    async def send_message():
+        session = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        async with AsyncTgClient.setup('token', session=session, retry_policy=make_policy()):
+            return await SendMessageRequest(chat_id=1, text='Hello!').asend()
+
+    response = asyncio.run(send_message())
+    assert response.result.text == 'Hello!'
+    assert len(requests) == 2
@@ -0,0 +1,168 @@
+import asyncio
+from contextlib import asynccontextmanager, contextmanager
+
+import pytest
+
+from ..state_machine import BaseSessionRepository, BaseState, Locator, StateMachine, StateRouter
+from ..state_machine.state_machine import MAX_STATES_CHAIN_LEN
+from ..tg_api import Update
+
+CHAT_ID = 1
+router = StateRouter()
+events = []
+
+
+class SessionRepository(BaseSessionRepository):
+
+    def save_user_locator(self, user_id: int, locator: Locator) -> None:
+        self[user_id] = locator
+
+    def get_locator_by_user_id(self, user_id: int) -> Locator | None:
+        return self.get(user_id)
+
+
+@router.register('/')
+class StartState(BaseState):
+
+    async def aenter_state(self, update: Update) -> Locator | None:
+        events.append('enter /')
+
+    async def aprocess(self, update: Update) -> Locator | None:
+        events.append(f'process / {update.message.text}')
+        match update.message.text:
+            case 'add':
+                return Locator('/add/', {'title': 'Todo'})
+            case 'stay':
+                return Locator('/', {'page': 2})
+
+    async def aexit_state(self, update: Update) -> None:
+        events.append('exit /')
+
+
+@router.register('/add/')
+class AddState(BaseState):
+    title: str
+
+    async def aenter_state(self, update: Update) -> Locator | None:
+        events.append(f'enter /add/ {self.title}')
+        # Chained to the next state within the update
+        return Locator('/saved/')
+
+    async def aexit_state(self, update: Update) -> None:
+        events.append('exit /add/')
+
+
+@router.register('/saved/')
+class SavedState(BaseState):
+    """Sync hooks serve the async runtime by default."""
+
+    def enter_state(self, update: Update) -> Locator | None:
+        events.append('enter /saved/')
+
+    def process(self, update: Update) -> Locator | None:
+        events.append('process /saved/')
+        return Locator('/')
+
+    def exit_state(self, update: Update) -> None:
+        events.append('exit /saved/')
+
+
+@router.register('/loop/')
+class LoopState(BaseState):
+    step: int = 0
+
+    async def aenter_state(self, update: Update) -> Locator | None:
+        events.append(f'enter /loop/ {self.step}')
+        return Locator('/loop/', {'step': self.step + 1})
+
+
+def make_update(text: str) -> Update:
+    return Update.parse_obj({
+        'update_id': 1,
+        'message': {'message_id': 1, 'date': 0, 'chat': {'id': CHAT_ID, 'type': 'private'}, 'text': text},
+    })
+
+
+@pytest.fixture
+def state_machine():
+    events.clear()
+    return StateMachine(
+        state_router=router,
+        session_repository=SessionRepository(),
+        start_state_locator=Locator('/'),
+        commands_map={'/start': Locator('/'), '/loop': Locator('/loop/')},
+    )
+
+
+def test_aprocess_enters_start_state_of_new_user(state_machine):
+    asyncio.run(state_machine.aprocess(make_update('hello')))
+
+    assert events == ['enter /']
+    assert state_machine.session_repository.get_locator_by_user_id(CHAT_ID) == Locator('/')
+
+
+def test_aprocess_exits_state_and_follows_chain(state_machine):
+    async def main():
+        await state_machine.aprocess(make_update('/start'))
+        await state_machine.aprocess(make_update('add'))
+
+    asyncio.run(main())
+
+    assert events == [
+        'enter /',
+        'process / add',
+        'exit /',
+        'enter /add/ Todo',
+        'exit /add/',
+        'enter /saved/',
+    ]
+    assert state_machine.session_repository.get_locator_by_user_id(CHAT_ID) == Locator('/saved/')
+
+
+def test_aprocess_does_not_exit_state_switched_to_itself(state_machine):
+    async def main():
+        await state_machine.aprocess(make_update('/start'))
+        await state_machine.aprocess(make_update('stay'))
+        # No next state, the user stays in the state
+        await state_machine.aprocess(make_update('other'))
+
+    asyncio.run(main())
+
+    assert events == ['enter /', 'process / stay', 'enter /', 'process / other']
+    assert state_machine.session_repository.get_locator_by_user_id(CHAT_ID) == Locator('/', {'page': 2})
+
+
+def test_aprocess_calls_sync_hooks_by_default(state_machine):
+    state_machine.session_repository.save_user_locator(CHAT_ID, Locator('/saved/'))
+
+    asyncio.run(state_machine.aprocess(make_update('hello')))
+
+    assert events == ['process /saved/', 'exit /saved/', 'enter /']
+
+
+def test_aswitch_state_limits_chain_length(state_machine):
+    asyncio.run(state_machine.aswitch_state(Locator('/loop/'), make_update('/loop')))
+
+    assert events == [f'enter /loop/ {step}' for step in range(MAX_STATES_CHAIN_LEN - 1)]
+    locator = state_machine.session_repository.get_locator_by_user_id(CHAT_ID)
+    assert locator == Locator('/loop/', {'step': MAX_STATES_CHAIN_LEN - 1})
+
+
+def test_aprocess_runs_update_in_units_of_work(state_machine):
+    @contextmanager
+    def unit_of_work():
+        events.append('begin')
+        yield
+        events.append('end')
+
+    @asynccontextmanager
+    async def async_unit_of_work():
+        events.append('abegin')
+        yield
+        events.append('aend')
+
+    state_machine.unit_of_work = unit_of_work
+    state_machine.async_unit_of_work = async_unit_of_work
+    asyncio.run(state_machine.aprocess(make_update('/start')))
+
+    assert events == ['begin', 'abegin', 'enter /', 'aend', 'end']
@@ -0,0 +1,111 @@
+import asyncio
+import random
+import threading
+from math import ceil, floor
+from time import sleep, time
+
+import pytest
+
+from ..state_machine import BaseTimerScheduler, TimerWheel, TimerScheduler, AsyncTimerScheduler
+
+
+def test_timer_wheel_fires_timers_across_levels():
+    # Three levels of four slots reach 64 ticks ahead, later timers wait in the overflow
+    wheel = TimerWheel(tick=1, slots=4, levels=3, now=0)
+    deadlines = {'now': 0, 'soon': 0.5, 'level_0': 3, 'level_1': 5, 'level_2': 40.2, 'overflow': 100, 'far': 1000}
+    for key, deadline in deadlines.items():
+        wheel.schedule(key, deadline)
+    wheel.schedule('cancelled', 7)
+    wheel.schedule('moved', 70)
+    wheel.schedule('moved', 9)
+
+    assert wheel.cancel('cancelled')
+    assert not wheel.cancel('cancelled')
+    assert len(wheel) == 8
+
+    fired = {}
+    for now in range(1100):
+        for key, deadline in wheel.advance(now):
+            fired[key] = now
+    assert fired == {key: ceil(deadline) for key, deadline in {**deadlines, 'moved': 9}.items()}
+    assert len(wheel) == 0
+    assert wheel.get_delay(1100) is None
+
+
+def test_timer_wheel_skips_idle_ticks():
+    wheel = TimerWheel(tick=0.5, slots=8, levels=4, now=1000)
+    random.seed(1)
+    deadlines = {key: 1000 + random.uniform(0, 3000) for key in range(500)}
+    for key, deadline in deadlines.items():
+        wheel.schedule(key, deadline)
+
+    fired = {}
+    now = 1000
+    while len(wheel):
+        now += random.uniform(0, 20)
+        for key, deadline in wheel.advance(now):
+            fired[key] = now
+            # Timers expire within a tick after their deadline, which the advances may overshoot
+            assert floor((now - 1000) / 0.5) >= ceil((deadline - 1000) / 0.5)
+            assert deadline <= now
+    assert fired.keys() == deadlines.keys()
+
+
+def test_timer_scheduler_loads_window():
+    now = time()
+    stored_timers = {'soon': now + 0.05, 'later': now + 0.1, 'beyond_window': now + 60}
+    loads = []
+    fired = []
+    all_fired = threading.Event()
+
+    def load(since, until):
+        loads.append((since, until))
+        return [
+            (key, deadline)
+            for key, deadline in stored_timers.items()
+            if (since is None or deadline >= since) and deadline < until
+        ]
+
+    def on_expired(key):
+        fired.append(key)
+        if len(fired) == 3:
+            all_fired.set()
+
+    with TimerScheduler.setup(on_expired, load=load, window=10, tick=0.01) as scheduler:
+        sleep(0.01)
+        assert scheduler.schedule('scheduled', time() + 0.02)
+        assert not scheduler.schedule('beyond_window', time() + 60)
+        assert all_fired.wait(timeout=2)
+        stats = scheduler.get_stats()
+
+    assert sorted(fired) == ['later', 'scheduled', 'soon']
+    assert loads[0][0] is None
+    assert stats.loaded == 2
+    assert stats.fired == 3
+    assert stats.pending == 0
+
+
+def test_async_timer_scheduler():
+    fired = []
+
+    async def on_expired(key):
+        fired.append(key)
+
+    async def main():
+        async with AsyncTimerScheduler.setup(on_expired, tick=0.01) as scheduler:
+            scheduler.schedule('first', time() + 0.02)
+            scheduler.schedule('cancelled', time() + 0.03)
+            # Timers are scheduled from other threads too
+            await asyncio.to_thread(scheduler.schedule, 'second', time() + 0.04)
+            scheduler.cancel('cancelled')
+            await asyncio.sleep(0.2)
+            return scheduler.get_stats()
+
+    stats = asyncio.run(main())
+    assert fired == ['first', 'second']
+    assert stats.cancelled == 1
+
+
+def test_base_timer_scheduler_is_abstract():
+    with pytest.raises(TypeError, match='_wakeup'):
+        BaseTimerScheduler()
@@ -0,0 +1,92 @@
+import http.client
+import json
+import threading
+
+from ..tg_api import Update, WebhookServer, replay_updates
+
+
+def make_update(update_id: int) -> dict:
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': 0,
+            'chat': {'id': 1, 'type': 'private'},
+            'text': 'hello',
+        },
+    }
+
+
+def test_webhook_server():
+    received: list[Update] = []
+    all_received = threading.Event()
+
+    def on_update(update: Update):
+        received.append(update)
+        if len(received) == 2:
+            all_received.set()
+
+    with WebhookServer(on_update, host='127.0.0.1', port=0, path='/hook', secret_token='secret') as server:
+        server.start()
+
+        assert replay_updates(server.url, [make_update(1)], secret_token='wrong') == [403]
+        assert replay_updates(server.url, [make_update(1)]) == [403]
+        assert replay_updates(server.url, [{'message': 'garbage'}], secret_token='secret') == [400]
+        assert replay_updates(server.url.replace('/hook', '/other'), [make_update(1)], secret_token='secret') == [404]
+
+        updates = [make_update(1), Update.parse_obj(make_update(2))]
+        assert replay_updates(server.url, updates, secret_token='secret') == [200, 200]
+        assert all_received.wait(timeout=5)
+
+    assert [update.update_id for update in received] == [1, 2]
+    assert received[0].message.text == 'hello'
+
+
+def post(connection: http.client.HTTPConnection, path: str, body: bytes, headers: dict) -> http.client.HTTPResponse:
+    connection.request('POST', path, body=body, headers=headers)
+    response = connection.getresponse()
+    response.read()
+    return response
+
+
+def test_webhook_server_keeps_connection_after_rejected_requests():
+    received: list[Update] = []
+    all_received = threading.Event()
+
+    def on_update(update: Update):
+        received.append(update)
+        all_received.set()
+
+    with WebhookServer(on_update, host='127.0.0.1', port=0, path='/hook', secret_token='secret') as server:
+        server.start()
+        connection = http.client.HTTPConnection(*server.http_server.server_address[:2])
+        # Bodies of rejected requests look like requests, they must not be parsed as the next one
+        smuggled = b'POST /hook HTTP/1.1\r\nContent-Length: 2\r\n\r\n{}'
+        headers = {'Content-Type': 'application/json', 'X-Telegram-Bot-Api-Secret-Token': 'secret'}
+
+        assert post(connection, '/other', smuggled, headers).status == 404
+        socket = connection.sock
+        assert post(connection, '/hook', smuggled, {'Content-Type': 'application/json'}).status == 403
+        assert post(connection, '/hook', b'{"message": "garbage"}', headers).status == 400
+        assert post(connection, '/hook', json.dumps(make_update(1)).encode(), headers).status == 200
+        assert connection.sock is socket
+        assert all_received.wait(timeout=5)
+        connection.close()
+
+    assert [update.update_id for update in received] == [1]
+
+
+def test_webhook_server_rejects_invalid_content_length():
+    with WebhookServer(lambda update: None, host='127.0.0.1', port=0) as server:
+        server.start()
+        for content_length, status in (('abc', 400), ('-1', 400), (str(2 * 1024 * 1024), 413)):
+            connection = http.client.HTTPConnection(*server.http_server.server_address[:2])
+            connection.putrequest('POST', '/')
+            connection.putheader('Content-Length', content_length)
+            connection.endheaders()
+            response = connection.getresponse()
+            response.read()
+            assert response.status == status
+            # The body is not read, so the connection is closed instead of reused
+            assert response.getheader('Connection') == 'close'
+            connection.close()
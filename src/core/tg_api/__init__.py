@@ -1,6 +1,14 @@
-from .client import AsyncTgClient, SyncTgClient, raise_for_tg_response_status  # noqa F401
+from .client import AsyncTgClient, SyncTgClient, TransportConfig, raise_for_tg_response_status  # noqa F401
 from .exceptions import TgHttpStatusError, TgRuntimeError  # noqa F401
-from .shortcuts import send_text_message, edit_inline_keyboard  # noqa F401
+from .retry import RetryPolicy, RetryBudget  # noqa F401
+from .shortcuts import (  # noqa F401
+    send_text_message,
+    asend_text_message,
+    edit_inline_keyboard,
+    aedit_inline_keyboard,
+    edit_text_message,
+    aedit_text_message,
+)
 from .tg_methods import (  # noqa F401
     SendMessageResponse,
     SendMessageRequest,
@@ -30,6 +38,15 @@ from .tg_methods import (  # noqa F401
     GetUpdatesResponse,
     GetUpdatesRequest,
 )
+from .offset_store import (  # noqa F401
+    BaseOffsetStore,
+    FileOffsetStore,
+    SqliteOffsetStore,
+    OffsetCheckpointer,
+)
+from .outbound import OutboundScheduler, AsyncOutboundScheduler, Priority  # noqa F401
+from .polling import UpdatesPoller, AsyncUpdatesPoller  # noqa F401
+from .webhook import WebhookServer, load_recorded_updates, replay_updates  # noqa F401
 from .tg_types import (  # noqa F401
     ParseMode,
     User,
@@ -1,4 +1,4 @@
-from contextlib import asynccontextmanager, contextmanager, AsyncExitStack
+from contextlib import asynccontextmanager, contextmanager, AsyncExitStack, ExitStack
 from contextvars import ContextVar, Token
 from dataclasses import dataclass, KW_ONLY, field
 from urllib.parse import urljoin
@@ -7,6 +7,7 @@ from typing import AsyncGenerator, ClassVar, Generator, Type, TypeVar
 import httpx
 
 from .exceptions import TgHttpStatusError, TgRuntimeError
+from .retry import RetryPolicy
 
 DEFAULT_TG_SERVER_URL = 'https://api.telegram.org'
 
@@ -14,12 +15,77 @@ AsyncTgClientType = TypeVar('AsyncTgClientType', bound='AsyncTgClient')
 SyncTgClientType = TypeVar('SyncTgClientType', bound='SyncTgClient')
 
 
+@dataclass(frozen=True)
+class TransportConfig:
+    """HTTP connection settings of the sessions created by `SyncTgClient.setup` and `AsyncTgClient.setup`.
+
+    Long polling `getUpdates` requests get a dedicated connection with `polling_read_timeout`, which should
+    exceed the `timeout` of `GetUpdatesRequest`. So the poll neither holds a connection of the outbound pool
+    nor fails with a read timeout while waiting for updates. HTTP/2 requires the `h2` package.
+    """
+
+    max_connections: int = 100
+    max_keepalive_connections: int = 20
+    keepalive_expiry: float = 30
+    connect_timeout: float = 5
+    read_timeout: float = 10
+    write_timeout: float = 10
+    pool_timeout: float = 5
+    http2: bool = False
+    dedicated_polling_connection: bool = True
+    polling_read_timeout: float = 60
+
+    def get_limits(self) -> httpx.Limits:
+        return httpx.Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_keepalive_connections,
+            keepalive_expiry=self.keepalive_expiry,
+        )
+
+    def get_timeout(self) -> httpx.Timeout:
+        return httpx.Timeout(
+            connect=self.connect_timeout,
+            read=self.read_timeout,
+            write=self.write_timeout,
+            pool=self.pool_timeout,
+        )
+
+    def get_polling_limits(self) -> httpx.Limits:
+        return httpx.Limits(max_connections=1, max_keepalive_connections=1, keepalive_expiry=self.keepalive_expiry)
+
+    def get_polling_timeout(self) -> httpx.Timeout:
+        return httpx.Timeout(
+            connect=self.connect_timeout,
+            read=self.polling_read_timeout,
+            write=self.write_timeout,
+            pool=self.pool_timeout,
+        )
+
+    def make_session(self) -> httpx.Client:
+        return httpx.Client(limits=self.get_limits(), timeout=self.get_timeout(), http2=self.http2)
+
+    def make_async_session(self) -> httpx.AsyncClient:
+        return httpx.AsyncClient(limits=self.get_limits(), timeout=self.get_timeout(), http2=self.http2)
+
+    def make_polling_session(self) -> httpx.Client:
+        return httpx.Client(limits=self.get_polling_limits(), timeout=self.get_polling_timeout(), http2=self.http2)
+
+    def make_async_polling_session(self) -> httpx.AsyncClient:
+        return httpx.AsyncClient(
+            limits=self.get_polling_limits(),
+            timeout=self.get_polling_timeout(),
+            http2=self.http2,
+        )
+
+
 @dataclass(frozen=True)
 class AsyncTgClient:
     token: str
     _: KW_ONLY
     session: httpx.AsyncClient
+    polling_session: httpx.AsyncClient | None = None
     tg_server_url: str = DEFAULT_TG_SERVER_URL
+    retry_policy: RetryPolicy | None = field(default_factory=RetryPolicy)
 
     api_root: str = field(init=False)
 
@@ -37,16 +103,29 @@ class AsyncTgClient:
         *,
         session: httpx.AsyncClient | None = None,
         tg_server_url: str = DEFAULT_TG_SERVER_URL,
+        retry_policy: RetryPolicy | None = None,
+        transport: TransportConfig | None = None,
     ) -> AsyncGenerator[AsyncTgClientType, None]:
         if not token:
             # Safety check for empty string or None to avoid confusing HTTP 404 error
             raise ValueError(f'Telegram token is empty: {token!r}')
 
+        transport = transport or TransportConfig()
         async with AsyncExitStack() as stack:
+            polling_session = None
             if not session:
-                session = await stack.enter_async_context(httpx.AsyncClient())
-
-            client = cls(token=token, session=session, tg_server_url=tg_server_url)
+                session = await stack.enter_async_context(transport.make_async_session())
+                if transport.dedicated_polling_connection:
+                    polling_session = await stack.enter_async_context(transport.make_async_polling_session())
+
+            # Retries are enabled by default, pass RetryPolicy(max_attempts=1) to turn them off
+            client = cls(
+                token=token,
+                session=session,
+                polling_session=polling_session,
+                tg_server_url=tg_server_url,
+                retry_policy=retry_policy or RetryPolicy(),
+            )
             with client.set_as_default():
                 yield client
 
@@ -64,7 +143,9 @@ class SyncTgClient:
     token: str
     _: KW_ONLY
     session: httpx.Client
+    polling_session: httpx.Client | None = None
     tg_server_url: str = DEFAULT_TG_SERVER_URL
+    retry_policy: RetryPolicy | None = field(default_factory=RetryPolicy)
 
     api_root: str = field(init=False)
 
@@ -82,17 +163,31 @@ class SyncTgClient:
         *,
         session: httpx.Client = None,
         tg_server_url: str = DEFAULT_TG_SERVER_URL,
+        retry_policy: RetryPolicy | None = None,
+        transport: TransportConfig | None = None,
     ) -> Generator[SyncTgClientType, None, None]:
         if not token:
             # Safety check for empty string or None to avoid confusing HTTP 404 error
             raise ValueError(f'Telegram token is empty: {token!r}')
 
-        if not session:
-            session = httpx.Client()
-
-        client = cls(token=token, session=session, tg_server_url=tg_server_url)
-        with client.set_as_default():
-            yield client
+        transport = transport or TransportConfig()
+        with ExitStack() as stack:
+            polling_session = None
+            if not session:
+                session = stack.enter_context(transport.make_session())
+                if transport.dedicated_polling_connection:
+                    polling_session = stack.enter_context(transport.make_polling_session())
+
+            # Retries are enabled by default, pass RetryPolicy(max_attempts=1) to turn them off
+            client = cls(
+                token=token,
+                session=session,
+                polling_session=polling_session,
+                tg_server_url=tg_server_url,
+                retry_policy=retry_policy or RetryPolicy(),
+            )
+            with client.set_as_default():
+                yield client
 
     @contextmanager
     def set_as_default(self) -> Generator[None, None, None]:
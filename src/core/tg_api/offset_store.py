@@ -0,0 +1,126 @@
+import os
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from pathlib import Path
+from time import monotonic
+
+
+class BaseOffsetStore(ABC):
+    """Durable storage for the `getUpdates` offset."""
+
+    @abstractmethod
+    def load(self) -> int | None:
+        pass
+
+    @abstractmethod
+    def save(self, offset: int) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class FileOffsetStore(BaseOffsetStore):
+    """Keeps offset in a text file, the file is replaced atomically on every save."""
+
+    def __init__(self, path: str | Path):
+        self.path = Path(path)
+
+    def load(self) -> int | None:
+        try:
+            return int(self.path.read_text().strip())
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def save(self, offset: int) -> None:
+        tmp_path = self.path.with_name(f'{self.path.name}.tmp')
+        with open(tmp_path, 'w') as file:
+            file.write(str(offset))
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, self.path)
+
+
+class SqliteOffsetStore(BaseOffsetStore):
+    """Keeps offsets in a SQLite table, several bots may share one database file using different keys."""
+
+    def __init__(self, path: str | Path, *, key: str = 'default'):
+        self.key = key
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._connection:
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS update_offsets (key TEXT PRIMARY KEY, offset INTEGER NOT NULL)',
+            )
+
+    def load(self) -> int | None:
+        with self._lock:
+            row = self._connection.execute('SELECT offset FROM update_offsets WHERE key = ?', (self.key,)).fetchone()
+        return row[0] if row else None
+
+    def save(self, offset: int) -> None:
+        with self._lock, self._connection:
+            self._connection.execute(
+                'INSERT INTO update_offsets (key, offset) VALUES (?, ?) '
+                'ON CONFLICT (key) DO UPDATE SET offset = excluded.offset',
+                (self.key, offset),
+            )
+
+    def close(self) -> None:
+        self._connection.close()
+
+
+class OffsetCheckpointer:
+    """Batches offset saves: the offset is written once per `every_updates` commits or `every_seconds`.
+
+    After a crash up to one checkpoint interval of updates is received again, a graceful shutdown
+    calls `flush` and resumes exactly where it stopped.
+    """
+
+    def __init__(self, store: BaseOffsetStore, *, every_updates: int = 100, every_seconds: float = 5.0):
+        self.store = store
+        self.every_updates = every_updates
+        self.every_seconds = every_seconds
+        self._lock = threading.Lock()
+        self._offset: int | None = None
+        self._saved_offset: int | None = None
+        self._commits_since_save = 0
+        self._saved_at = monotonic()
+
+    def load(self) -> int | None:
+        self._saved_offset = self.store.load()
+        return self._saved_offset
+
+    def commit(self, offset: int) -> None:
+        with self._lock:
+            # Commits from concurrent workers may arrive out of order, offset never goes back
+            self._offset = max(offset, self._offset or offset)
+            self._commits_since_save += 1
+            if self._commits_since_save >= self.every_updates:
+                self._save()
+            else:
+                self._save_if_stale()
+
+    def flush_if_stale(self) -> None:
+        with self._lock:
+            self._save_if_stale()
+
+    def flush(self) -> None:
+        with self._lock:
+            self._save()
+
+    def close(self) -> None:
+        self.flush()
+        self.store.close()
+
+    def _save_if_stale(self) -> None:
+        if monotonic() - self._saved_at >= self.every_seconds:
+            self._save()
+
+    def _save(self) -> None:
+        if self._offset is not None and self._offset != self._saved_offset:
+            self.store.save(self._offset)
+            self._saved_offset = self._offset
+        self._commits_since_save = 0
+        self._saved_at = monotonic()
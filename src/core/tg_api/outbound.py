@@ -0,0 +1,564 @@
+import asyncio
+import contextvars
+import heapq
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar, Token
+from dataclasses import dataclass, field, replace
+from enum import IntEnum
+from itertools import count
+from time import monotonic
+from typing import Any, AsyncGenerator, Callable, ClassVar, Generator, Hashable
+
+from .exceptions import TgHttpStatusError, TgRuntimeError
+from .retry import get_retry_after, raise_rate_limit_errors
+
+DEFAULT_GLOBAL_RATE = 30
+DEFAULT_CHAT_RATE = 1
+MAX_BUCKETS_TO_KEEP = 10_000
+
+
+class Priority(IntEnum):
+    HIGH = 0
+    NORMAL = 1
+    LOW = 2
+
+
+class TokenBucket:
+    """Token bucket refilled with `rate` tokens per second up to `capacity` tokens."""
+
+    def __init__(self, rate: float, capacity: float, *, now: float | None = None):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = monotonic() if now is None else now
+        self.blocked_until = 0.0
+
+    def get_delay(self, now: float) -> float:
+        """Seconds to wait until a token is available."""
+        self._refill(now)
+        token_delay = max(0.0, (1 - self.tokens) / self.rate)
+        return max(token_delay, self.blocked_until - now)
+
+    def consume(self, now: float) -> None:
+        self._refill(now)
+        self.tokens -= 1
+
+    def block_until(self, moment: float) -> None:
+        self.blocked_until = max(self.blocked_until, moment)
+
+    def is_full(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity and self.blocked_until <= now
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+
+@dataclass(eq=False)
+class OutboundJob:
+    request: Any
+    chat_id: Hashable
+    priority: Priority
+    future: Any
+    coalesce_key: Hashable | None = None
+    merge: Callable[[Any, Any], Any] | None = None
+    hold_until: float = 0.0
+    context: contextvars.Context | None = None
+    seq: int = 0
+    requeues: int = 0
+    coalesced_futures: list = field(default_factory=list)
+
+
+@dataclass
+class OutboundStats:
+    submitted: int = 0
+    sent: int = 0
+    failed: int = 0
+    requeued: int = 0
+    coalesced: int = 0
+    queued: int = 0
+    max_queued: int = 0
+
+
+class OutboundQueue:
+    """Decides which request may be sent next without exceeding Telegram rate limits.
+
+    Requests of one chat are sent one at a time in submission order. Every chat has its own token bucket
+    and all the chats share the global bucket. Among the chats allowed to send, the one with the most
+    urgent priority lane goes first. The queue is not thread safe and takes the current time as argument,
+    schedulers call it under their own lock.
+
+    A job with `coalesce_key` is merged into a queued job of the same chat with the same key instead
+    of being queued, so only the latest state is sent, e.g. for several edits of one message.
+    `hold_until` keeps such a job in the queue for a short window to let later jobs merge into it.
+    """
+
+    def __init__(
+            self,
+            *,
+            global_rate: float = DEFAULT_GLOBAL_RATE,
+            global_burst: float = DEFAULT_GLOBAL_RATE,
+            chat_rate: float = DEFAULT_CHAT_RATE,
+            chat_burst: float = 3,
+            now: float | None = None,
+    ):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.global_bucket = TokenBucket(global_rate, global_burst, now=now)
+        self.stats = OutboundStats()
+        self._chat_buckets: dict[Hashable, TokenBucket] = {}
+        self._chat_queues: dict[Hashable, deque[OutboundJob]] = {}
+        self._in_flight_chats: set[Hashable] = set()
+        self._waiting_chats: list[tuple[float, int, Hashable]] = []
+        self._ready_chats: list[tuple[Priority, int, Hashable]] = []
+        # Valid entry of every ready chat, entries left in the heap by raising the priority are stale
+        self._ready_entries: dict[Hashable, tuple[Priority, int, Hashable]] = {}
+        self._coalescible_jobs: dict[tuple[Hashable, Hashable], OutboundJob] = {}
+        self._seq = count()
+
+    def push(self, job: OutboundJob, now: float) -> bool:
+        """Queue job. Return False if the job was merged into an already queued one."""
+        if job.coalesce_key is not None:
+            coalescible_key = (job.chat_id, job.coalesce_key)
+            if queued_job := self._coalescible_jobs.get(coalescible_key):
+                self._merge_jobs(queued_job, job)
+                self.stats.submitted += 1
+                self.stats.coalesced += 1
+                return False
+            self._coalescible_jobs[coalescible_key] = job
+
+        job.seq = next(self._seq)
+        chat_queue = self._chat_queues.setdefault(job.chat_id, deque())
+        chat_queue.append(job)
+
+        self.stats.submitted += 1
+        self.stats.queued += 1
+        self.stats.max_queued = max(self.stats.max_queued, self.stats.queued)
+        if len(chat_queue) == 1 and job.chat_id not in self._in_flight_chats:
+            self._schedule_chat(job.chat_id, now)
+        return True
+
+    def pop(self, now: float) -> tuple[OutboundJob | None, float | None]:
+        """Take the next job allowed to be sent.
+
+        Return the job or, if nothing may be sent yet, None and the number of seconds to wait.
+        Waiting time is None when the queue is empty.
+        """
+        while self._waiting_chats and self._waiting_chats[0][0] <= now:
+            _, _, chat_id = heapq.heappop(self._waiting_chats)
+            self._push_ready_chat(chat_id)
+        while self._ready_chats and self._ready_entries.get(self._ready_chats[0][2]) != self._ready_chats[0]:
+            heapq.heappop(self._ready_chats)
+
+        if not self._ready_chats:
+            if self._waiting_chats:
+                return None, self._waiting_chats[0][0] - now
+            return None, None
+
+        global_delay = self.global_bucket.get_delay(now)
+        if global_delay > 0:
+            return None, global_delay
+
+        _, _, chat_id = heapq.heappop(self._ready_chats)
+        del self._ready_entries[chat_id]
+        job = self._chat_queues[chat_id].popleft()
+        if job.coalesce_key is not None:
+            self._coalescible_jobs.pop((chat_id, job.coalesce_key), None)
+        self.global_bucket.consume(now)
+        self._get_chat_bucket(chat_id, now).consume(now)
+        self._in_flight_chats.add(chat_id)
+        self.stats.queued -= 1
+        return job, None
+
+    def complete(self, job: OutboundJob, now: float, *, failed: bool = False) -> None:
+        self._in_flight_chats.discard(job.chat_id)
+        if failed:
+            self.stats.failed += 1
+        else:
+            self.stats.sent += 1
+        self._reschedule_chat(job.chat_id, now)
+
+    def requeue(self, job: OutboundJob, now: float, *, retry_after: float) -> None:
+        """Put job back to the head of its chat queue and pause the chat for `retry_after` seconds."""
+        job.requeues += 1
+        self._in_flight_chats.discard(job.chat_id)
+        chat_queue = self._chat_queues.setdefault(job.chat_id, deque())
+        if job.coalesce_key is not None:
+            coalescible_key = (job.chat_id, job.coalesce_key)
+            # Jobs queued with the key while the job was in flight are sent with it
+            if newer_job := self._coalescible_jobs.get(coalescible_key):
+                chat_queue.remove(newer_job)
+                self._merge_jobs(job, newer_job)
+                self.stats.coalesced += 1
+                self.stats.queued -= 1
+            self._coalescible_jobs[coalescible_key] = job
+        chat_queue.appendleft(job)
+        self._get_chat_bucket(job.chat_id, now).block_until(now + retry_after)
+        self.stats.requeued += 1
+        self.stats.queued += 1
+        self._reschedule_chat(job.chat_id, now)
+
+    def is_empty(self) -> bool:
+        """Return True if no job is queued or in flight."""
+        return not self._chat_queues and not self._in_flight_chats
+
+    def clear(self) -> list[OutboundJob]:
+        """Remove the queued jobs and return them, jobs in flight are not affected."""
+        jobs = [job for chat_queue in self._chat_queues.values() for job in chat_queue]
+        self._chat_queues = {chat_id: deque() for chat_id in self._in_flight_chats}
+        self._waiting_chats.clear()
+        self._ready_chats.clear()
+        self._ready_entries.clear()
+        self._coalescible_jobs.clear()
+        self.stats.queued -= len(jobs)
+        return jobs
+
+    def _merge_jobs(self, queued_job: OutboundJob, job: OutboundJob) -> None:
+        queued_job.request = job.merge(queued_job.request, job.request) if job.merge else job.request
+        queued_job.coalesced_futures.extend((job.future, *job.coalesced_futures))
+        if job.priority < queued_job.priority:
+            queued_job.priority = job.priority
+            chat_queue = self._chat_queues.get(queued_job.chat_id)
+            if queued_job.chat_id in self._ready_entries and chat_queue and chat_queue[0] is queued_job:
+                # The chat is ready with the former priority, its entry in the heap becomes stale
+                self._push_ready_chat(queued_job.chat_id)
+
+    def _push_ready_chat(self, chat_id: Hashable) -> None:
+        head_job = self._chat_queues[chat_id][0]
+        entry = self._ready_entries[chat_id] = (head_job.priority, head_job.seq, chat_id)
+        heapq.heappush(self._ready_chats, entry)
+
+    def _reschedule_chat(self, chat_id: Hashable, now: float) -> None:
+        if self._chat_queues.get(chat_id):
+            self._schedule_chat(chat_id, now)
+        else:
+            self._chat_queues.pop(chat_id, None)
+
+    def _schedule_chat(self, chat_id: Hashable, now: float) -> None:
+        ready_at = now + self._get_chat_bucket(chat_id, now).get_delay(now)
+        ready_at = max(ready_at, self._chat_queues[chat_id][0].hold_until)
+        heapq.heappush(self._waiting_chats, (ready_at, next(self._seq), chat_id))
+
+    def _get_chat_bucket(self, chat_id: Hashable, now: float) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self._chat_buckets) >= MAX_BUCKETS_TO_KEEP:
+                self._forget_idle_buckets(now)
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst, now=now)
+        return bucket
+
+    def _forget_idle_buckets(self, now: float) -> None:
+        self._chat_buckets = {
+            chat_id: bucket
+            for chat_id, bucket in self._chat_buckets.items()
+            if chat_id in self._chat_queues or chat_id in self._in_flight_chats or not bucket.is_full(now)
+        }
+
+
+@dataclass
+class BaseOutboundScheduler:
+    global_rate: float = DEFAULT_GLOBAL_RATE
+    chat_rate: float = DEFAULT_CHAT_RATE
+    chat_burst: float = 3
+    max_requeues: int = 5
+    coalesce_window: float = 0.05
+    # Seconds `stop` keeps sending queued requests, requests still queued then fail with TgRuntimeError
+    drain_timeout: float = 5
+
+    queue: OutboundQueue = field(init=False)
+
+    def __post_init__(self) -> None:
+        self.queue = OutboundQueue(
+            global_rate=self.global_rate,
+            global_burst=self.global_rate,
+            chat_rate=self.chat_rate,
+            chat_burst=self.chat_burst,
+        )
+
+    def get_stats(self) -> OutboundStats:
+        return replace(self.queue.stats)
+
+    def _make_job(
+            self,
+            request: Any,
+            *,
+            chat_id: Hashable,
+            priority: Priority,
+            future: Any,
+            coalesce_key: Hashable | None,
+            merge: Callable[[Any, Any], Any] | None,
+    ) -> OutboundJob:
+        return OutboundJob(
+            request=request,
+            chat_id=chat_id,
+            priority=priority,
+            future=future,
+            coalesce_key=coalesce_key,
+            merge=merge,
+            hold_until=monotonic() + self.coalesce_window if coalesce_key is not None else 0.0,
+        )
+
+    def _fail_queued_jobs(self, jobs: list[OutboundJob]) -> None:
+        for job in jobs:
+            self._resolve(job, exception=TgRuntimeError('Outbound scheduler is stopped, the request is not sent'))
+
+    @staticmethod
+    def _resolve(job: OutboundJob, *, result: Any = None, exception: BaseException | None = None) -> None:
+        for future in (job.future, *job.coalesced_futures):
+            if future.done():
+                continue
+            if exception is not None:
+                future.set_exception(exception)
+            else:
+                future.set_result(result)
+
+
+@dataclass
+class OutboundScheduler(BaseOutboundScheduler):
+    """Sends requests for SyncTgClient from a pool of sender threads, see `OutboundQueue` for the rules.
+
+    Usage:
+
+        with SyncTgClient.setup(token), OutboundScheduler.setup():
+            send_text_message('Hello!', chat_id)
+    """
+
+    senders: int = 8
+
+    default_scheduler: ClassVar[ContextVar['OutboundScheduler']] = ContextVar('default_outbound_scheduler')
+
+    def __post_init__(self) -> None:
+        super().__post_init__()
+        self._condition = threading.Condition()
+        self._stopped = False
+        self._drain_deadline = 0.0
+        self._executor: ThreadPoolExecutor | None = None
+        self._thread: threading.Thread | None = None
+
+    @classmethod
+    @contextmanager
+    def setup(cls, **kwargs) -> Generator['OutboundScheduler', None, None]:
+        scheduler = cls(**kwargs)
+        scheduler.start()
+        try:
+            with scheduler.set_as_default():
+                yield scheduler
+        finally:
+            scheduler.stop()
+
+    @contextmanager
+    def set_as_default(self) -> Generator[None, None, None]:
+        default_scheduler_token: Token = self.default_scheduler.set(self)
+        try:
+            yield
+        finally:
+            self.default_scheduler.reset(default_scheduler_token)
+
+    def start(self) -> None:
+        self._executor = ThreadPoolExecutor(max_workers=self.senders, thread_name_prefix='outbound-sender')
+        self._thread = threading.Thread(target=self._run, name='outbound-scheduler', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Send the queued requests within `drain_timeout` and stop, the requests left fail."""
+        with self._condition:
+            self._stopped = True
+            self._drain_deadline = monotonic() + self.drain_timeout
+            self._condition.notify_all()
+        self._thread.join()
+        self._executor.shutdown(wait=True)
+        with self._condition:
+            jobs = self.queue.clear()
+        self._fail_queued_jobs(jobs)
+
+    def submit(
+            self,
+            request: Any,
+            *,
+            chat_id: Hashable,
+            priority: Priority = Priority.NORMAL,
+            coalesce_key: Hashable | None = None,
+            merge: Callable[[Any, Any], Any] | None = None,
+    ) -> Future:
+        """Queue request, the returned future resolves to the result of `request.send()`."""
+        job = self._make_job(
+            request,
+            chat_id=chat_id,
+            priority=priority,
+            future=Future(),
+            coalesce_key=coalesce_key,
+            merge=merge,
+        )
+        # Request is sent from another thread, it has to see the current default Telegram client
+        job.context = contextvars.copy_context()
+        with self._condition:
+            self.queue.push(job, monotonic())
+            self._condition.notify()
+        return job.future
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                if self._stopped and (self.queue.is_empty() or monotonic() >= self._drain_deadline):
+                    return
+                job, delay = self.queue.pop(monotonic())
+                if not job:
+                    if self._stopped:
+                        delay = min(delay or self.drain_timeout, self._drain_deadline - monotonic())
+                    self._condition.wait(timeout=delay)
+                    continue
+            self._executor.submit(self._execute, job)
+
+    @staticmethod
+    def _send(request: Any) -> Any:
+        with raise_rate_limit_errors():
+            return request.send()
+
+    def _execute(self, job: OutboundJob) -> None:
+        try:
+            result = job.context.run(self._send, job.request)
+        except TgHttpStatusError as ex:
+            retry_after = get_retry_after(ex)
+            with self._condition:
+                if retry_after is not None and job.requeues < self.max_requeues:
+                    self.queue.requeue(job, monotonic(), retry_after=retry_after)
+                    self._condition.notify()
+                    return
+                self.queue.complete(job, monotonic(), failed=True)
+                self._condition.notify()
+            self._resolve(job, exception=ex)
+        except BaseException as ex:
+            with self._condition:
+                self.queue.complete(job, monotonic(), failed=True)
+                self._condition.notify()
+            self._resolve(job, exception=ex)
+        else:
+            with self._condition:
+                self.queue.complete(job, monotonic())
+                self._condition.notify()
+            self._resolve(job, result=result)
+
+
+@dataclass
+class AsyncOutboundScheduler(BaseOutboundScheduler):
+    """Sends requests for AsyncTgClient from asyncio tasks, see `OutboundQueue` for the rules.
+
+    Usage:
+
+        async with AsyncTgClient.setup(token), AsyncOutboundScheduler.setup():
+            await asend_text_message('Hello!', chat_id)
+    """
+
+    max_in_flight: int = 64
+
+    default_scheduler: ClassVar[ContextVar['AsyncOutboundScheduler']] = ContextVar('default_outbound_scheduler')
+
+    def __post_init__(self) -> None:
+        super().__post_init__()
+        self._wakeup = asyncio.Event()
+        self._in_flight = asyncio.Semaphore(self.max_in_flight)
+        self._task: asyncio.Task | None = None
+        self._sending_tasks: set[asyncio.Task] = set()
+        self._stopped = False
+
+    @classmethod
+    @asynccontextmanager
+    async def setup(cls, **kwargs) -> AsyncGenerator['AsyncOutboundScheduler', None]:
+        scheduler = cls(**kwargs)
+        scheduler.start()
+        try:
+            with scheduler.set_as_default():
+                yield scheduler
+        finally:
+            await scheduler.stop()
+
+    @contextmanager
+    def set_as_default(self) -> Generator[None, None, None]:
+        default_scheduler_token: Token = self.default_scheduler.set(self)
+        try:
+            yield
+        finally:
+            self.default_scheduler.reset(default_scheduler_token)
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run(), name='outbound-scheduler')
+
+    async def stop(self) -> None:
+        """Send the queued requests within `drain_timeout` and stop, the requests left fail."""
+        self._stopped = True
+        self._wakeup.set()
+        await asyncio.wait({self._task}, timeout=self.drain_timeout)
+        self._task.cancel()
+        await asyncio.gather(self._task, *self._sending_tasks, return_exceptions=True)
+        self._fail_queued_jobs(self.queue.clear())
+
+    def submit(
+            self,
+            request: Any,
+            *,
+            chat_id: Hashable,
+            priority: Priority = Priority.NORMAL,
+            coalesce_key: Hashable | None = None,
+            merge: Callable[[Any, Any], Any] | None = None,
+    ) -> asyncio.Future:
+        """Queue request, the returned future resolves to the result of `request.asend()`."""
+        job = self._make_job(
+            request,
+            chat_id=chat_id,
+            priority=priority,
+            future=asyncio.get_running_loop().create_future(),
+            coalesce_key=coalesce_key,
+            merge=merge,
+        )
+        self.queue.push(job, monotonic())
+        self._wakeup.set()
+        return job.future
+
+    async def _run(self) -> None:
+        while True:
+            if self._stopped and self.queue.is_empty():
+                return
+            job, delay = self.queue.pop(monotonic())
+            if not job:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            await self._in_flight.acquire()
+            task = asyncio.create_task(self._execute(job))
+            self._sending_tasks.add(task)
+            task.add_done_callback(self._sending_tasks.discard)
+
+    async def _execute(self, job: OutboundJob) -> None:
+        try:
+            # The task runs in a copy of the context, the flag does not leak to the caller
+            with raise_rate_limit_errors():
+                result = await job.request.asend()
+        except TgHttpStatusError as ex:
+            retry_after = get_retry_after(ex)
+            if retry_after is not None and job.requeues < self.max_requeues:
+                self.queue.requeue(job, monotonic(), retry_after=retry_after)
+            else:
+                self.queue.complete(job, monotonic(), failed=True)
+                self._resolve(job, exception=ex)
+        except asyncio.CancelledError:
+            self.queue.complete(job, monotonic(), failed=True)
+            for future in (job.future, *job.coalesced_futures):
+                future.cancel()
+            raise
+        except Exception as ex:
+            self.queue.complete(job, monotonic(), failed=True)
+            self._resolve(job, exception=ex)
+        else:
+            self.queue.complete(job, monotonic())
+            self._resolve(job, result=result)
+        finally:
+            self._in_flight.release()
+            self._wakeup.set()
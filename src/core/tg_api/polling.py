@@ -0,0 +1,263 @@
+import asyncio
+import contextvars
+import queue
+import threading
+from collections import deque
+from collections.abc import AsyncGenerator, Generator
+from itertools import chain, repeat
+from time import sleep
+from typing import NoReturn
+
+import httpx
+
+from . import tg_types
+from .exceptions import TgHttpStatusError
+from .offset_store import OffsetCheckpointer
+from .retry import RetryPolicy, get_retry_after
+from .tg_methods import GetUpdatesRequest
+
+RECOVERABLE_ERRORS = (httpx.ConnectError, httpx.RemoteProtocolError, httpx.ConnectTimeout)
+# Period of checks whether the updates in flight are acknowledged, polling waits for them
+IN_FLIGHT_PAUSE = 0.05
+
+
+def _make_pauses():
+    max_pause = 10
+    return chain(
+        [0, 1, 3],
+        repeat(max_pause),
+    )
+
+
+class BaseUpdatesPoller:
+    """Long polling listener that fetches the next batch of updates while the current one is processed.
+
+    Updates are yielded as soon as they are fetched, the caller reports processed updates with `ack`.
+    `committed_offset` moves forward only over the contiguous range of acknowledged updates, so it can be
+    persisted as a restart point without losing unprocessed updates.
+
+    Telegram confirms all the updates preceding the offset of a `getUpdates` call, so batches are fetched
+    from the committed offset: unacknowledged updates stay on the Telegram side until they are processed
+    and are delivered again after a crash. Updates in flight received again are dropped, so fetching runs
+    ahead of processing by at most `limit` updates of the request. When a response holds only updates
+    in flight, polling waits until all the fetched updates are acknowledged instead of downloading them
+    again. `prefetch_batches` limits how many fetched batches may wait for processing.
+
+    With `checkpointer` given polling starts from the stored offset and the committed offset is saved
+    to the store as updates are acknowledged.
+
+    Rate limit and server errors of `getUpdates` do not stop polling: it waits for `retry_after` given by
+    Telegram or for the backoff of `retry_policy` and polls again.
+    """
+
+    def __init__(
+            self,
+            request: GetUpdatesRequest | None = None,
+            *,
+            prefetch_batches: int = 1,
+            checkpointer: OffsetCheckpointer | None = None,
+            retry_policy: RetryPolicy | None = None,
+    ):
+        if prefetch_batches < 1:
+            raise ValueError(f'prefetch_batches must be positive, got {prefetch_batches}')
+
+        self.request = request or GetUpdatesRequest()
+        self.prefetch_batches = prefetch_batches
+        self.checkpointer = checkpointer
+        # Only the backoff of the policy is used, polling is retried without limits
+        self.retry_policy = retry_policy or RetryPolicy(budget=None)
+        if checkpointer and (stored_offset := checkpointer.load()) is not None:
+            self.request = self.request.copy(update={'offset': stored_offset})
+        self.committed_offset = self.request.offset
+        # Updates up to this one are in flight or processed, Telegram sends them again until acknowledged
+        self._last_update_id: int | None = None
+        self._unacked_update_ids: deque[int] = deque()
+        self._acked_update_ids: set[int] = set()
+        self._lock = threading.Lock()
+        self._offset_committed = threading.Event()
+
+    def ack(self, update: tg_types.Update) -> None:
+        """Mark update as processed."""
+        with self._lock:
+            if not self._unacked_update_ids or update.update_id < self._unacked_update_ids[0]:
+                return
+            self._acked_update_ids.add(update.update_id)
+            previous_offset = self.committed_offset
+            while self._unacked_update_ids and self._unacked_update_ids[0] in self._acked_update_ids:
+                update_id = self._unacked_update_ids.popleft()
+                self._acked_update_ids.remove(update_id)
+                self.committed_offset = update_id + 1
+            committed_offset = self.committed_offset
+
+        if committed_offset != previous_offset:
+            self._offset_committed.set()
+            if self.checkpointer:
+                self.checkpointer.commit(committed_offset)
+
+    @property
+    def unacked_count(self) -> int:
+        return len(self._unacked_update_ids)
+
+    def _make_request(self) -> GetUpdatesRequest:
+        with self._lock:
+            return self.request.copy(update={'offset': self.committed_offset})
+
+    def _get_error_pause(self, ex: TgHttpStatusError, attempt: int) -> float | None:
+        """Return pause before polling again after the error or None if polling can not recover from it."""
+        if ex.response.status_code != 429 and ex.response.status_code < 500:
+            return None
+        retry_after = get_retry_after(ex)
+        return self.retry_policy.get_backoff(attempt) if retry_after is None else retry_after
+
+    def _on_idle(self) -> None:
+        if self.checkpointer:
+            self.checkpointer.flush_if_stale()
+
+    def _on_stop(self) -> None:
+        if self.checkpointer:
+            self.checkpointer.flush()
+
+    def _is_in_flight_acked(self) -> bool:
+        with self._lock:
+            return self._last_update_id is None or self.committed_offset > self._last_update_id
+
+    def _register_batch(self, batch: list[tg_types.Update]) -> list[tg_types.Update]:
+        """Start tracking the new updates of the batch and return them, updates in flight are dropped."""
+        with self._lock:
+            if self._last_update_id is not None:
+                batch = [update for update in batch if update.update_id > self._last_update_id]
+            if batch:
+                self._unacked_update_ids.extend(update.update_id for update in batch)
+                self._last_update_id = batch[-1].update_id
+        return batch
+
+
+class UpdatesPoller(BaseUpdatesPoller):
+    """Pipelined listener for SyncTgClient, batches are prefetched by a background thread.
+
+    Usage:
+
+        poller = UpdatesPoller()
+        with SyncUpdateDispatcher(state_machine.process, on_processed=poller.ack) as dispatcher:
+            for update in poller.listen_updates():
+                dispatcher.submit(update)
+    """
+
+    def listen_updates(self) -> Generator[tg_types.Update, None, NoReturn]:
+        batches = queue.Queue(maxsize=self.prefetch_batches)
+        stopped = threading.Event()
+        # Fetching thread inherits the context to see the default Telegram client
+        context = contextvars.copy_context()
+        fetcher = threading.Thread(
+            target=context.run,
+            args=(self._fetch_batches, batches, stopped),
+            name='updates-poller',
+            daemon=True,
+        )
+        fetcher.start()
+        try:
+            while True:
+                batch = batches.get()
+                if isinstance(batch, BaseException):
+                    raise batch
+                yield from batch
+        finally:
+            stopped.set()
+            self._on_stop()
+
+    def _fetch_batches(self, batches: queue.Queue, stopped: threading.Event) -> None:
+        pauses = _make_pauses()
+        failed_attempts = 0
+        while not stopped.is_set():
+            try:
+                batch = list(self._make_request().send())
+            except httpx.ReadTimeout:
+                continue
+            except RECOVERABLE_ERRORS:
+                sleep(next(pauses))
+                continue
+            except TgHttpStatusError as ex:
+                if (pause := self._get_error_pause(ex, failed_attempts)) is None:
+                    batches.put(ex)
+                    return
+                failed_attempts += 1
+                sleep(pause)
+                continue
+            except Exception as ex:
+                batches.put(ex)
+                return
+            pauses = _make_pauses()
+            failed_attempts = 0
+
+            if not batch:
+                self._on_idle()
+            elif new_updates := self._register_batch(batch):
+                batches.put(new_updates)
+            else:
+                self._wait_for_in_flight(stopped)
+
+    def _wait_for_in_flight(self, stopped: threading.Event) -> None:
+        while not stopped.is_set():
+            # Cleared before the check, so an acknowledgement after the check ends the wait
+            self._offset_committed.clear()
+            if self._is_in_flight_acked():
+                return
+            self._offset_committed.wait(IN_FLIGHT_PAUSE)
+
+
+class AsyncUpdatesPoller(BaseUpdatesPoller):
+    """Pipelined listener for AsyncTgClient, batches are prefetched by a background task.
+
+    Usage:
+
+        poller = AsyncUpdatesPoller()
+        async with AsyncUpdateDispatcher(state_machine.aprocess, on_processed=poller.ack) as dispatcher:
+            async for update in poller.alisten_updates():
+                await dispatcher.submit(update)
+    """
+
+    async def alisten_updates(self) -> AsyncGenerator[tg_types.Update, NoReturn]:
+        batches = asyncio.Queue(maxsize=self.prefetch_batches)
+        fetcher = asyncio.create_task(self._afetch_batches(batches), name='updates-poller')
+        try:
+            while True:
+                batch = await batches.get()
+                if isinstance(batch, BaseException):
+                    raise batch
+                for update in batch:
+                    yield update
+        finally:
+            fetcher.cancel()
+            self._on_stop()
+
+    async def _afetch_batches(self, batches: asyncio.Queue) -> None:
+        pauses = _make_pauses()
+        failed_attempts = 0
+        while True:
+            try:
+                batch = [update async for update in self._make_request().asend()]
+            except httpx.ReadTimeout:
+                continue
+            except RECOVERABLE_ERRORS:
+                await asyncio.sleep(next(pauses))
+                continue
+            except TgHttpStatusError as ex:
+                if (pause := self._get_error_pause(ex, failed_attempts)) is None:
+                    await batches.put(ex)
+                    return
+                failed_attempts += 1
+                await asyncio.sleep(pause)
+                continue
+            except Exception as ex:
+                await batches.put(ex)
+                return
+            pauses = _make_pauses()
+            failed_attempts = 0
+
+            if not batch:
+                self._on_idle()
+            elif new_updates := self._register_batch(batch):
+                await batches.put(new_updates)
+            else:
+                while not self._is_in_flight_acked():
+                    await asyncio.sleep(IN_FLIGHT_PAUSE)
@@ -0,0 +1,161 @@
+import asyncio
+import random
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from time import monotonic, sleep
+from typing import Awaitable, Callable, Generator, TypeVar
+
+import httpx
+
+from .exceptions import TgHttpStatusError
+
+ResultType = TypeVar('ResultType')
+
+# The request has not reached the server, it is safe to send it again
+NOT_SENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+# The request may have been processed by the server, only idempotent methods are sent again
+AMBIGUOUS_ERRORS = (httpx.ReadTimeout, httpx.WriteTimeout, httpx.ReadError, httpx.WriteError, httpx.RemoteProtocolError)
+
+NON_IDEMPOTENT_METHOD_PREFIXES = ('send', 'forward', 'copy', 'create')
+
+_rate_limit_errors_raised: ContextVar[bool] = ContextVar('rate_limit_errors_raised', default=False)
+
+
+def get_retry_after(ex: TgHttpStatusError) -> int | None:
+    if ex.response.status_code != 429 or not ex.tg_response or not ex.tg_response.parameters:
+        return None
+    return ex.tg_response.parameters.retry_after
+
+
+@contextmanager
+def raise_rate_limit_errors() -> Generator[None, None, None]:
+    """Raise rate limit errors of the requests sent within the scope instead of waiting for `retry_after`.
+
+    Used by the outbound schedulers: they requeue the request and pause the whole chat, while a pause
+    inside the request would hold the sender and let other requests to the chat hit the same limit.
+    """
+    token = _rate_limit_errors_raised.set(True)
+    try:
+        yield
+    finally:
+        _rate_limit_errors_raised.reset(token)
+
+
+def is_idempotent_method(api_method: str) -> bool:
+    """Check if a repeated call of the Bot API method can not produce a duplicate, like a second message."""
+    return not api_method.lower().startswith(NON_IDEMPOTENT_METHOD_PREFIXES)
+
+
+class RetryBudget:
+    """Limits retries to a share of the requests, so an outage does not multiply the load on the API.
+
+    Every request deposits `ratio` of a token, every retry withdraws a whole token. `min_per_second`
+    tokens are added over time to let a quiet bot retry occasional failures.
+    """
+
+    def __init__(self, *, ratio: float = 0.2, min_per_second: float = 1, max_tokens: float = 10):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.max_tokens = max_tokens
+        self._tokens = max_tokens
+        self._updated_at = monotonic()
+        self._lock = threading.Lock()
+
+    def record_request(self) -> None:
+        with self._lock:
+            self._tokens = min(self.max_tokens, self._tokens + self.ratio)
+
+    def try_spend(self) -> bool:
+        with self._lock:
+            now = monotonic()
+            self._tokens = min(self.max_tokens, self._tokens + (now - self._updated_at) * self.min_per_second)
+            self._updated_at = now
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    """Decides whether a failed Bot API call is sent again and how long to wait before it.
+
+    Rate limit errors wait for `retry_after` given by Telegram, server and network errors wait for
+    exponential backoff with jitter. Methods that create something, like `sendMessage`, are retried only
+    if the request surely was not processed: on a rate limit error or when the connection failed.
+    Rate limit pauses longer than `max_retry_after` are not waited, the error is raised to the caller.
+    Within `raise_rate_limit_errors` every rate limit error is raised.
+    """
+
+    max_attempts: int = 4
+    base_delay: float = 0.5
+    max_delay: float = 10
+    jitter: float = 0.5
+    max_retry_after: float = 5
+    budget: RetryBudget | None = field(default_factory=RetryBudget)
+
+    def get_backoff(self, attempt: int) -> float:
+        # The exponent is capped, long polling counts failed attempts without limits
+        delay = min(self.max_delay, self.base_delay * 2 ** min(attempt, 32))
+        return delay * (1 - self.jitter * random.random())
+
+    def is_retryable(self, api_method: str, ex: Exception) -> bool:
+        if isinstance(ex, NOT_SENT_ERRORS):
+            return True
+        if isinstance(ex, TgHttpStatusError) and ex.response.status_code == 429:
+            return True
+        if not is_idempotent_method(api_method):
+            return False
+        if isinstance(ex, TgHttpStatusError):
+            return ex.response.status_code >= 500
+        return isinstance(ex, AMBIGUOUS_ERRORS)
+
+    def get_retry_delay(self, api_method: str, ex: Exception, attempt: int) -> float | None:
+        """Return pause before the next attempt or None if the error should be raised.
+
+        :param attempt: Zero-based number of the failed attempt.
+        """
+        if attempt + 1 >= self.max_attempts or not self.is_retryable(api_method, ex):
+            return None
+
+        retry_after = get_retry_after(ex) if isinstance(ex, TgHttpStatusError) else None
+        if retry_after is not None:
+            if retry_after > self.max_retry_after or _rate_limit_errors_raised.get():
+                return None
+            delay = retry_after
+        else:
+            delay = self.get_backoff(attempt)
+
+        if self.budget and not self.budget.try_spend():
+            return None
+        return delay
+
+    def call(self, api_method: str, send: Callable[[], ResultType]) -> ResultType:
+        if self.budget:
+            self.budget.record_request()
+        attempt = 0
+        while True:
+            try:
+                return send()
+            except Exception as ex:
+                delay = self.get_retry_delay(api_method, ex, attempt)
+                if delay is None:
+                    raise
+            sleep(delay)
+            attempt += 1
+
+    async def acall(self, api_method: str, send: Callable[[], Awaitable[ResultType]]) -> ResultType:
+        if self.budget:
+            self.budget.record_request()
+        attempt = 0
+        while True:
+            try:
+                return await send()
+            except Exception as ex:
+                delay = self.get_retry_delay(api_method, ex, attempt)
+                if delay is None:
+                    raise
+            await asyncio.sleep(delay)
+            attempt += 1
@@ -1,8 +1,12 @@
+import traceback
+from concurrent.futures import Future
 from types import NoneType
-from typing import Literal
+from typing import Hashable, Literal
 
 from .exceptions import TgHttpStatusError
+from .outbound import AsyncOutboundScheduler, OutboundScheduler, Priority
 from .tg_methods import (
+    BaseTgRequest,
     SendMessageRequest,
     EditMessageReplyMarkupRequest, EditMessageTextRequest,
 )
@@ -21,6 +25,86 @@ KeyboardMarkup = InlineKeyboardMarkup | ReplyKeyboardMarkup
 KeyboardSchema = InlineKeyboardSchema | ReplyKeyboardSchema
 
 
+def send_request(
+        request: BaseTgRequest,
+        *,
+        chat_id: int | None,
+        priority: Priority = Priority.NORMAL,
+        coalesce_key: Hashable | None = None,
+        wait: bool = True,
+):
+    """Send request through the default outbound scheduler if one is set up, otherwise send it immediately.
+
+    With `wait=False` the request is only queued and None is returned, errors are printed.
+    """
+    scheduler = OutboundScheduler.default_scheduler.get(None)
+    if not scheduler:
+        return request.send()
+    future = scheduler.submit(
+        request,
+        chat_id=chat_id,
+        priority=priority,
+        coalesce_key=coalesce_key,
+        merge=merge_edit_requests,
+    )
+    if not wait:
+        future.add_done_callback(_report_edit_error)
+        return
+    return future.result()
+
+
+async def asend_request(
+        request: BaseTgRequest,
+        *,
+        chat_id: int | None,
+        priority: Priority = Priority.NORMAL,
+        coalesce_key: Hashable | None = None,
+        wait: bool = True,
+):
+    """Send request through the default async outbound scheduler if one is set up, otherwise send it immediately.
+
+    With `wait=False` the request is only queued and None is returned, errors are printed.
+    """
+    scheduler = AsyncOutboundScheduler.default_scheduler.get(None)
+    if not scheduler:
+        return await request.asend()
+    future = scheduler.submit(
+        request,
+        chat_id=chat_id,
+        priority=priority,
+        coalesce_key=coalesce_key,
+        merge=merge_edit_requests,
+    )
+    if not wait:
+        future.add_done_callback(_report_edit_error)
+        return
+    return await future
+
+
+def merge_edit_requests(
+        queued_request: EditMessageTextRequest | EditMessageReplyMarkupRequest,
+        request: EditMessageTextRequest | EditMessageReplyMarkupRequest,
+) -> EditMessageTextRequest | EditMessageReplyMarkupRequest:
+    """Combine two edits of one message into a single request carrying the latest text and markup."""
+    if isinstance(queued_request, EditMessageTextRequest) and isinstance(request, EditMessageReplyMarkupRequest):
+        return queued_request.copy(update={'reply_markup': request.reply_markup})
+    return request
+
+
+def _get_edit_coalesce_key(message_id: int | None, inline_message_id: int | str | None) -> Hashable:
+    return 'edit', message_id, inline_message_id
+
+
+def _report_edit_error(future: Future) -> None:
+    if future.cancelled() or not (ex := future.exception()):
+        return
+    if isinstance(ex, TgHttpStatusError) and (
+        'exactly the same' in str(ex) or 'too much time has passed since its creation' in str(ex)
+    ):
+        return
+    traceback.print_exception(ex)
+
+
 def send_text_message(
         text: str,
         chat_id: int,
@@ -33,8 +117,38 @@ def send_text_message(
         protect_content: bool | None = None,
         message_thread_id: bool | None = None,
         allow_sending_without_reply: bool | None = None,
+        priority: Priority = Priority.NORMAL,
+) -> Message:
+    request = SendMessageRequest(
+        text=text,
+        chat_id=chat_id,
+        reply_markup=generate_reply_markup(keyboard),
+        parse_mode=parse_mode,
+        entities=entities,
+        disable_web_page_preview=disable_web_page_preview,
+        disable_notification=disable_notification,
+        protect_content=protect_content,
+        message_thread_id=message_thread_id,
+        allow_sending_without_reply=allow_sending_without_reply,
+    )
+    return send_request(request, chat_id=chat_id, priority=priority).result
+
+
+async def asend_text_message(
+        text: str,
+        chat_id: int,
+        keyboard: KeyboardMarkup | KeyboardSchema | None = None,
+        *,
+        parse_mode: Literal['Markdown', 'MarkdownV2', 'HTML'] | None = None,
+        entities: list[MessageEntity] | None = None,
+        disable_web_page_preview: bool | None = None,
+        disable_notification: bool | None = None,
+        protect_content: bool | None = None,
+        message_thread_id: bool | None = None,
+        allow_sending_without_reply: bool | None = None,
+        priority: Priority = Priority.NORMAL,
 ) -> Message:
-    return SendMessageRequest(
+    request = SendMessageRequest(
         text=text,
         chat_id=chat_id,
         reply_markup=generate_reply_markup(keyboard),
@@ -45,7 +159,9 @@ def send_text_message(
         protect_content=protect_content,
         message_thread_id=message_thread_id,
         allow_sending_without_reply=allow_sending_without_reply,
-    ).send().result
+    )
+    response = await asend_request(request, chat_id=chat_id, priority=priority)
+    return response.result
 
 
 def edit_inline_keyboard(
@@ -55,27 +171,59 @@ def edit_inline_keyboard(
         *,
         inline_message_id: int | None = None,
         ignore_to_old_message=True,
+        priority: Priority = Priority.NORMAL,
+        wait: bool = True,
 ) -> Message | None:
-    match keyboard:
-        case InlineKeyboardMarkup():
-            reply_markup = keyboard
-        case None:
-            reply_markup = InlineKeyboardMarkup([[]])
-        case _:
-            reply_markup = generate_reply_markup(keyboard)
+    try:
+        request = EditMessageReplyMarkupRequest(
+            chat_id=chat_id,
+            message_id=message_id,
+            reply_markup=generate_inline_reply_markup(keyboard),
+            inline_message_id=inline_message_id,
+        )
+        response = send_request(
+            request,
+            chat_id=chat_id,
+            priority=priority,
+            coalesce_key=_get_edit_coalesce_key(message_id, inline_message_id),
+            wait=wait,
+        )
+    except TgHttpStatusError as ex:
+        if ignore_to_old_message and 'too much time has passed since its creation' in str(ex):
+            return
+    else:
+        return response.result if response else None
+
 
+async def aedit_inline_keyboard(
+        chat_id: int,
+        message_id: int,
+        keyboard: InlineKeyboardSchema | InlineKeyboardMarkup | None,
+        *,
+        inline_message_id: int | None = None,
+        ignore_to_old_message=True,
+        priority: Priority = Priority.NORMAL,
+        wait: bool = True,
+) -> Message | None:
     try:
-        message = EditMessageReplyMarkupRequest(
+        request = EditMessageReplyMarkupRequest(
             chat_id=chat_id,
             message_id=message_id,
-            reply_markup=reply_markup,
+            reply_markup=generate_inline_reply_markup(keyboard),
             inline_message_id=inline_message_id,
-        ).send().result
+        )
+        response = await asend_request(
+            request,
+            chat_id=chat_id,
+            priority=priority,
+            coalesce_key=_get_edit_coalesce_key(message_id, inline_message_id),
+            wait=wait,
+        )
     except TgHttpStatusError as ex:
         if ignore_to_old_message and 'too much time has passed since its creation' in str(ex):
             return
     else:
-        return message
+        return response.result if response else None
 
 
 def edit_text_message(
@@ -90,9 +238,11 @@ def edit_text_message(
         disable_web_page_preview: bool | None = None,
         ignore_exactly_the_same: bool = True,
         ignore_to_old_message: bool = True,
+        priority: Priority = Priority.NORMAL,
+        wait: bool = True,
 ) -> Message | None:
     try:
-        message = EditMessageTextRequest(
+        request = EditMessageTextRequest(
             chat_id=chat_id,
             message_id=message_id,
             text=text,
@@ -101,14 +251,76 @@ def edit_text_message(
             inline_message_id=inline_message_id,
             entities=entities,
             disable_web_page_preview=disable_web_page_preview,
-        ).send().result
+        )
+        response = send_request(
+            request,
+            chat_id=chat_id,
+            priority=priority,
+            coalesce_key=_get_edit_coalesce_key(message_id, inline_message_id),
+            wait=wait,
+        )
     except TgHttpStatusError as ex:
         if ignore_exactly_the_same and 'exactly the same' in str(ex):
             return
         if ignore_to_old_message and 'too much time has passed since its creation' in str(ex):
             return
     else:
-        return message
+        return response.result if response else None
+
+
+async def aedit_text_message(
+        chat_id: int,
+        message_id: int,
+        text: str,
+        keyboard: KeyboardMarkup | KeyboardSchema | None = None,
+        *,
+        parse_mode: Literal['Markdown', 'MarkdownV2', 'HTML'] | None = None,
+        inline_message_id: str | None = None,
+        entities: list[MessageEntity] | None = None,
+        disable_web_page_preview: bool | None = None,
+        ignore_exactly_the_same: bool = True,
+        ignore_to_old_message: bool = True,
+        priority: Priority = Priority.NORMAL,
+        wait: bool = True,
+) -> Message | None:
+    try:
+        request = EditMessageTextRequest(
+            chat_id=chat_id,
+            message_id=message_id,
+            text=text,
+            reply_markup=generate_reply_markup(keyboard),
+            parse_mode=parse_mode,
+            inline_message_id=inline_message_id,
+            entities=entities,
+            disable_web_page_preview=disable_web_page_preview,
+        )
+        response = await asend_request(
+            request,
+            chat_id=chat_id,
+            priority=priority,
+            coalesce_key=_get_edit_coalesce_key(message_id, inline_message_id),
+            wait=wait,
+        )
+    except TgHttpStatusError as ex:
+        if ignore_exactly_the_same and 'exactly the same' in str(ex):
+            return
+        if ignore_to_old_message and 'too much time has passed since its creation' in str(ex):
+            return
+    else:
+        return response.result if response else None
+
+
+def generate_inline_reply_markup(
+        keyboard: InlineKeyboardSchema | InlineKeyboardMarkup | None,
+) -> InlineKeyboardMarkup:
+    """Generate InlineKeyboardMarkup, an empty keyboard is used to remove the existing one."""
+    match keyboard:
+        case InlineKeyboardMarkup():
+            return keyboard
+        case None:
+            return InlineKeyboardMarkup([[]])
+        case _:
+            return generate_reply_markup(keyboard)
 
 
 def generate_reply_markup(keyboard: KeyboardMarkup | KeyboardSchema | None) -> KeyboardMarkup | None:
@@ -5,7 +5,7 @@ from collections.abc import AsyncGenerator, Generator
 from itertools import chain, repeat
 from textwrap import dedent
 from time import sleep
-from typing import Any, Union, NoReturn
+from typing import Any, ClassVar, Union, NoReturn
 
 import httpx
 from pydantic import BaseModel, Field
@@ -29,6 +29,11 @@ class BaseTgRequest(BaseModel, tg_types.ValidableMixin):
         validate_assignment = True
         anystr_strip_whitespace = True
 
+    # Failed JSON requests are sent again according to the client retry policy
+    retryable: ClassVar[bool] = True
+    # Long polling requests use the dedicated polling session of the client if it has one
+    long_polling: ClassVar[bool] = False
+
     async def apost_as_json(self, api_method: str) -> bytes:
         """Send a request to the Telegram Bot API asynchronously using a JSON payload.
 
@@ -40,16 +45,24 @@ class BaseTgRequest(BaseModel, tg_types.ValidableMixin):
         if not client:
             raise TgRuntimeError('Requires AsyncTgClient to be specified before call.')
 
-        http_response = await client.session.post(
-            f'{client.api_root}{api_method}',
-            headers={
-                'content-type': 'application/json',
-                'accept': 'application/json',
-            },
-            content=self.json(exclude_none=True).encode('utf-8'),
-        )
-        raise_for_tg_response_status(http_response)
-        return http_response.content
+        content = self.json(exclude_none=True).encode('utf-8')
+        session = client.polling_session if self.long_polling and client.polling_session else client.session
+
+        async def post() -> bytes:
+            http_response = await session.post(
+                f'{client.api_root}{api_method}',
+                headers={
+                    'content-type': 'application/json',
+                    'accept': 'application/json',
+                },
+                content=content,
+            )
+            raise_for_tg_response_status(http_response)
+            return http_response.content
+
+        if not self.retryable or not client.retry_policy:
+            return await post()
+        return await client.retry_policy.acall(api_method, post)
 
     def post_as_json(self, api_method: str) -> bytes:
         """Send a request to the Telegram Bot API synchronously using a JSON payload.
@@ -62,16 +75,24 @@ class BaseTgRequest(BaseModel, tg_types.ValidableMixin):
         if not client:
             raise TgRuntimeError('Requires SyncTgClient to be specified before call.')
 
-        http_response = client.session.post(
-            f'{client.api_root}{api_method}',
-            headers={
-                'content-type': 'application/json',
-                'accept': 'application/json',
-            },
-            content=self.json(exclude_none=True).encode('utf-8'),
-        )
-        raise_for_tg_response_status(http_response)
-        return http_response.content
+        content = self.json(exclude_none=True).encode('utf-8')
+        session = client.polling_session if self.long_polling and client.polling_session else client.session
+
+        def post() -> bytes:
+            http_response = session.post(
+                f'{client.api_root}{api_method}',
+                headers={
+                    'content-type': 'application/json',
+                    'accept': 'application/json',
+                },
+                content=content,
+            )
+            raise_for_tg_response_status(http_response)
+            return http_response.content
+
+        if not self.retryable or not client.retry_policy:
+            return post()
+        return client.retry_policy.call(api_method, post)
 
     async def apost_multipart_form_data(self, api_method: str, content: dict, files: dict) -> bytes:
         """Send a request to the Telegram Bot API asynchronously using the "multipart/form-data" format.
@@ -1221,6 +1242,10 @@ class GetUpdatesRequest(BaseTgRequest):
     See here https://core.telegram.org/bots/api#getupdates
     """
 
+    # Long polling recovers from errors by itself, see UpdatesPoller
+    retryable: ClassVar[bool] = False
+    long_polling: ClassVar[bool] = True
+
     offset: int | None = Field(
         default=1,
         description="Identifier of the first update to be returned.",
@@ -0,0 +1,167 @@
+import hmac
+import json
+import threading
+from collections.abc import Iterable
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Callable
+
+import httpx
+from pydantic import ValidationError
+
+from . import tg_types
+
+SECRET_TOKEN_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+MAX_BODY_SIZE = 1024 * 1024
+
+
+class WebhookServer:
+    """Lightweight HTTP server receiving updates pushed by Telegram to the webhook.
+
+    Every valid request is acknowledged immediately, the update is passed to `on_update` after the response
+    has been sent, so `on_update` should only queue the update, e.g. submit it to an update dispatcher.
+
+    Usage:
+
+        with SyncUpdateDispatcher(state_machine.process) as dispatcher:
+            with WebhookServer(dispatcher.submit, port=8080, secret_token='secret') as server:
+                server.serve_forever()
+    """
+
+    def __init__(
+            self,
+            on_update: Callable[[tg_types.Update], object],
+            *,
+            host: str = '0.0.0.0',
+            port: int = 8080,
+            path: str = '/',
+            secret_token: str | None = None,
+    ):
+        self.on_update = on_update
+        self.path = path
+        self.secret_token = secret_token
+        self.http_server = ThreadingHTTPServer((host, port), self._make_request_handler())
+        self.http_server.daemon_threads = True
+        self._thread: threading.Thread | None = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    @property
+    def url(self) -> str:
+        host, port = self.http_server.server_address[:2]
+        return f'http://{host}:{port}{self.path}'
+
+    def serve_forever(self) -> None:
+        self.http_server.serve_forever()
+
+    def start(self) -> None:
+        """Serve requests in a background thread."""
+        self._thread = threading.Thread(target=self.serve_forever, name='webhook-server', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        if self._thread:
+            self.http_server.shutdown()
+            self._thread.join()
+            self._thread = None
+        self.http_server.server_close()
+
+    def is_authorized(self, secret_token: str | None) -> bool:
+        if not self.secret_token:
+            return True
+        if secret_token is None:
+            return False
+        return hmac.compare_digest(secret_token.encode(), self.secret_token.encode())
+
+    def _make_request_handler(self) -> type[BaseHTTPRequestHandler]:
+        server = self
+
+        class WebhookRequestHandler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):  # noqa N802
+                content_length = self.get_content_length()
+                if content_length is None:
+                    return self.reply(HTTPStatus.BAD_REQUEST, close=True)
+                if content_length > MAX_BODY_SIZE:
+                    return self.reply(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, close=True)
+                # The body is read before any reply, otherwise its bytes would be parsed as the next request
+                # on the keep-alive connection
+                body = self.rfile.read(content_length)
+
+                if self.path != server.path:
+                    return self.reply(HTTPStatus.NOT_FOUND)
+                if not server.is_authorized(self.headers.get(SECRET_TOKEN_HEADER)):
+                    return self.reply(HTTPStatus.FORBIDDEN)
+                try:
+                    update = tg_types.Update.parse_raw(body)
+                except ValidationError:
+                    return self.reply(HTTPStatus.BAD_REQUEST)
+
+                self.reply(HTTPStatus.OK)
+                server.on_update(update)
+
+            def get_content_length(self) -> int | None:
+                """Return the body size or None if the header is not a non-negative integer."""
+                try:
+                    content_length = int(self.headers.get('Content-Length') or 0)
+                except ValueError:
+                    return None
+                return content_length if content_length >= 0 else None
+
+            def reply(self, status: HTTPStatus, *, close: bool = False) -> None:
+                """Send an empty response, with `close` the connection is closed as the body is not read."""
+                self.send_response(status)
+                self.send_header('Content-Length', '0')
+                if close:
+                    self.send_header('Connection', 'close')
+                    self.close_connection = True
+                self.end_headers()
+
+            def log_message(self, format, *args):  # noqa A002
+                pass
+
+        return WebhookRequestHandler
+
+
+def load_recorded_updates(path: str | Path) -> list[tg_types.Update]:
+    """Load updates recorded one JSON object per line."""
+    with open(path, encoding='utf-8') as file:
+        return [tg_types.Update.parse_raw(line) for line in file if line.strip()]
+
+
+def replay_updates(
+        url: str,
+        updates: Iterable[tg_types.Update | dict],
+        *,
+        secret_token: str | None = None,
+        session: httpx.Client | None = None,
+) -> list[int]:
+    """Post updates to the webhook the same way Telegram does. Return response status codes.
+
+    Used as a local test harness for the webhook server, pass `session` to plug in another transport.
+    """
+    headers = {'content-type': 'application/json'}
+    if secret_token:
+        headers[SECRET_TOKEN_HEADER] = secret_token
+
+    owns_session = session is None
+    session = session or httpx.Client()
+    try:
+        statuses = []
+        for update in updates:
+            if isinstance(update, tg_types.Update):
+                content = update.json(exclude_none=True, by_alias=True)
+            else:
+                content = json.dumps(update)
+            response = session.post(url, headers=headers, content=content.encode('utf-8'))
+            statuses.append(response.status_code)
+        return statuses
+    finally:
+        if owns_session:
+            session.close()
@@ -1,16 +1,196 @@
+import asyncio
 import os
+from contextlib import AbstractContextManager, closing, nullcontext
 from typing import NoReturn
 
 from bot import state_machine
-from core import SyncTgClient, GetUpdatesRequest
+from bot.env import get_env_flag
+from bot.reminders import aload_reminders, asend_reminder, load_reminders, send_reminder
+from bot.repositories import (
+    GroupCommitWriter,
+    SqlSessionRepository,
+    configure_async,
+    get_async_dsn,
+    get_dsn,
+    get_pool_options,
+)
+from core import (
+    SyncTgClient,
+    AsyncTgClient,
+    SyncUpdateDispatcher,
+    AsyncUpdateDispatcher,
+)
+from core.state_machine import UpdateDeduplicator, TimerScheduler, AsyncTimerScheduler
+from core.tg_api import (
+    DeleteWebhookRequest,
+    SetWebhookRequest,
+    WebhookServer,
+    UpdatesPoller,
+    AsyncUpdatesPoller,
+    FileOffsetStore,
+    SqliteOffsetStore,
+    OffsetCheckpointer,
+    OutboundScheduler,
+    AsyncOutboundScheduler,
+    TransportConfig,
+)
+from core.tg_api.client import DEFAULT_TG_SERVER_URL
 
 
 def run_bot() -> NoReturn:
     tg_bot_token = os.environ['TG_BOT_TOKEN']
-    with SyncTgClient.setup(tg_bot_token):
-        for update in GetUpdatesRequest().listen_updates():
-            state_machine.process(update)
+    # Every update gets its own database session, keep the pool (DB_POOL_SIZE) at least as large
+    workers = int(os.getenv('BOT_WORKERS', 8))
+    max_pending = int(os.getenv('BOT_MAX_PENDING_UPDATES', 1000))
+    checkpointer = create_offset_checkpointer()
+    poller = UpdatesPoller(checkpointer=checkpointer)
+
+    dispatcher = SyncUpdateDispatcher(
+        state_machine.process,
+        workers=workers,
+        max_pending=max_pending,
+        on_processed=poller.ack,
+        deduplicator=UpdateDeduplicator(int(os.getenv('BOT_DEDUPLICATION_WINDOW', 65536))),
+    )
+    with (
+        SyncTgClient.setup(
+            tg_bot_token,
+            tg_server_url=os.getenv('TG_SERVER_URL', DEFAULT_TG_SERVER_URL),
+            transport=get_transport_config(),
+        ),
+        OutboundScheduler.setup(**get_outbound_limits()),
+        setup_group_commit_writer(),
+        setup_session_writer(),
+        TimerScheduler.setup(send_reminder, load=load_reminders, **get_reminder_options()),
+        setup_offset_checkpointer(checkpointer),
+        dispatcher,
+    ):
+        if webhook_url := os.getenv('BOT_WEBHOOK_URL'):
+            secret_token = os.getenv('BOT_WEBHOOK_SECRET')
+            SetWebhookRequest(url=webhook_url, secret_token=secret_token).send()
+            with create_webhook_server(dispatcher.submit, secret_token) as server:
+                server.serve_forever()
+        else:
+            DeleteWebhookRequest().send()
+            for update in poller.listen_updates():
+                dispatcher.submit(update)
+
+
+async def arun_bot() -> NoReturn:
+    tg_bot_token = os.environ['TG_BOT_TOKEN']
+    workers = int(os.getenv('BOT_WORKERS', 64))
+    max_pending = int(os.getenv('BOT_MAX_PENDING_UPDATES', 1000))
+    checkpointer = create_offset_checkpointer()
+    poller = AsyncUpdatesPoller(checkpointer=checkpointer)
+
+    dispatcher = AsyncUpdateDispatcher(
+        state_machine.aprocess,
+        workers=workers,
+        max_pending=max_pending,
+        on_processed=poller.ack,
+        deduplicator=UpdateDeduplicator(int(os.getenv('BOT_DEDUPLICATION_WINDOW', 65536))),
+    )
+    database = configure_async(get_async_dsn(get_dsn()), **get_pool_options())
+    # Writer threads commit writes of the async handlers too
+    with setup_group_commit_writer(), setup_session_writer(), setup_offset_checkpointer(checkpointer):
+        async with (
+            AsyncTgClient.setup(
+                tg_bot_token,
+                tg_server_url=os.getenv('TG_SERVER_URL', DEFAULT_TG_SERVER_URL),
+                transport=get_transport_config(),
+            ),
+            AsyncOutboundScheduler.setup(**get_outbound_limits()),
+            AsyncTimerScheduler.setup(asend_reminder, load=aload_reminders, **get_reminder_options()),
+            dispatcher,
+        ):
+            if webhook_url := os.getenv('BOT_WEBHOOK_URL'):
+                secret_token = os.getenv('BOT_WEBHOOK_SECRET')
+                await SetWebhookRequest(url=webhook_url, secret_token=secret_token).asend()
+                loop = asyncio.get_running_loop()
+                with create_webhook_server(
+                    lambda update: asyncio.run_coroutine_threadsafe(dispatcher.submit(update), loop),
+                    secret_token,
+                ) as server:
+                    await asyncio.to_thread(server.serve_forever)
+            else:
+                await DeleteWebhookRequest().asend()
+                async for update in poller.alisten_updates():
+                    await dispatcher.submit(update)
+    await database.dispose()
+
+
+def get_transport_config() -> TransportConfig:
+    return TransportConfig(
+        max_connections=int(os.getenv('BOT_HTTP_MAX_CONNECTIONS', 100)),
+        max_keepalive_connections=int(os.getenv('BOT_HTTP_MAX_KEEPALIVE_CONNECTIONS', 20)),
+        read_timeout=float(os.getenv('BOT_HTTP_READ_TIMEOUT', 10)),
+        http2=get_env_flag('BOT_HTTP2'),
+    )
+
+
+def setup_group_commit_writer() -> AbstractContextManager:
+    if not get_env_flag('DB_GROUP_COMMIT'):
+        return nullcontext()
+    return GroupCommitWriter.setup(
+        max_batch_size=int(os.getenv('DB_GROUP_COMMIT_MAX_BATCH_SIZE', 128)),
+        max_delay=float(os.getenv('DB_GROUP_COMMIT_MAX_DELAY', 0.005)),
+    )
+
+
+def setup_session_writer() -> AbstractContextManager:
+    if not isinstance(state_machine.session_repository, SqlSessionRepository):
+        return nullcontext()
+    return state_machine.session_repository.write_behind()
+
+
+def get_outbound_limits() -> dict:
+    return {
+        'global_rate': float(os.getenv('BOT_OUTBOUND_GLOBAL_RATE', 30)),
+        'chat_rate': float(os.getenv('BOT_OUTBOUND_CHAT_RATE', 1)),
+        'chat_burst': float(os.getenv('BOT_OUTBOUND_CHAT_BURST', 3)),
+    }
+
+
+def get_reminder_options() -> dict:
+    # Only reminders of the window are kept in memory, the next window is loaded when half of it has passed
+    return {
+        'window': float(os.getenv('BOT_REMINDERS_WINDOW', 3600)),
+        'tick': float(os.getenv('BOT_REMINDERS_TICK', 1)),
+    }
+
+
+def create_offset_checkpointer() -> OffsetCheckpointer | None:
+    path = os.getenv('BOT_OFFSET_STORE_PATH')
+    if not path:
+        return None
+    if path.endswith(('.db', '.sqlite', '.sqlite3')):
+        store = SqliteOffsetStore(path)
+    else:
+        store = FileOffsetStore(path)
+    return OffsetCheckpointer(
+        store,
+        every_updates=int(os.getenv('BOT_OFFSET_CHECKPOINT_UPDATES', 100)),
+        every_seconds=float(os.getenv('BOT_OFFSET_CHECKPOINT_SECONDS', 5)),
+    )
+
+
+def setup_offset_checkpointer(checkpointer: OffsetCheckpointer | None) -> AbstractContextManager:
+    # Closed after the dispatcher has drained, so the updates acknowledged while draining are saved too
+    return closing(checkpointer) if checkpointer else nullcontext()
+
+
+def create_webhook_server(on_update, secret_token: str | None) -> WebhookServer:
+    return WebhookServer(
+        on_update,
+        host=os.getenv('BOT_WEBHOOK_HOST', '0.0.0.0'),
+        port=int(os.getenv('BOT_WEBHOOK_PORT', 8080)),
+        path=os.getenv('BOT_WEBHOOK_PATH', '/'),
+        secret_token=secret_token,
+    )
 
 
 if __name__ == '__main__':
-    run_bot()
+    if get_env_flag('BOT_ASYNC_RUNTIME'):
+        asyncio.run(arun_bot())
+    else:
+        run_bot()